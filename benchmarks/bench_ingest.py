@@ -0,0 +1,103 @@
+"""Compare product ingestion paths of analyze_report_async.
+
+Usage: python benchmarks/bench_ingest.py [--products N] [--batch-size N] [--output results.json]
+
+Runs against a separate "<POSTGRES_DB>_bench" database, every path is rolled back after the run.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import BenchResult, create_bench_database, write_results
+from report_generator import DEFAULT_REPORT_DATE as BENCH_REPORT_DATE
+from sqlalchemy import text, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AnalyzeRequest, Product
+from partitions import product_partitions
+from categories import category_ids
+from product_batch import ProductBatch
+from service import insert_products
+
+
+def generate_products(count: int) -> list[dict]:
+    rnd = random.Random(42)
+    return [
+        {
+            "name": f"Product {i}",
+            "quantity": rnd.randint(1, 1000),
+            "price": round(rnd.uniform(1, 1000), 2),
+            "category": f"Category {rnd.randint(1, 50)}",
+        }
+        for i in range(count)
+    ]
+
+
+async def get_product_rows(session: AsyncSession, request_id: int, products: list[dict]) -> list[dict]:
+    ids = await category_ids.ensure(session.bind, [product["category"] for product in products])
+    return [
+        {
+            "request_id": request_id, "report_date": BENCH_REPORT_DATE, "name": product["name"],
+            "quantity": product["quantity"], "price": product["price"], "category_id": ids[product["category"]],
+        }
+        for product in products
+    ]
+
+
+async def ingest_orm(session: AsyncSession, request_id: int, products: list[dict], batch_size: int):
+    for row in await get_product_rows(session, request_id, products):
+        session.add(Product(**row))
+    await session.flush()
+
+
+async def ingest_bulk_insert(session: AsyncSession, request_id: int, products: list[dict], batch_size: int):
+    for start in range(0, len(products), batch_size):
+        batch = products[start:start + batch_size]
+        await session.execute(insert(Product), await get_product_rows(session, request_id, batch))
+
+
+async def ingest_copy(session: AsyncSession, request_id: int, products: ProductBatch, batch_size: int):
+    for batch in products.chunks(batch_size):
+        await insert_products(session, request_id, batch, BENCH_REPORT_DATE)
+
+
+async def run(products_count: int, batch_size: int, output: str | None):
+    engine, session_maker = await create_bench_database()
+    await product_partitions.ensure(engine, BENCH_REPORT_DATE)
+
+    async with session_maker() as session:
+        request = AnalyzeRequest(report_url="http://example.com/bench.xml")
+        session.add(request)
+        await session.commit()
+
+    products = generate_products(products_count)
+    # the parser hands batches of products to the copy path
+    product_batch = ProductBatch.from_dicts(products)
+    print(f"{products_count} products, batch size {batch_size}")
+    results = []
+    for name, ingest, ingested in (
+            ("orm add", ingest_orm, products),
+            ("bulk insert", ingest_bulk_insert, products),
+            ("copy", ingest_copy, product_batch),
+    ):
+        async with session_maker() as session:
+            await session.execute(text("SELECT 1"))
+            started = time.perf_counter()
+            await ingest(session, request.id, ingested, batch_size)
+            elapsed = time.perf_counter() - started
+            await session.rollback()
+        results.append(BenchResult(name, elapsed, products_count))
+        print(results[-1])
+
+    await engine.dispose()
+    if output:
+        write_results(output, "ingest", {"products": products_count, "batch_size": batch_size}, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+    asyncio.run(run(args.products, args.batch_size, args.output))
@@ -0,0 +1,65 @@
+"""Compare the report parser engines on the same synthetic report.
+
+Usage: python benchmarks/bench_parsers.py [--products N] [--categories N] [--malformed-rate R] [--repeat N]
+       [--output results.json]
+
+Every engine parses the report --repeat times, the best run is kept. No database is needed.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from contextlib import aclosing
+
+from common import BenchResult, write_results
+from report_generator import write_sales_report
+from utils import REPORT_PARSERS, create_sales_report_parser, parse_sales_report_stream, stream_report_file
+
+
+async def bench_parser(name: str, report_path: str, report_size: int, repeat: int) -> BenchResult:
+    best = None
+    for _ in range(repeat):
+        parser = create_sales_report_parser(name)
+        started = time.perf_counter()
+        async with aclosing(parse_sales_report_stream(stream_report_file(report_path), parser)) as report_products:
+            async for _ in report_products:
+                pass
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return BenchResult(
+        f"parse {name}", best, parser.products_count, report_size, params={"engine": type(parser).__name__}
+    )
+
+
+async def run(args: argparse.Namespace):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_path = os.path.join(tmp_dir, "report.xml")
+        stats = write_sales_report(
+            report_path, args.products, categories=args.categories, malformed_rate=args.malformed_rate,
+            seed=args.seed,
+        )
+        print(f"{stats.products} products ({stats.malformed} malformed), {stats.size} bytes")
+        results = [await bench_parser(name, report_path, stats.size, args.repeat) for name in REPORT_PARSERS]
+
+    for result in results:
+        print(result)
+    baseline = results[0]
+    for result in results[1:]:
+        print(f"{result.name} speedup over {baseline.name}: {baseline.seconds / result.seconds:.2f}x")
+    if args.output:
+        write_results(args.output, "parsers", vars(args), results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON file for the results")
+    # malformed products are logged one by one
+    logging.disable(logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
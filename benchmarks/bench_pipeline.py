@@ -0,0 +1,140 @@
+"""Benchmark the whole analysis of reports, from the download to the finished request.
+
+Usage: python benchmarks/bench_pipeline.py [--products N] [--requests N] [--concurrency N] [--staged]
+       [--llm-latency S] [--output results.json]
+
+Reports are served by a local HTTP stub and Claude is replaced with a fake answering after --llm-latency
+seconds, so only the service itself is measured. Every request gets its own report date, which keeps
+the prompts and report hashes apart. Runs against a separate "<POSTGRES_DB>_bench" database.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from aiohttp import web
+from sqlalchemy import select, func
+
+from common import BenchResult, create_bench_database, write_results
+from report_generator import write_sales_report, DEFAULT_REPORT_DATE
+from models import AnalyzeRequest
+from utils import start_http_session, close_http_session
+from config import REPORT_CHUNK_SIZE
+import tasks
+
+
+def get_report_date(number: int):
+    return DEFAULT_REPORT_DATE + timedelta(days=number)
+
+
+def create_report_server(report_path: str) -> web.Application:
+    async def get_report(request: web.Request) -> web.StreamResponse:
+        report_date = get_report_date(int(request.match_info["number"]))
+        response = web.StreamResponse(headers={"Content-Type": "application/xml"})
+        await response.prepare(request)
+        with open(report_path, "rb") as file:
+            header = file.read(REPORT_CHUNK_SIZE)
+            await response.write(header.replace(
+                DEFAULT_REPORT_DATE.isoformat().encode(), report_date.isoformat().encode(), 1
+            ))
+            while chunk := file.read(REPORT_CHUNK_SIZE):
+                await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/reports/{number}.xml", get_report)
+    return app
+
+
+def create_fake_claude(latency: float):
+    async def get_claude_result(prompt: str) -> str:
+        await asyncio.sleep(latency)
+        return "Benchmark analysis"
+    return get_claude_result
+
+
+async def analyze_staged(request_id: int):
+    fetched = await tasks.fetch_report_async(request_id)
+    ingested = await tasks.ingest_report_async(fetched)
+    return await tasks.analyze_prompt_async(ingested)
+
+
+async def run(args: argparse.Namespace):
+    engine, session_maker = await create_bench_database()
+    tasks.async_session_maker = session_maker
+    tasks.get_claude_result = create_fake_claude(args.llm_latency)
+    analyze = analyze_staged if args.staged else tasks.analyze_report_async
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_path = os.path.join(tmp_dir, "report.xml")
+        stats = write_sales_report(
+            report_path, args.products, categories=args.categories, malformed_rate=args.malformed_rate,
+            seed=args.seed,
+        )
+        print(f"{args.requests} reports of {stats.products} products ({stats.malformed} malformed), "
+              f"{stats.size} bytes")
+
+        runner = web.AppRunner(create_report_server(report_path))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        await start_http_session()
+
+        async with session_maker() as session:
+            requests = [
+                AnalyzeRequest(report_url=f"http://127.0.0.1:{port}/reports/{number}.xml")
+                for number in range(args.requests)
+            ]
+            session.add_all(requests)
+            await session.commit()
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def analyze_limited(request_id: int):
+            async with semaphore:
+                return await analyze(request_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(analyze_limited(request.id) for request in requests))
+        elapsed = time.perf_counter() - started
+
+        await close_http_session()
+        await runner.cleanup()
+
+    async with session_maker() as session:
+        finished = await session.execute(
+            select(func.count()).filter(AnalyzeRequest.status == AnalyzeRequest.STATUS_FINISHED)
+        )
+        finished = finished.scalar_one()
+    await engine.dispose()
+
+    results = [
+        BenchResult("pipeline requests", elapsed, finished, params={"staged": args.staged}),
+        BenchResult("pipeline products", elapsed, finished * stats.valid_products, finished * stats.size),
+    ]
+    print(f"{finished} of {args.requests} requests finished")
+    for result in results:
+        print(result)
+    if args.output:
+        write_results(args.output, "pipeline", vars(args), results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--staged", action="store_true", help="run the fetch, ingest and analyze stages one by one")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--output", help="JSON file for the results")
+    # malformed products are logged one by one
+    logging.disable(logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,121 @@
+"""Benchmark every stage of report analysis on a synthetic report.
+
+Usage: python benchmarks/bench_stages.py [--products N] [--categories N] [--malformed-rate R] [--output results.json]
+
+Stages: report generation, parsing, on the fly aggregation, product ingestion with COPY and the
+service.py aggregates over the ingested products. Runs against a separate "<POSTGRES_DB>_bench" database.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from contextlib import aclosing
+
+from common import BenchResult, create_bench_database, write_results
+from report_generator import write_sales_report, DEFAULT_REPORT_DATE
+from models import AnalyzeRequest
+from metrics import Stopwatch
+from partitions import product_partitions
+from product_batch import ProductBatch
+from service import insert_products, get_total_revenue, get_top3_products, get_categories_distribution
+from utils import create_sales_report_parser, ReportAggregator, parse_sales_report_stream, stream_report_file
+from config import PRODUCT_BATCH_SIZE
+
+
+async def bench_parse(report_path: str, report_size: int) -> BenchResult:
+    parser = create_sales_report_parser()
+    started = time.perf_counter()
+    async with aclosing(parse_sales_report_stream(stream_report_file(report_path), parser)) as report_products:
+        async for _ in report_products:
+            pass
+    return BenchResult("parse", time.perf_counter() - started, parser.products_count, report_size)
+
+
+async def bench_aggregate(report_path: str) -> BenchResult:
+    parser = create_sales_report_parser()
+    aggregator = ReportAggregator(top_size=100)
+    timer = Stopwatch()
+    async with aclosing(parse_sales_report_stream(stream_report_file(report_path), parser)) as report_products:
+        async for products in report_products:
+            with timer.measure():
+                aggregator.add(products)
+    return BenchResult("aggregate", timer.seconds, aggregator.products_count)
+
+
+async def bench_ingest(session_maker, report_path: str, batch_size: int) -> tuple[BenchResult, int]:
+    async with session_maker() as session:
+        request = AnalyzeRequest(report_url="http://example.com/bench.xml")
+        session.add(request)
+        await session.commit()
+
+        parser = create_sales_report_parser()
+        timer = Stopwatch()
+        batch = ProductBatch()
+        async with aclosing(parse_sales_report_stream(stream_report_file(report_path), parser)) as report_products:
+            async for products in report_products:
+                batch.extend(products)
+                if len(batch) >= batch_size:
+                    with timer.measure():
+                        await insert_products(session, request.id, batch, DEFAULT_REPORT_DATE)
+                    batch = ProductBatch()
+        with timer.measure():
+            await insert_products(session, request.id, batch, DEFAULT_REPORT_DATE)
+            await session.commit()
+    return BenchResult("ingest copy", timer.seconds, parser.products_count), request.id
+
+
+async def bench_service_aggregates(session_maker, request_id: int, products_count: int) -> list[BenchResult]:
+    results = []
+    for name, aggregate in (
+            ("total revenue", get_total_revenue),
+            ("top3 products", get_top3_products),
+            ("categories", get_categories_distribution),
+    ):
+        async with session_maker() as session:
+            started = time.perf_counter()
+            await aggregate(session, request_id, DEFAULT_REPORT_DATE)
+            results.append(BenchResult(name, time.perf_counter() - started, products_count))
+    return results
+
+
+async def run(args: argparse.Namespace):
+    engine, session_maker = await create_bench_database()
+    await product_partitions.ensure(engine, DEFAULT_REPORT_DATE)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_path = os.path.join(tmp_dir, "report.xml")
+        started = time.perf_counter()
+        stats = write_sales_report(
+            report_path, args.products, categories=args.categories, malformed_rate=args.malformed_rate,
+            seed=args.seed,
+        )
+        results.append(BenchResult("generate", time.perf_counter() - started, stats.products, stats.size))
+        print(f"{stats.products} products ({stats.malformed} malformed), {stats.size} bytes")
+
+        results.append(await bench_parse(report_path, stats.size))
+        results.append(await bench_aggregate(report_path))
+        ingest_result, request_id = await bench_ingest(session_maker, report_path, args.batch_size)
+        results.append(ingest_result)
+    results.extend(await bench_service_aggregates(session_maker, request_id, stats.valid_products))
+    await engine.dispose()
+
+    for result in results:
+        print(result)
+    if args.output:
+        write_results(args.output, "stages", vars(args), results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=PRODUCT_BATCH_SIZE)
+    parser.add_argument("--output", help="JSON file for the results")
+    # malformed products are logged one by one
+    logging.disable(logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
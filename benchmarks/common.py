@@ -0,0 +1,80 @@
+"""Shared pieces of the benchmarks: the benchmark database and machine-readable results."""
+import json
+import platform
+import subprocess
+import sys
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
+from config import DATABASE_TEST_URL, PG_DB
+from models import Base
+
+PG_BENCH_DB = f"{PG_DB}_bench"
+
+
+async def create_bench_database() -> tuple[AsyncEngine, async_sessionmaker]:
+    """Recreate the "<POSTGRES_DB>_bench" database with the service schema."""
+    postgres_engine = create_async_engine(DATABASE_TEST_URL, isolation_level="AUTOCOMMIT")
+    async with postgres_engine.connect() as conn:
+        await conn.execute(text(f"DROP DATABASE IF EXISTS {PG_BENCH_DB}"))
+        await conn.execute(text(f"CREATE DATABASE {PG_BENCH_DB}"))
+    await postgres_engine.dispose()
+
+    engine = create_async_engine(DATABASE_TEST_URL + PG_BENCH_DB)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+@dataclass
+class BenchResult:
+    name: str
+    seconds: float
+    items: int = 0
+    bytes: int = 0
+    params: dict = field(default_factory=dict)
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "items_per_second": self.items_per_second}
+
+    def __str__(self):
+        line = f"{self.name:>20}: {self.seconds:8.3f}s"
+        if self.items:
+            line += f" {self.items_per_second:12.0f} items/s"
+        if self.bytes:
+            line += f" {self.bytes / self.seconds / 2 ** 20:8.1f} MiB/s"
+        return line
+
+
+def get_git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, benchmark: str, params: dict, results: list[BenchResult]):
+    """Save results as JSON together with what they were measured on, to compare versions."""
+    document = {
+        "benchmark": benchmark,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": get_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": [result.to_dict() for result in results],
+    }
+    with open(path, "w") as file:
+        json.dump(document, file, indent=2)
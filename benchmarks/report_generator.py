@@ -0,0 +1,101 @@
+"""Deterministic synthetic sales reports for the benchmarks.
+
+Usage: python benchmarks/report_generator.py OUTPUT [--products N] [--categories N] [--malformed-rate R] [--seed N]
+
+The same arguments always produce the same document. Reports are generated chunk by chunk,
+so 10M products don't have to fit into memory.
+"""
+import argparse
+import random
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterator
+
+DEFAULT_REPORT_DATE = date(2024, 1, 1)
+PRODUCTS_PER_CHUNK = 1000
+
+# kinds of broken products, every one is skipped by the parser
+MALFORMED_PRODUCTS = (
+    '<product><name>{name}</name><quantity>many</quantity><price>{price}</price>'
+    '<category>{category}</category></product>',
+    '<product><name>{name}</name><quantity>{quantity}</quantity><category>{category}</category></product>',
+    '<product><quantity>{quantity}</quantity><price>{price}</price><category>{category}</category></product>',
+)
+PRODUCT = (
+    '<product><name>{name}</name><quantity>{quantity}</quantity><price>{price}</price>'
+    '<category>{category}</category></product>'
+)
+
+
+@dataclass
+class ReportStats:
+    """What the generated report holds, to check the parser and the database against it."""
+    products: int = 0
+    malformed: int = 0
+    size: int = 0
+    total_revenue: float = 0.0
+
+    @property
+    def valid_products(self) -> int:
+        return self.products - self.malformed
+
+
+def generate_sales_report(
+        products: int, categories: int = 50, malformed_rate: float = 0.0, seed: int = 42,
+        report_date: date = DEFAULT_REPORT_DATE, stats: ReportStats | None = None,
+) -> Iterator[bytes]:
+    """Yield a sales_data document in chunks of PRODUCTS_PER_CHUNK products.
+
+    About malformed_rate of the products are broken, categories is the number of distinct categories.
+    """
+    rnd = random.Random(seed)
+    stats = stats if stats is not None else ReportStats()
+    header = f'<?xml version="1.0" encoding="UTF-8"?>\n<sales_data date="{report_date.isoformat()}"><products>'.encode()
+    stats.size += len(header)
+    yield header
+
+    for start in range(0, products, PRODUCTS_PER_CHUNK):
+        chunk = []
+        for i in range(start, min(start + PRODUCTS_PER_CHUNK, products)):
+            quantity = rnd.randint(1, 1000)
+            price = round(rnd.uniform(1, 1000), 2)
+            values = {
+                'name': f'Product {i}', 'quantity': quantity, 'price': price,
+                'category': f'Category {rnd.randrange(categories)}',
+            }
+            if malformed_rate and rnd.random() < malformed_rate:
+                chunk.append(MALFORMED_PRODUCTS[stats.malformed % len(MALFORMED_PRODUCTS)].format(**values))
+                stats.malformed += 1
+            else:
+                chunk.append(PRODUCT.format(**values))
+                stats.total_revenue += quantity * price
+            stats.products += 1
+        data = ''.join(chunk).encode()
+        stats.size += len(data)
+        yield data
+
+    footer = b'</products></sales_data>\n'
+    stats.size += len(footer)
+    yield footer
+
+
+def write_sales_report(path: str, products: int, **kwargs) -> ReportStats:
+    stats = ReportStats()
+    with open(path, 'wb') as file:
+        for chunk in generate_sales_report(products, stats=stats, **kwargs):
+            file.write(chunk)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    report_stats = write_sales_report(
+        args.output, args.products, categories=args.categories, malformed_rate=args.malformed_rate, seed=args.seed
+    )
+    print(f"{report_stats.products} products ({report_stats.malformed} malformed), {report_stats.size} bytes")
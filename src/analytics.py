@@ -0,0 +1,134 @@
+from datetime import date, timedelta
+from typing import Sequence
+from sqlalchemy import select, func, or_, and_, Row
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from metrics import AGGREGATE_QUERY_SECONDS
+from models import SalesRollup, CategoryRollup, ProductRollup
+from partitions import get_month_bounds
+
+PERIODS = (SalesRollup.PERIOD_DAY, SalesRollup.PERIOD_MONTH)
+
+
+def get_period_start(period: str, report_date: date) -> date:
+    return report_date.replace(day=1) if period == SalesRollup.PERIOD_MONTH else report_date
+
+
+async def add_report_to_rollups(
+        session: AsyncSession, report_date: date, products_count: int, total_revenue: float,
+        categories: dict[str, int], category_revenue: dict[str, float], top_products: Sequence[tuple[str, int]],
+):
+    """Add metrics of a finished report to the daily and monthly rollups.
+
+    Rows are upserted in key order, so concurrent workers lock them in the same order. Call it right before
+    the commit, the rows stay locked until then.
+    """
+    with AGGREGATE_QUERY_SECONDS.labels('rollups').time():
+        for period in PERIODS:
+            period_start = get_period_start(period, report_date)
+            statement = insert(SalesRollup).values(
+                period=period, period_start=period_start, reports_count=1,
+                products_count=products_count, total_revenue=total_revenue,
+            )
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[SalesRollup.period, SalesRollup.period_start],
+                set_={
+                    'reports_count': SalesRollup.reports_count + 1,
+                    'products_count': SalesRollup.products_count + statement.excluded.products_count,
+                    'total_revenue': SalesRollup.total_revenue + statement.excluded.total_revenue,
+                },
+            ))
+
+            if categories:
+                statement = insert(CategoryRollup).values([
+                    {
+                        'period': period, 'period_start': period_start, 'category': category,
+                        'quantity': categories[category], 'revenue': category_revenue.get(category, 0.0),
+                    }
+                    for category in sorted(categories)
+                ])
+                await session.execute(statement.on_conflict_do_update(
+                    index_elements=[CategoryRollup.period, CategoryRollup.period_start, CategoryRollup.category],
+                    set_={
+                        'quantity': CategoryRollup.quantity + statement.excluded.quantity,
+                        'revenue': CategoryRollup.revenue + statement.excluded.revenue,
+                    },
+                ))
+
+            quantities: dict[str, int] = {}
+            for name, quantity in top_products:
+                quantities[name] = quantities.get(name, 0) + quantity
+            if quantities:
+                statement = insert(ProductRollup).values([
+                    {'period': period, 'period_start': period_start, 'name': name, 'quantity': quantities[name]}
+                    for name in sorted(quantities)
+                ])
+                await session.execute(statement.on_conflict_do_update(
+                    index_elements=[ProductRollup.period, ProductRollup.period_start, ProductRollup.name],
+                    set_={'quantity': ProductRollup.quantity + statement.excluded.quantity},
+                ))
+
+
+def filter_rollup_range(model, date_from: date, date_to: date):
+    """Rows covering [date_from, date_to]: monthly rows for whole months, daily rows for the rest."""
+    first_month = date_from if date_from.day == 1 else get_month_bounds(date_from)[1]
+    month_start, next_month = get_month_bounds(date_to)
+    end_month = next_month if next_month - timedelta(days=1) == date_to else month_start
+
+    if first_month >= end_month:
+        return and_(model.period == SalesRollup.PERIOD_DAY, model.period_start.between(date_from, date_to))
+
+    return or_(
+        and_(model.period == SalesRollup.PERIOD_MONTH, model.period_start >= first_month,
+             model.period_start < end_month),
+        and_(model.period == SalesRollup.PERIOD_DAY, model.period_start >= date_from,
+             model.period_start < first_month),
+        and_(model.period == SalesRollup.PERIOD_DAY, model.period_start >= end_month,
+             model.period_start <= date_to),
+    )
+
+
+async def get_revenue_trend(
+        session: AsyncSession, period: str, date_from: date, date_to: date
+) -> Sequence[SalesRollup]:
+    with AGGREGATE_QUERY_SECONDS.labels('revenue_trend').time():
+        rollups = await session.execute(
+            select(SalesRollup).filter(
+                SalesRollup.period == period,
+                SalesRollup.period_start.between(get_period_start(period, date_from), date_to),
+            ).order_by(SalesRollup.period_start)
+        )
+    return rollups.scalars().all()
+
+
+async def get_categories_mix(
+        session: AsyncSession, date_from: date, date_to: date
+) -> Sequence[Row[tuple[str, int, float]]]:
+    with AGGREGATE_QUERY_SECONDS.labels('categories_mix').time():
+        categories = await session.execute(
+            select(
+                CategoryRollup.category, func.sum(CategoryRollup.quantity), func.sum(CategoryRollup.revenue)
+            ).filter(
+                filter_rollup_range(CategoryRollup, date_from, date_to)
+            ).group_by(
+                CategoryRollup.category
+            ).order_by(CategoryRollup.category)
+        )
+    return categories.all()
+
+
+async def get_top_products(
+        session: AsyncSession, date_from: date, date_to: date, limit: int
+) -> Sequence[Row[tuple[str, int]]]:
+    quantity = func.sum(ProductRollup.quantity)
+    with AGGREGATE_QUERY_SECONDS.labels('top_products').time():
+        top_products = await session.execute(
+            select(
+                ProductRollup.name, quantity
+            ).filter(
+                filter_rollup_range(ProductRollup, date_from, date_to)
+            ).group_by(
+                ProductRollup.name
+            ).order_by(quantity.desc(), ProductRollup.name).limit(limit)
+        )
+    return top_products.all()
@@ -0,0 +1,54 @@
+import logging
+from typing import Iterable
+from sqlalchemy import select, func, literal, any_
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.types import Text
+from models import Category
+
+logger = logging.getLogger('celery')
+
+
+class CategoryIds:
+    """Ids of the category dimension by name, shared by all ingests of the process.
+
+    Unknown categories are created in bulk in their own short transaction, like product partitions: their ids
+    are cached right away, so the rows must not go away with a rolled back ingest. Workers load the known
+    categories on startup, after that a batch of products usually needs no query at all.
+    """
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    async def ensure(self, engine: AsyncEngine, names: Iterable[str | None]) -> dict[str, int]:
+        """Ids of all cached categories, including the given names. None has no id, products need a category."""
+        missing = set(names).difference(self._ids)
+        missing.discard(None)
+        if not missing:
+            return self._ids
+
+        names = literal(sorted(missing), ARRAY(Text))
+        async with engine.begin() as conn:
+            # rows are inserted in name order, so concurrent ingests of overlapping categories can't deadlock
+            await conn.execute(
+                insert(Category).from_select([Category.name], select(func.unnest(names)))
+                .on_conflict_do_nothing(index_elements=[Category.name])
+            )
+            rows = await conn.execute(select(Category.id, Category.name).filter(Category.name == any_(names)))
+            self._ids.update({name: category_id for category_id, name in rows})
+        return self._ids
+
+    async def warm(self, engine: AsyncEngine):
+        async with engine.connect() as conn:
+            rows = await conn.execute(select(Category.id, Category.name))
+            self._ids.update({name: category_id for category_id, name in rows})
+        logger.info(f'{len(self._ids)} category ids loaded')
+
+    def clear(self):
+        self._ids.clear()
+
+
+category_ids = CategoryIds()
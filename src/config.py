@@ -1,5 +1,6 @@
 import logging
 import os
+import tempfile
 from logging.config import dictConfig
 
 PG_USER = os.getenv("POSTGRES_USER")
@@ -10,8 +11,52 @@ PG_DB = os.getenv("POSTGRES_DB")
 PG_TEST_DB = f"{PG_DB}_test"
 DATABASE_URL = f'postgresql+asyncpg://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}'
 DATABASE_TEST_URL = f'postgresql+asyncpg://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/'
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
 RABBITMQ_URL = os.getenv("RABBITMQ_URL")
+WORKER_POOL = os.getenv("WORKER_POOL", "prefork")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 0)) or None
+# celery kills a pool process that doesn't start within worker_proc_alive_timeout (4 s)
+CATEGORY_WARM_TIMEOUT = float(os.getenv("CATEGORY_WARM_TIMEOUT", 2))
+PIPELINE_STAGED = os.getenv("PIPELINE_STAGED", "false").lower() in ("1", "true", "yes")
+REPORT_IO_QUEUE = os.getenv("REPORT_IO_QUEUE", "reports_io")
+REPORT_CPU_QUEUE = os.getenv("REPORT_CPU_QUEUE", "reports_cpu")
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 0))
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-haiku-20240307")
+CLAUDE_MAX_TOKENS = int(os.getenv("CLAUDE_MAX_TOKENS", 1000))
+CLAUDE_REQUESTS_PER_MINUTE = int(os.getenv("CLAUDE_REQUESTS_PER_MINUTE", 0))
+CLAUDE_TOKENS_PER_MINUTE = int(os.getenv("CLAUDE_TOKENS_PER_MINUTE", 0))
+CLAUDE_MAX_IN_FLIGHT = int(os.getenv("CLAUDE_MAX_IN_FLIGHT", 8))
+CLAUDE_MAX_RETRIES = int(os.getenv("CLAUDE_MAX_RETRIES", 5))
+CLAUDE_BACKOFF_BASE = float(os.getenv("CLAUDE_BACKOFF_BASE", 1))
+CLAUDE_BACKOFF_MAX = float(os.getenv("CLAUDE_BACKOFF_MAX", 60))
+LLM_BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", 10_000))
+LLM_BATCH_SUBMIT_INTERVAL = float(os.getenv("LLM_BATCH_SUBMIT_INTERVAL", 5 * 60))
+LLM_BATCH_POLL_INTERVAL = float(os.getenv("LLM_BATCH_POLL_INTERVAL", 60))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 60 * 60))
+LLM_CACHE_MAX_SIZE = int(os.getenv("LLM_CACHE_MAX_SIZE", 1024))
+LLM_CACHE_DB_MAX_ROWS = int(os.getenv("LLM_CACHE_DB_MAX_ROWS", 100_000))
+REPORT_CHUNK_SIZE = int(os.getenv("REPORT_CHUNK_SIZE", 64 * 1024))
+REPORT_MAX_SIZE = int(os.getenv("REPORT_MAX_SIZE", 1024 * 1024 * 1024))
+# "lxml" or "stdlib", lxml falls back to stdlib when it isn't installed
+REPORT_PARSER = os.getenv("REPORT_PARSER", "lxml")
+UPLOAD_REPORTS_MAX_URLS = int(os.getenv("UPLOAD_REPORTS_MAX_URLS", 50_000))
+PRODUCT_BATCH_SIZE = int(os.getenv("PRODUCT_BATCH_SIZE", 5000))
+PRODUCT_RETENTION_DAYS = int(os.getenv("PRODUCT_RETENTION_DAYS", 365))
+ROLLUP_TOP_PRODUCTS = int(os.getenv("ROLLUP_TOP_PRODUCTS", 100))
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR")
+# cached bodies beyond this size are evicted, least recently used first
+REPORT_CACHE_MAX_SIZE = int(os.getenv("REPORT_CACHE_MAX_SIZE", 10 * 1024 * 1024 * 1024))
+REPORT_UPLOAD_DIR = os.getenv("REPORT_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "uploads"))
+REPORT_SPOOL_DIR = os.getenv("REPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "reports"))
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 10))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 60))
+REQUEST_WAIT_MAX_TIMEOUT = float(os.getenv("REQUEST_WAIT_MAX_TIMEOUT", 60))
+REQUEST_POLL_INTERVAL = float(os.getenv("REQUEST_POLL_INTERVAL", 5))
+REQUEST_EVENTS_KEEPALIVE = float(os.getenv("REQUEST_EVENTS_KEEPALIVE", 15))
 LOG_DIR = '../logs'
 
 def config_logging():
@@ -0,0 +1,191 @@
+import struct
+import zlib
+from contextlib import aclosing
+from typing import AsyncIterator, Iterator
+from backports import zstd
+from config import REPORT_CHUNK_SIZE
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+ZIP_MAGIC = b'PK\x03\x04'
+ZIP_CENTRAL_DIRECTORY_MAGIC = (b'PK\x01\x02', b'PK\x05\x06')
+ZIP_LOCAL_HEADER = struct.Struct('<4s2xHH8xII2H')
+# general purpose flag of entries whose sizes follow the data instead of the header
+ZIP_DATA_DESCRIPTOR_FLAG = 0x08
+ZIP_STORED, ZIP_DEFLATED = 0, 8
+
+
+class ReportDecompressError(Exception):
+    """Compressed report is broken or uses an unsupported format."""
+
+
+class ZlibDecompressor:
+    """gzip members or a raw deflate stream, at most max_length bytes of output per step."""
+
+    def __init__(self, wbits: int, multi_member: bool = True):
+        self._wbits = wbits
+        self._multi_member = multi_member
+        self._decompressor = zlib.decompressobj(wbits)
+        self._started = False
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressor.eof
+
+    @property
+    def unused_data(self) -> bytes:
+        return self._decompressor.unused_data
+
+    def decompress(self, data: bytes, max_length: int = REPORT_CHUNK_SIZE) -> Iterator[bytes]:
+        while data:
+            if self._decompressor.eof:
+                if not self._multi_member:
+                    return
+                # concatenated gzip members make one document
+                self._decompressor = zlib.decompressobj(self._wbits)
+            self._started = True
+            while True:
+                output = self._decompressor.decompress(data, max_length)
+                yield output
+                if self._decompressor.eof:
+                    break
+                data = self._decompressor.unconsumed_tail
+                # a full output may leave more of it inside zlib even when the input is consumed
+                if not data and len(output) < max_length:
+                    break
+            data = self._decompressor.unused_data if self._decompressor.eof else b''
+
+    def finish(self):
+        if self._started and not self._decompressor.eof:
+            raise ReportDecompressError('Compressed report is truncated')
+
+
+class ZstdDecompressor:
+    """Zstandard frames, at most max_length bytes of output per step."""
+
+    def __init__(self):
+        self._decompressor = zstd.ZstdDecompressor()
+        self._started = False
+
+    def decompress(self, data: bytes, max_length: int = REPORT_CHUNK_SIZE) -> Iterator[bytes]:
+        while data or not self._decompressor.needs_input:
+            if self._decompressor.eof:
+                if not data:
+                    return
+                self._decompressor = zstd.ZstdDecompressor()
+            self._started = True
+            yield self._decompressor.decompress(data, max_length)
+            data = self._decompressor.unused_data if self._decompressor.eof else b''
+
+    def finish(self):
+        if self._started and not self._decompressor.eof:
+            raise ReportDecompressError('Compressed report is truncated')
+
+
+class ZipEntryDecompressor:
+    """The first .xml entry of a zip archive.
+
+    The archive is read front to back from the local file headers, without the central directory
+    at its end, so it doesn't have to be downloaded first.
+    """
+
+    def __init__(self):
+        self._buffer = b''
+        self._skip = 0
+        self._entry: ZlibDecompressor | None = None
+        self._stored_left: int | None = None
+        self._done = False
+
+    def decompress(self, data: bytes, max_length: int = REPORT_CHUNK_SIZE) -> Iterator[bytes]:
+        self._buffer += data
+        while self._buffer and not self._done:
+            if self._skip:
+                skipped = min(self._skip, len(self._buffer))
+                self._skip -= skipped
+                self._buffer = self._buffer[skipped:]
+            elif self._entry is not None:
+                data, self._buffer = self._buffer, b''
+                yield from self._entry.decompress(data, max_length)
+                if self._entry.eof:
+                    self._done = True
+            elif self._stored_left is not None:
+                data = self._buffer[:self._stored_left]
+                self._buffer = self._buffer[len(data):]
+                self._stored_left -= len(data)
+                self._done = not self._stored_left
+                yield data
+            elif not self._read_header():
+                return
+
+    def _read_header(self) -> bool:
+        if self._buffer[:4] in ZIP_CENTRAL_DIRECTORY_MAGIC:
+            raise ReportDecompressError('No xml report in the zip archive')
+        if len(self._buffer) < ZIP_LOCAL_HEADER.size:
+            return False
+        signature, flags, method, compressed_size, _, name_size, extra_size = ZIP_LOCAL_HEADER.unpack_from(self._buffer)
+        if signature != ZIP_MAGIC:
+            raise ReportDecompressError('Invalid zip archive')
+        header_size = ZIP_LOCAL_HEADER.size + name_size + extra_size
+        if len(self._buffer) < header_size:
+            return False
+        name = self._buffer[ZIP_LOCAL_HEADER.size:ZIP_LOCAL_HEADER.size + name_size].decode('utf-8', 'replace')
+        self._buffer = self._buffer[header_size:]
+        has_size = not flags & ZIP_DATA_DESCRIPTOR_FLAG
+
+        if not name.lower().endswith('.xml'):
+            if not has_size:
+                raise ReportDecompressError(f'Zip entry {name} has no size to skip it')
+            self._skip = compressed_size
+        elif method == ZIP_DEFLATED:
+            self._entry = ZlibDecompressor(-zlib.MAX_WBITS, multi_member=False)
+        elif method == ZIP_STORED and has_size:
+            self._stored_left = compressed_size
+            self._done = not compressed_size
+        else:
+            raise ReportDecompressError(f'Unsupported compression of zip entry {name}')
+        return True
+
+    def finish(self):
+        if not self._done:
+            raise ReportDecompressError('Zip archive is truncated or has no xml report')
+
+
+def get_decompressor(head: bytes) -> ZlibDecompressor | ZstdDecompressor | ZipEntryDecompressor | None:
+    """Decompressor of the report by its magic number, so .xml.gz, .zst and .zip reports are recognized
+    whatever the url or Content-Type says, and a body already decoded by Content-Encoding is left as is.
+    """
+    if head.startswith(GZIP_MAGIC):
+        return ZlibDecompressor(16 + zlib.MAX_WBITS)
+    if head.startswith(ZSTD_MAGIC):
+        return ZstdDecompressor()
+    if head.startswith(ZIP_MAGIC):
+        return ZipEntryDecompressor()
+    return None
+
+
+async def decompress_report_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pass report chunks through, decompressing them on the way if the report is compressed."""
+    head = b''
+    decompressor = None
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            if head is not None:
+                head += chunk
+                if len(head) < len(ZSTD_MAGIC):
+                    continue
+                chunk, head = head, None
+                decompressor = get_decompressor(chunk)
+            if decompressor is None:
+                yield chunk
+                continue
+            try:
+                for data in decompressor.decompress(chunk):
+                    if data:
+                        yield data
+            except (zlib.error, zstd.ZstdError, EOFError) as e:
+                raise ReportDecompressError(str(e)) from e
+
+    if head:
+        yield head
+    elif decompressor is not None:
+        decompressor.finish()
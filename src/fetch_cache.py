@@ -0,0 +1,212 @@
+import logging
+import os
+import tempfile
+import time
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable
+from sqlalchemy import select, exists
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import REPORT_CACHE_DIR, REPORT_CACHE_MAX_SIZE
+from models import ReportFetchCacheEntry
+from utils import stream_report, stream_report_file, ReportNotModified
+
+logger = logging.getLogger('celery')
+
+# spooled bodies of downloads interrupted by a crash
+STALE_SPOOL_AGE = 24 * 60 * 60
+
+
+class ReportFetch:
+    """Download of a report url, revalidated against the previous fetch of the same url.
+
+    The request is conditional when revalidating. On 304 the caller reuses the results of content_hash when
+    they are still there, otherwise the body kept in REPORT_CACHE_DIR is replayed.
+    """
+
+    def __init__(
+            self, url: str, entry: ReportFetchCacheEntry | None, cache_dir: str | None = REPORT_CACHE_DIR,
+            cache_max_size: int = REPORT_CACHE_MAX_SIZE,
+    ):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.cache_max_size = cache_max_size
+        # plain values, the entry expires on rollback of the task transaction
+        self.etag = entry.etag if entry else None
+        self.last_modified = entry.last_modified if entry else None
+        self.content_hash = entry.content_hash if entry else None
+        self.body_path = entry.body_path if entry else None
+        self.validators: dict[str, str | None] = {}
+        self._spool_path: str | None = None
+        self.not_modified = False
+
+    @classmethod
+    async def load(cls, session: AsyncSession, url: str) -> 'ReportFetch':
+        return cls(url, await session.get(ReportFetchCacheEntry, url))
+
+    @property
+    def cached_body_path(self) -> str | None:
+        if self.body_path and os.path.exists(self.body_path):
+            return self.body_path
+        return None
+
+    async def stream(
+            self, revalidate: bool, download: Callable[..., AsyncIterator[bytes]] = stream_report, replay: bool = True
+    ) -> AsyncIterator[bytes]:
+        """Chunks of the report body.
+
+        On 304 ReportNotModified is raised unless replay is set: a finished request of content_hash is reused
+        without reading the body at all. With replay the cached body is streamed instead, or the report is
+        downloaded again unconditionally when the body has been evicted since cached_body_path was checked.
+        """
+        headers = self._get_conditional_headers() if revalidate else None
+        try:
+            async with aclosing(self._download(download, headers)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            return
+        except ReportNotModified:
+            if not replay:
+                self.not_modified = True
+                raise
+            body_path = self._touch_cached_body()
+            if body_path:
+                self.not_modified = True
+            else:
+                logger.info(f'Cached body of {self.url} is gone, downloading it again')
+
+        if body_path:
+            chunks = stream_report_file(body_path)
+        else:
+            chunks = self._download(download, None)
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk
+
+    def _touch_cached_body(self) -> str | None:
+        """Path of the cached body, marked as recently used for the eviction."""
+        if not self.body_path:
+            return None
+        try:
+            os.utime(self.body_path)
+        except FileNotFoundError:
+            return None
+        return self.body_path
+
+    async def _download(
+            self, download: Callable[..., AsyncIterator[bytes]], headers: dict[str, str] | None
+    ) -> AsyncIterator[bytes]:
+        spool_file = None
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            spool_file = tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.part', delete=False)
+            self._spool_path = spool_file.name
+
+        completed = False
+        try:
+            async with aclosing(download(self.url, headers=headers, validators=self.validators)) as chunks:
+                async for chunk in chunks:
+                    if spool_file:
+                        spool_file.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if spool_file:
+                spool_file.close()
+                if not completed:
+                    os.unlink(self._spool_path)
+                    self._spool_path = None
+
+    async def save(self, session: AsyncSession, content_hash: str):
+        """Remember validators of the fetched body, it has to be streamed to the end first."""
+        if self.not_modified:
+            etag, last_modified = self.etag, self.last_modified
+            body_path = self.cached_body_path
+        else:
+            etag, last_modified = self.validators.get('etag'), self.validators.get('last_modified')
+            body_path = None
+
+        if self._spool_path:
+            body_path = os.path.join(self.cache_dir, f'{content_hash}.xml')
+            os.replace(self._spool_path, body_path)
+            self._spool_path = None
+            prune_report_cache(self.cache_dir, self.cache_max_size, keep=body_path)
+        if self.body_path and self.body_path != body_path:
+            await remove_unused_body(session, self.url, self.body_path)
+
+        if not etag and not last_modified and not body_path:
+            return
+
+        values = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash,
+            'body_path': body_path,
+            'updated_at': datetime.now(timezone.utc),
+        }
+        await session.execute(
+            insert(ReportFetchCacheEntry).values(url=self.url, **values).on_conflict_do_update(
+                index_elements=[ReportFetchCacheEntry.url], set_=values
+            )
+        )
+
+    def _get_conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+async def remove_unused_body(session: AsyncSession, url: str, body_path: str):
+    """Delete the previous body of url, unless another url of the same content still uses it."""
+    used = await session.scalar(select(exists().where(
+        ReportFetchCacheEntry.body_path == body_path, ReportFetchCacheEntry.url != url
+    )))
+    if not used:
+        remove_cached_body(body_path)
+
+
+def remove_cached_body(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune_report_cache(cache_dir: str, max_size: int, keep: str | None = None) -> list[str]:
+    """Evict least recently used bodies until the cache fits into max_size, drop stale spool files.
+
+    Entries of evicted bodies stay, their urls are downloaded in full on the next 304.
+    """
+    bodies = []
+    size = 0
+    now = time.time()
+    removed = []
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.part'):
+                if now - stat.st_mtime > STALE_SPOOL_AGE:
+                    remove_cached_body(entry.path)
+                    removed.append(entry.path)
+            elif entry.name.endswith('.xml'):
+                bodies.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+
+    for _, body_size, path in sorted(bodies):
+        if size <= max_size:
+            break
+        if path == keep:
+            continue
+        remove_cached_body(path)
+        removed.append(path)
+        size -= body_size
+    if removed:
+        logger.info(f'Evicted {len(removed)} files from the report cache')
+    return removed
@@ -0,0 +1,121 @@
+import logging
+from datetime import datetime, timezone
+import anthropic
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import CLAUDE_MODEL, CLAUDE_MAX_TOKENS, LLM_BATCH_MAX_SIZE
+from llm_cache import llm_cache
+from metrics import observe_llm_usage
+from models import AnalyzeRequest, LLMBatch, LLMBatchItem
+from service import get_request_by_id, notify_request_status
+from utils import client
+
+logger = logging.getLogger('celery')
+
+
+async def queue_llm_batch_item(session: AsyncSession, request_id: int, prompt: str, prompt_key: str):
+    """Leave the prompt for the next Message Batch, the request stays created until the batch has ended."""
+    session.add(LLMBatchItem(
+        request_id=request_id, prompt=prompt, prompt_key=prompt_key, created_at=datetime.now(timezone.utc)
+    ))
+
+
+async def submit_llm_batch(session: AsyncSession, max_size: int = LLM_BATCH_MAX_SIZE) -> str | None:
+    """Submit queued prompts as one Message Batch."""
+    items = await session.execute(
+        select(LLMBatchItem).filter(
+            LLMBatchItem.batch_id.is_(None)
+        ).order_by(LLMBatchItem.created_at).limit(max_size).with_for_update(skip_locked=True)
+    )
+    items = items.scalars().all()
+    if not items:
+        await session.rollback()
+        return None
+
+    try:
+        batch = await client.messages.batches.create(requests=[
+            {
+                'custom_id': str(item.request_id),
+                'params': {
+                    'model': CLAUDE_MODEL,
+                    'max_tokens': CLAUDE_MAX_TOKENS,
+                    'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': item.prompt}]}],
+                },
+            }
+            for item in items
+        ])
+    except anthropic.AnthropicError as e:
+        logger.error(f'Error submitting llm batch of {len(items)} prompts: {e}')
+        await session.rollback()
+        return None
+    session.add(LLMBatch(id=batch.id, status=LLMBatch.STATUS_IN_PROGRESS, created_at=datetime.now(timezone.utc)))
+    await session.flush()
+    for item in items:
+        item.batch_id = batch.id
+    await session.commit()
+    logger.info(f'LLM batch {batch.id} submitted with {len(items)} prompts')
+    return batch.id
+
+
+async def poll_llm_batches(session: AsyncSession) -> list[str]:
+    """Fan results of the ended batches out to their requests."""
+    batches = await session.execute(
+        select(LLMBatch).filter(LLMBatch.status == LLMBatch.STATUS_IN_PROGRESS).order_by(LLMBatch.created_at)
+    )
+    batch_ids = [batch.id for batch in batches.scalars().all()]
+    await session.commit()
+
+    ended = []
+    for batch_id in batch_ids:
+        try:
+            batch = await client.messages.batches.retrieve(batch_id)
+        except anthropic.AnthropicError as e:
+            logger.warning(f'Error polling llm batch {batch_id}: {e}')
+            continue
+        if batch.processing_status != 'ended':
+            continue
+        await process_llm_batch_results(session, batch_id)
+        ended.append(batch_id)
+    return ended
+
+
+async def process_llm_batch_results(session: AsyncSession, batch_id: str):
+    items = await session.execute(select(LLMBatchItem).filter(LLMBatchItem.batch_id == batch_id))
+    items = {item.request_id: item for item in items.scalars().all()}
+
+    results = await client.messages.batches.results(batch_id)
+    async for response in results:
+        item = items.pop(int(response.custom_id), None)
+        if item is None:
+            continue
+        llm_result = None
+        if response.result.type == 'succeeded' and response.result.message.content:
+            llm_result = response.result.message.content[0].text
+            observe_llm_usage(response.result.message.usage)
+            await llm_cache.set(session, item.prompt_key, llm_result)
+        else:
+            logger.warning(f'LLM batch {batch_id} has no result for request_id={item.request_id}: {response.result.type}')
+        await finish_llm_request(session, item.request_id, llm_result)
+
+    # requests missing from the results are not going to get one
+    for request_id in items:
+        await finish_llm_request(session, request_id, None)
+
+    await session.execute(delete(LLMBatchItem).filter(LLMBatchItem.batch_id == batch_id))
+    batch = await session.get(LLMBatch, batch_id)
+    batch.status = LLMBatch.STATUS_ENDED
+    await session.commit()
+    logger.info(f'LLM batch {batch_id} processed')
+
+
+async def finish_llm_request(session: AsyncSession, request_id: int, llm_result: str | None):
+    request = await get_request_by_id(session, request_id)
+    if request is None:
+        return
+    if llm_result:
+        request.llm_result = llm_result
+        request.status = AnalyzeRequest.STATUS_FINISHED
+    else:
+        request.status = AnalyzeRequest.STATUS_ERROR
+    await notify_request_status(session, request_id)
+
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import CLAUDE_MODEL, CLAUDE_MAX_TOKENS, LLM_CACHE_TTL, LLM_CACHE_MAX_SIZE, LLM_CACHE_DB_MAX_ROWS
+from models import LLMCacheEntry
+from metrics import LLM_CACHE_LOOKUPS
+
+logger = logging.getLogger('celery')
+
+PRUNE_INTERVAL = 100
+
+
+def get_prompt_fingerprint(prompt: str, model: str = CLAUDE_MODEL, max_tokens: int = CLAUDE_MAX_TOKENS) -> str:
+    return hashlib.sha256(f'{model}\0{max_tokens}\0{prompt}'.encode()).hexdigest()
+
+
+class LLMCache:
+    """Claude results by prompt fingerprint: in-process LRU in front of the llm_cache table.
+
+    Entries expire after ttl seconds, the LRU keeps at most max_size entries and the table is
+    pruned down to db_max_rows newest entries every PRUNE_INTERVAL writes.
+    """
+
+    def __init__(self, max_size: int, ttl: int, db_max_rows: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_max_rows = db_max_rows
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._writes = 0
+
+    async def get(self, session: AsyncSession, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry:
+            expires_at, result = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                LLM_CACHE_LOOKUPS.labels('memory_hit').inc()
+                return result
+            del self._entries[key]
+
+        expired_before = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        entry = await session.execute(
+            select(LLMCacheEntry).filter(
+                LLMCacheEntry.key == key,
+                LLMCacheEntry.created_at > expired_before,
+            )
+        )
+        entry = entry.scalar()
+        if entry is None:
+            LLM_CACHE_LOOKUPS.labels('miss').inc()
+            return None
+
+        LLM_CACHE_LOOKUPS.labels('db_hit').inc()
+        self._remember(key, entry.result, entry.created_at)
+        return entry.result
+
+    async def set(self, session: AsyncSession, key: str, result: str):
+        created_at = datetime.now(timezone.utc)
+        await session.execute(
+            insert(LLMCacheEntry).values(
+                key=key, result=result, created_at=created_at
+            ).on_conflict_do_update(
+                index_elements=[LLMCacheEntry.key],
+                set_={'result': result, 'created_at': created_at},
+            )
+        )
+        self._remember(key, result, created_at)
+
+        self._writes += 1
+        if self._writes % PRUNE_INTERVAL == 0:
+            await self.prune(session)
+
+    async def prune(self, session: AsyncSession):
+        expired_before = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        await session.execute(delete(LLMCacheEntry).filter(LLMCacheEntry.created_at <= expired_before))
+
+        oldest_kept = select(LLMCacheEntry.created_at).order_by(
+            LLMCacheEntry.created_at.desc()
+        ).offset(self.db_max_rows - 1).limit(1).scalar_subquery()
+        await session.execute(delete(LLMCacheEntry).filter(LLMCacheEntry.created_at < oldest_kept))
+
+    def clear(self):
+        self._entries.clear()
+
+    def _remember(self, key: str, result: str, created_at: datetime):
+        self._entries[key] = (created_at.timestamp() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+llm_cache = LLMCache(max_size=LLM_CACHE_MAX_SIZE, ttl=LLM_CACHE_TTL, db_max_rows=LLM_CACHE_DB_MAX_ROWS)
@@ -1,29 +1,189 @@
 import logging
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends
+from datetime import date
+from typing import AsyncIterator
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
 from sqlalchemy.ext.asyncio import AsyncSession
-from schemas import UploadReportSchema, AnalyzeRequestSchema
-from db import get_async_session, create_db_and_tables
-from service import create_analyze_request
-from config import config_logging
-from tasks import analyze_report
+from starlette.concurrency import run_in_threadpool
+from schemas import (
+    UploadReportSchema, UploadReportsSchema, AnalyzeRequestSchema, ReportSummarySchema, RollupPeriod, SalesRollupSchema,
+    CategoryMixSchema, TopProductSchema,
+)
+from db import get_async_session, create_db_and_tables, async_session_maker
+from models import AnalyzeRequest
+from analytics import get_revenue_trend, get_categories_mix, get_top_products
+from metrics import HTTP_REQUEST_SECONDS, get_latest_metrics
+from notifications import request_status_listener, wait_for_request_status
+from service import (
+    create_analyze_request, create_analyze_requests, create_uploaded_analyze_request, get_request_by_id,
+    get_report_summary,
+)
+from config import config_logging, REQUEST_WAIT_MAX_TIMEOUT, REQUEST_EVENTS_KEEPALIVE, ROLLUP_TOP_PRODUCTS
+from tasks import enqueue_analyze_report, enqueue_analyze_reports
+from uploads import ReportTooLargeError, save_uploaded_report, remove_uploaded_report
+from utils import start_http_session, close_http_session
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await create_db_and_tables()
     config_logging()
+    await start_http_session()
+    await request_status_listener.start()
     yield
+    await request_status_listener.stop()
+    await close_http_session()
 
 
 app = FastAPI(lifespan=lifespan)
 logger = logging.getLogger('fastapi')
 
 
+@app.middleware('http')
+async def observe_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # path template, so request ids don't make a time series each
+    route = request.scope.get('route')
+    HTTP_REQUEST_SECONDS.labels(
+        request.method, route.path if route else 'unmatched', response.status_code
+    ).observe(time.perf_counter() - started)
+    return response
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics of the API process, the workers expose theirs on WORKER_METRICS_PORT."""
+    return Response(get_latest_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post('/upload_report_url/', response_model=AnalyzeRequestSchema)
 async def post_upload_report_by_url(schema: UploadReportSchema, s: AsyncSession = Depends(get_async_session)):
     request = await create_analyze_request(s, schema)
     logger.info(f"Analyze request created with {request.id=}")
-    analyze_report.delay(request.id)
+    enqueue_analyze_report(request.id)
     logger.info(f"Task analyze_report started for {request.id=}")
     return request
+
+
+@app.post('/upload_report/', response_model=AnalyzeRequestSchema, openapi_extra={
+    'requestBody': {
+        'required': True,
+        'content': {'application/octet-stream': {'schema': {'type': 'string', 'format': 'binary'}}},
+    },
+})
+async def post_upload_report(request: Request, s: AsyncSession = Depends(get_async_session)):
+    """Analyze the report sent as the request body, plain or gzip, zstd, zip compressed.
+
+    The body is written to disk as it arrives and the worker reads it from there.
+    """
+    try:
+        report_path = await save_uploaded_report(request.stream())
+    except ReportTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        analyze_request = await create_uploaded_analyze_request(s, report_path)
+    except Exception:
+        remove_uploaded_report(report_path)
+        raise
+    logger.info(f"Analyze request created for uploaded report with {analyze_request.id=}")
+    enqueue_analyze_report(analyze_request.id)
+    logger.info(f"Task analyze_report started for {analyze_request.id=}")
+    return analyze_request
+
+
+@app.post('/upload_report_urls/', response_model=list[AnalyzeRequestSchema])
+async def post_upload_report_by_urls(schema: UploadReportsSchema, s: AsyncSession = Depends(get_async_session)):
+    requests = await create_analyze_requests(s, schema)
+    logger.info(f"{len(requests)} analyze requests created")
+    # publishing up to UPLOAD_REPORTS_MAX_URLS messages blocks, the event loop keeps serving the waiting clients meanwhile
+    await run_in_threadpool(
+        enqueue_analyze_reports, [request.id for request in requests], llm_batch=schema.llm_batch
+    )
+    logger.info(f"Tasks analyze_report started for {len(requests)} requests")
+    return requests
+
+
+@app.get('/analyze_request/{request_id}', response_model=AnalyzeRequestSchema)
+async def get_analyze_request(
+        request_id: int,
+        wait: float = Query(0, ge=0, le=REQUEST_WAIT_MAX_TIMEOUT),
+        s: AsyncSession = Depends(get_async_session),
+):
+    """Status and result of the request, with wait > 0 responds once the request is processed or wait expires."""
+    request = await wait_for_request_status(s, request_id, wait)
+    if request is None:
+        raise HTTPException(status_code=404, detail='Analyze request not found')
+    return request
+
+
+@app.get('/analyze_request/{request_id}/summary', response_model=ReportSummarySchema)
+async def get_analyze_request_summary(request_id: int, s: AsyncSession = Depends(get_async_session)):
+    """Report metrics precomputed at ingest, the same report uploaded again shares the summary of the first one."""
+    request = await get_request_by_id(s, request_id)
+    if request is None:
+        raise HTTPException(status_code=404, detail='Analyze request not found')
+    summary = await get_report_summary(s, request.products_request_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail='Report summary not found')
+    return summary
+
+
+async def stream_request_events(request_id: int) -> AsyncIterator[str]:
+    status = None
+    async with async_session_maker() as session:
+        while True:
+            request = await wait_for_request_status(session, request_id, REQUEST_EVENTS_KEEPALIVE)
+            if request is None:
+                yield 'event: error\ndata: Analyze request not found\n\n'
+                return
+            if request.status != status:
+                status = request.status
+                yield f'event: status\ndata: {AnalyzeRequestSchema.model_validate(request, from_attributes=True).model_dump_json()}\n\n'
+            else:
+                yield ': keepalive\n\n'
+            if status != AnalyzeRequest.STATUS_CREATED:
+                return
+
+
+@app.get('/analyze_request/{request_id}/events')
+async def get_analyze_request_events(request_id: int):
+    """Server-sent events with the request state, sent on every status change until the request is processed."""
+    return StreamingResponse(
+        stream_request_events(request_id), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'}
+    )
+
+
+def check_date_range(date_from: date, date_to: date):
+    if date_from > date_to:
+        raise HTTPException(status_code=422, detail='date_from is after date_to')
+
+
+@app.get('/analytics/revenue', response_model=list[SalesRollupSchema])
+async def get_analytics_revenue(
+        date_from: date, date_to: date, period: RollupPeriod = 'day', s: AsyncSession = Depends(get_async_session)
+):
+    """Revenue of all finished reports by day or by month of the report date."""
+    check_date_range(date_from, date_to)
+    return await get_revenue_trend(s, period, date_from, date_to)
+
+
+@app.get('/analytics/categories', response_model=list[CategoryMixSchema])
+async def get_analytics_categories(date_from: date, date_to: date, s: AsyncSession = Depends(get_async_session)):
+    check_date_range(date_from, date_to)
+    categories = await get_categories_mix(s, date_from, date_to)
+    return [{'category': category, 'quantity': quantity, 'revenue': revenue} for category, quantity, revenue in categories]
+
+
+@app.get('/analytics/top_products', response_model=list[TopProductSchema])
+async def get_analytics_top_products(
+        date_from: date, date_to: date, limit: int = Query(10, ge=1, le=ROLLUP_TOP_PRODUCTS),
+        s: AsyncSession = Depends(get_async_session),
+):
+    """Best selling products of the range, counted over the top products of every report."""
+    check_date_range(date_from, date_to)
+    top_products = await get_top_products(s, date_from, date_to, limit)
+    return [{'name': name, 'quantity': quantity} for name, quantity in top_products]
@@ -0,0 +1,85 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, start_http_server, multiprocess,
+)
+
+# seconds of whole report stages, from a few ms for small reports to minutes for the largest ones
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+QUERY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+THROUGHPUT_BUCKETS = (1_000, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000)
+
+REPORT_DOWNLOAD_BYTES = Counter('report_download_bytes', 'Bytes of report bodies downloaded')
+REPORT_DOWNLOAD_SECONDS = Histogram(
+    'report_download_seconds', 'Time spent waiting for report bodies from the network', buckets=STAGE_BUCKETS
+)
+REPORT_PARSE_SECONDS = Histogram('report_parse_seconds', 'Time spent parsing a report', buckets=STAGE_BUCKETS)
+PRODUCTS_PARSED = Counter('products_parsed', 'Products parsed from reports')
+PRODUCTS_PARSED_PER_SECOND = Histogram(
+    'report_parse_products_per_second', 'Parse throughput of a report', buckets=THROUGHPUT_BUCKETS
+)
+PRODUCT_INSERT_SECONDS = Histogram(
+    'product_insert_seconds', 'Duration of a product batch COPY', buckets=QUERY_BUCKETS
+)
+PRODUCTS_INSERTED = Counter('products_inserted', 'Products stored into the database')
+AGGREGATE_QUERY_SECONDS = Histogram(
+    'aggregate_query_seconds', 'Duration of aggregate queries and upserts', ['query'], buckets=QUERY_BUCKETS
+)
+LLM_REQUEST_SECONDS = Histogram(
+    'llm_request_seconds', 'Latency of Claude API calls', ['outcome'], buckets=STAGE_BUCKETS
+)
+LLM_TOKENS = Counter('llm_tokens', 'Tokens used by Claude', ['type'])
+LLM_CACHE_LOOKUPS = Counter(
+    'llm_cache_lookups', 'Lookups of Claude results by prompt fingerprint', ['result']
+)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    'task_queue_wait_seconds', 'Time tasks spent in the broker queue', ['task'], buckets=STAGE_BUCKETS
+)
+TASK_SECONDS = Histogram('task_seconds', 'Duration of tasks', ['task', 'state'], buckets=STAGE_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds', 'Duration of API requests', ['method', 'route', 'status'], buckets=QUERY_BUCKETS
+)
+
+
+class Stopwatch:
+    """Time accumulated over the blocks it measures, e.g. waits for the chunks of one download."""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    @contextmanager
+    def measure(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def observe_llm_usage(usage):
+    LLM_TOKENS.labels('input').inc(usage.input_tokens)
+    LLM_TOKENS.labels('output').inc(usage.output_tokens)
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """Metrics of the process, or of all processes of the prefork pool when PROMETHEUS_MULTIPROC_DIR is set."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def get_latest_metrics() -> bytes:
+    return generate_latest(get_metrics_registry())
+
+
+def start_metrics_server(port: int):
+    start_http_server(port, registry=get_metrics_registry())
+
+
+def mark_process_dead(pid: int):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
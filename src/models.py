@@ -1,5 +1,6 @@
-from datetime import datetime
-from sqlalchemy import Integer, Date, ForeignKey, Text, Float
+from datetime import date, datetime
+from sqlalchemy import Integer, BigInteger, Date, DateTime, ForeignKey, Text, Float, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -16,17 +17,141 @@ class AnalyzeRequest(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     status: Mapped[str] = mapped_column(Text, server_default=STATUS_CREATED)
-    report_url: Mapped[str] = mapped_column(Text)
+    report_url: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # uploaded report in REPORT_UPLOAD_DIR, instead of report_url
+    report_path: Mapped[str | None] = mapped_column(Text, nullable=True)
     report_date: Mapped[datetime | None] = mapped_column(Date, nullable=True)
     llm_result: Mapped[str | None] = mapped_column(Text, nullable=True)
+    report_hash: Mapped[str | None] = mapped_column(Text, nullable=True, index=True)
+    source_request_id: Mapped[int | None] = mapped_column(ForeignKey('analyze_request.id'), nullable=True)
+
+    @property
+    def products_request_id(self) -> int:
+        """Id of the request which owns products of the report, differs for deduplicated reports."""
+        return self.source_request_id or self.id
+
+
+class Category(Base):
+    """Dimension of product categories, rows are never deleted so their ids are cached by categories.CategoryIds."""
+    __tablename__ = 'category'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(Text, unique=True)
 
 
 class Product(Base):
     __tablename__ = 'product'
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # partition key, monthly partitions are created by partitions.ProductPartitions
+    report_date: Mapped[date] = mapped_column(Date, primary_key=True)
     request_id: Mapped[int] = mapped_column(ForeignKey('analyze_request.id'))
     name: Mapped[str] = mapped_column(Text)
     quantity: Mapped[int] = mapped_column(Integer)
     price: Mapped[float] = mapped_column(Float)
-    category: Mapped[str] = mapped_column(Text)
+    # no foreign key: ids come from categories.CategoryIds and categories are never deleted, while checking
+    # the key for every row would take a third of the COPY throughput
+    category_id: Mapped[int] = mapped_column(Integer)
+
+    __table_args__ = (
+        # index-only scans for top products, revenue and categories distribution of a request
+        Index('ix_product_request_id_quantity', 'request_id', quantity.desc(), postgresql_include=['price']),
+        Index('ix_product_request_id_category_id', 'request_id', 'category_id', postgresql_include=['quantity']),
+        {'postgresql_partition_by': 'RANGE (report_date)'},
+    )
+
+
+class ReportSummary(Base):
+    """Report metrics computed at ingest, read instead of aggregating the products of the request."""
+    __tablename__ = 'report_summary'
+
+    request_id: Mapped[int] = mapped_column(ForeignKey('analyze_request.id'), primary_key=True)
+    products_count: Mapped[int] = mapped_column(Integer)
+    total_revenue: Mapped[float] = mapped_column(Float)
+    top_products: Mapped[list[dict]] = mapped_column(JSONB)
+    categories: Mapped[dict[str, int]] = mapped_column(JSONB)
+
+
+class SalesRollup(Base):
+    """Totals of finished reports by day or by month of the report date."""
+    __tablename__ = 'sales_rollup'
+
+    PERIOD_DAY = 'day'
+    PERIOD_MONTH = 'month'
+
+    period: Mapped[str] = mapped_column(Text, primary_key=True)
+    period_start: Mapped[date] = mapped_column(Date, primary_key=True)
+    reports_count: Mapped[int] = mapped_column(BigInteger)
+    products_count: Mapped[int] = mapped_column(BigInteger)
+    total_revenue: Mapped[float] = mapped_column(Float)
+
+
+class CategoryRollup(Base):
+    __tablename__ = 'category_rollup'
+
+    period: Mapped[str] = mapped_column(Text, primary_key=True)
+    period_start: Mapped[date] = mapped_column(Date, primary_key=True)
+    category: Mapped[str] = mapped_column(Text, primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger)
+    revenue: Mapped[float] = mapped_column(Float)
+
+
+class ProductRollup(Base):
+    """Quantities of products which made it into the top of at least one report of the period."""
+    __tablename__ = 'product_rollup'
+
+    period: Mapped[str] = mapped_column(Text, primary_key=True)
+    period_start: Mapped[date] = mapped_column(Date, primary_key=True)
+    name: Mapped[str] = mapped_column(Text, primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger)
+
+
+class RateLimitBucket(Base):
+    """Token bucket shared by worker processes, tokens go negative for reservations waiting for a refill."""
+    __tablename__ = 'rate_limit_bucket'
+
+    name: Mapped[str] = mapped_column(Text, primary_key=True)
+    tokens: Mapped[float] = mapped_column(Float)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
+class LLMBatch(Base):
+    """Message Batch submitted to Claude, processed until it has ended."""
+    __tablename__ = 'llm_batch'
+
+    STATUS_IN_PROGRESS = 'in_progress'
+    STATUS_ENDED = 'ended'
+
+    id: Mapped[str] = mapped_column(Text, primary_key=True)
+    status: Mapped[str] = mapped_column(Text, server_default=STATUS_IN_PROGRESS, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
+class LLMBatchItem(Base):
+    """Prompt of a request waiting for batch submission (batch_id is null) or for its batch to end."""
+    __tablename__ = 'llm_batch_item'
+
+    request_id: Mapped[int] = mapped_column(ForeignKey('analyze_request.id'), primary_key=True)
+    prompt: Mapped[str] = mapped_column(Text)
+    prompt_key: Mapped[str] = mapped_column(Text)
+    batch_id: Mapped[str | None] = mapped_column(ForeignKey('llm_batch.id'), nullable=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
+class LLMCacheEntry(Base):
+    __tablename__ = 'llm_cache'
+
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    result: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+
+class ReportFetchCacheEntry(Base):
+    __tablename__ = 'report_fetch_cache'
+
+    url: Mapped[str] = mapped_column(Text, primary_key=True)
+    etag: Mapped[str | None] = mapped_column(Text, nullable=True)
+    last_modified: Mapped[str | None] = mapped_column(Text, nullable=True)
+    content_hash: Mapped[str] = mapped_column(Text)
+    body_path: Mapped[str | None] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
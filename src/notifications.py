@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+import asyncpg
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import DATABASE_URL, REQUEST_POLL_INTERVAL
+from models import AnalyzeRequest
+from service import REQUEST_STATUS_CHANNEL, get_request_by_id
+
+logger = logging.getLogger('fastapi')
+
+
+class RequestStatusListener:
+    """Status changes of analyze requests, pushed by workers with NOTIFY on commit.
+
+    A single LISTEN connection is shared by all waiters of the process. Waiters poll every
+    REQUEST_POLL_INTERVAL seconds as well, so a lost notification only delays the response. A lost
+    connection is reopened at the same interval, waiters only poll until it's back.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._connection: asyncpg.Connection | None = None
+        self._reconnecting: asyncio.Task | None = None
+        self._waiters: dict[int, set[asyncio.Event]] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None
+
+    async def start(self):
+        if self._connection is not None or self._reconnecting is not None:
+            return
+        try:
+            await self._connect()
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning(f'Request status listener is not started, falling back to polling: {e}')
+            self._reconnect()
+
+    async def stop(self):
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+            self._reconnecting = None
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        await connection.close()
+
+    async def _connect(self):
+        connection = await asyncpg.connect(self.dsn)
+        try:
+            await connection.add_listener(REQUEST_STATUS_CHANNEL, self._on_notification)
+        except BaseException:
+            connection.terminate()
+            raise
+        connection.add_termination_listener(self._on_termination)
+        self._connection = connection
+
+    def _on_termination(self, connection: asyncpg.Connection):
+        # a connection closed by stop() is forgotten already
+        if connection is not self._connection:
+            return
+        self._connection = None
+        logger.warning('Request status listener lost its connection, falling back to polling')
+        self._reconnect()
+
+    def _reconnect(self):
+        self._reconnecting = asyncio.get_running_loop().create_task(self._keep_reconnecting())
+
+    async def _keep_reconnecting(self):
+        while True:
+            await asyncio.sleep(REQUEST_POLL_INTERVAL)
+            try:
+                await self._connect()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.debug(f'Request status listener is not reconnected: {e}')
+                continue
+            self._reconnecting = None
+            logger.info('Request status listener reconnected')
+            return
+
+    @contextmanager
+    def subscribe(self, request_id: int) -> Iterator[asyncio.Event]:
+        event = asyncio.Event()
+        self._waiters.setdefault(request_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            waiters = self._waiters[request_id]
+            waiters.discard(event)
+            if not waiters:
+                del self._waiters[request_id]
+
+    def _on_notification(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str):
+        try:
+            request_id = int(payload)
+        except ValueError:
+            return
+        for event in self._waiters.get(request_id, ()):
+            event.set()
+
+
+def get_listener_dsn(url: str = DATABASE_URL) -> str:
+    return make_url(url).set(drivername='postgresql').render_as_string(hide_password=False)
+
+
+request_status_listener = RequestStatusListener(get_listener_dsn())
+
+
+async def wait_for_request_status(
+        session: AsyncSession, request_id: int, timeout: float,
+        listener: RequestStatusListener = request_status_listener,
+) -> AnalyzeRequest | None:
+    """Long-poll: the request once it leaves STATUS_CREATED, or its current state when timeout expires.
+
+    The session doesn't hold a connection while waiting for the status change.
+    """
+    deadline = time.monotonic() + timeout
+    with listener.subscribe(request_id) as changed:
+        while True:
+            changed.clear()
+            session.expire_all()
+            request = await get_request_by_id(session, request_id)
+            await session.commit()
+            if request is None or request.status != AnalyzeRequest.STATUS_CREATED:
+                return request
+
+            wait = min(REQUEST_POLL_INTERVAL, deadline - time.monotonic())
+            if wait <= 0:
+                return request
+            try:
+                await asyncio.wait_for(changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,104 @@
+import logging
+import re
+from datetime import date
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from models import Product
+
+logger = logging.getLogger('celery')
+
+PARTITION_NAME_RE = re.compile(rf'^{Product.__tablename__}_(\d{{4}})_(\d{{2}})$')
+
+
+def get_month_bounds(report_date: date) -> tuple[date, date]:
+    start = report_date.replace(day=1)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+
+def get_partition_name(report_date: date) -> str:
+    return f'{Product.__tablename__}_{report_date.year:04d}_{report_date.month:02d}'
+
+
+def is_missing_partition_error(error: Exception) -> bool:
+    return f'no partition of relation "{Product.__tablename__}" found' in str(error)
+
+
+class ProductPartitions:
+    """Monthly partitions of the product table by report_date.
+
+    Partitions are created on demand in their own short transaction: a new table is attached to product,
+    which doesn't wait for running ingests unlike CREATE TABLE ... PARTITION OF. Names of partitions known
+    to exist are remembered, so the check costs nothing for the following reports of the month.
+    """
+
+    def __init__(self):
+        self._created: set[str] = set()
+
+    async def ensure(self, engine: AsyncEngine, report_date: date):
+        name = get_partition_name(report_date)
+        if name in self._created:
+            return
+
+        start, end = get_month_bounds(report_date)
+        async with engine.begin() as conn:
+            # workers can meet the first report of a month at the same time
+            await conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:name))'), {'name': name})
+            if name not in await self._get_partitions(conn):
+                await conn.execute(text(
+                    f'CREATE TABLE IF NOT EXISTS {name} '
+                    f'(LIKE {Product.__tablename__} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                ))
+                await conn.execute(text(
+                    f"ALTER TABLE {Product.__tablename__} ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+                logger.info(f'Product partition {name} created')
+        self._created.add(name)
+
+    async def drop_expired(self, engine: AsyncEngine, expired_before: date) -> list[str]:
+        """Drop partitions whose whole month is before expired_before."""
+        async with engine.connect() as conn:
+            partitions = await self._get_partitions(conn)
+            await conn.rollback()
+
+        dropped = []
+        autocommit_engine = engine.execution_options(isolation_level='AUTOCOMMIT')
+        for name in sorted(partitions):
+            match = PARTITION_NAME_RE.match(name)
+            if not match:
+                continue
+            _, end = get_month_bounds(date(int(match[1]), int(match[2]), 1))
+            if end > expired_before:
+                continue
+            async with autocommit_engine.connect() as conn:
+                await conn.execute(text(f'ALTER TABLE {Product.__tablename__} DETACH PARTITION {name} CONCURRENTLY'))
+                await conn.execute(text(f'DROP TABLE {name}'))
+            self._created.discard(name)
+            dropped.append(name)
+            logger.info(f'Product partition {name} dropped')
+        return dropped
+
+    def forget(self, report_date: date):
+        """Stop trusting the partition of report_date, another process may have dropped it."""
+        self._created.discard(get_partition_name(report_date))
+
+    def clear(self):
+        self._created.clear()
+
+    @staticmethod
+    async def _get_partitions(conn) -> set[str]:
+        partitions = await conn.execute(
+            text(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'WHERE parent.relname = :parent'
+            ),
+            {'parent': Product.__tablename__},
+        )
+        return set(partitions.scalars().all())
+
+
+product_partitions = ProductPartitions()
@@ -0,0 +1,89 @@
+from array import array
+from itertools import islice
+from typing import Iterable, Iterator
+
+
+class ProductBatch:
+    """Products of a report stored by columns.
+
+    Quantities and prices are packed into arrays, names and categories go through a table of
+    interned strings, which the parser shares between the batches of a report, so every distinct
+    category is kept once. Rows are read as dicts, like the products of the parser used to be.
+    """
+
+    __slots__ = ('names', 'quantities', 'prices', 'categories', '_strings')
+
+    def __init__(self, strings: dict[str, str] | None = None):
+        self.names: list[str | None] = []
+        # 32-bit like the quantity column, a larger value must not reach the COPY
+        self.quantities = array('i')
+        self.prices = array('d')
+        self.categories: list[str | None] = []
+        self._strings = {} if strings is None else strings
+
+    @classmethod
+    def from_dicts(cls, products: Iterable[dict]) -> 'ProductBatch':
+        batch = cls()
+        for product in products:
+            batch.append(product['name'], product['quantity'], product['price'], product['category'])
+        return batch
+
+    def append(self, name: str | None, quantity: int, price: float, category: str | None):
+        """Add a product, OverflowError is raised for a quantity out of int32 and the batch is left as is."""
+        self.quantities.append(quantity)
+        try:
+            self.prices.append(price)
+        except TypeError:
+            self.quantities.pop()
+            raise
+        strings = self._strings
+        self.names.append(strings.setdefault(name, name))
+        self.categories.append(strings.setdefault(category, category))
+
+    def extend(self, other: 'ProductBatch'):
+        self.names.extend(other.names)
+        self.quantities.extend(other.quantities)
+        self.prices.extend(other.prices)
+        self.categories.extend(other.categories)
+
+    def rows(self) -> Iterator[tuple[str | None, int, float, str | None]]:
+        return zip(self.names, self.quantities, self.prices, self.categories)
+
+    def chunks(self, size: int) -> Iterator['ProductBatch']:
+        for start in range(0, len(self), size):
+            yield self[start:start + size]
+
+    def __len__(self) -> int:
+        return len(self.quantities)
+
+    def __getitem__(self, index: int | slice) -> 'dict | ProductBatch':
+        if isinstance(index, slice):
+            batch = ProductBatch(self._strings)
+            batch.names = self.names[index]
+            batch.quantities = self.quantities[index]
+            batch.prices = self.prices[index]
+            batch.categories = self.categories[index]
+            return batch
+        return {
+            'name': self.names[index],
+            'quantity': self.quantities[index],
+            'price': self.prices[index],
+            'category': self.categories[index],
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for name, quantity, price, category in self.rows():
+            yield {'name': name, 'quantity': quantity, 'price': price, 'category': category}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ProductBatch):
+            return (
+                self.quantities == other.quantities and self.prices == other.prices
+                and self.names == other.names and self.categories == other.categories
+            )
+        if isinstance(other, list):
+            return len(self) == len(other) and all(row == product for row, product in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'ProductBatch({list(islice(self, 3))!r}, size={len(self)})'
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from config import CLAUDE_REQUESTS_PER_MINUTE, CLAUDE_TOKENS_PER_MINUTE, CLAUDE_MAX_IN_FLIGHT
+from db import engine
+from models import RateLimitBucket
+
+logger = logging.getLogger('celery')
+
+# rough size of a token, prompts are mostly cyrillic
+CHARS_PER_TOKEN = 3
+
+
+def estimate_claude_tokens(prompt: str, max_tokens: int) -> int:
+    return len(prompt) // CHARS_PER_TOKEN + max_tokens
+
+
+class TokenBucket:
+    """Token bucket refilled at per_minute / 60 tokens per second, stored in the rate_limit_bucket table.
+
+    Every reservation takes its cost right away, the bucket goes negative when it's exhausted and the caller
+    waits until the refill covers the debt. One UPSERT per reservation keeps processes consistent.
+    """
+
+    def __init__(self, name: str, per_minute: int):
+        self.name = name
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+
+    async def reserve(self, engine: AsyncEngine, cost: float) -> float:
+        """Take cost tokens, return the delay before they may be used."""
+        elapsed = func.extract('epoch', func.now() - RateLimitBucket.updated_at)
+        statement = insert(RateLimitBucket).values(name=self.name, tokens=self.capacity - cost, updated_at=func.now())
+        statement = statement.on_conflict_do_update(
+            index_elements=[RateLimitBucket.name],
+            set_={
+                'tokens': func.least(self.capacity, RateLimitBucket.tokens + elapsed * self.rate) - cost,
+                'updated_at': func.now(),
+            },
+        ).returning(RateLimitBucket.tokens)
+        async with engine.begin() as conn:
+            tokens = (await conn.execute(statement)).scalar_one()
+        return max(0.0, -tokens / self.rate)
+
+    async def refund(self, engine: AsyncEngine, tokens: float):
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(RateLimitBucket).filter(RateLimitBucket.name == self.name).values(
+                    tokens=func.least(self.capacity, RateLimitBucket.tokens + tokens)
+                )
+            )
+
+    async def drain(self, engine: AsyncEngine, seconds: float):
+        """Make every process wait at least seconds, e.g. after a 429 with retry-after."""
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(RateLimitBucket).filter(RateLimitBucket.name == self.name).values(
+                    tokens=func.least(RateLimitBucket.tokens, 0) - seconds * self.rate, updated_at=func.now()
+                )
+            )
+
+
+class ClaudeReservation:
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        # anthropic usage of the response, the estimate is corrected with it
+        self.usage = None
+
+
+class ClaudeRateLimiter:
+    """Requests and tokens per minute of the Claude account, shared by worker processes through Postgres,
+    and at most max_in_flight requests of the process at a time. A limit of 0 disables its bucket.
+    """
+
+    def __init__(
+            self, engine: AsyncEngine, requests_per_minute: int, tokens_per_minute: int, max_in_flight: int
+    ):
+        self.engine = engine
+        self.buckets: list[tuple[TokenBucket, bool]] = []
+        if requests_per_minute:
+            self.buckets.append((TokenBucket('claude_requests', requests_per_minute), False))
+        if tokens_per_minute:
+            self.buckets.append((TokenBucket('claude_tokens', tokens_per_minute), True))
+        self.max_in_flight = max_in_flight
+        self._semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @property
+    def in_flight(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphores[loop]
+
+    @asynccontextmanager
+    async def acquire(self, tokens: int) -> AsyncIterator[ClaudeReservation]:
+        reservation = ClaudeReservation(tokens)
+        async with self.in_flight:
+            delay = 0.0
+            for bucket, counts_tokens in self.buckets:
+                delay = max(delay, await bucket.reserve(self.engine, tokens if counts_tokens else 1))
+            if delay:
+                logger.info(f'Waiting {delay:.1f}s for the Claude rate limit')
+                await asyncio.sleep(delay)
+            try:
+                yield reservation
+            finally:
+                await self._settle(reservation)
+
+    async def pause(self, seconds: float):
+        for bucket, _ in self.buckets:
+            await bucket.drain(self.engine, seconds)
+
+    async def _settle(self, reservation: ClaudeReservation):
+        if reservation.usage is None:
+            return
+        for bucket, counts_tokens in self.buckets:
+            if counts_tokens:
+                used_tokens = reservation.usage.input_tokens + reservation.usage.output_tokens
+                if used_tokens != reservation.tokens:
+                    await bucket.refund(self.engine, reservation.tokens - used_tokens)
+
+
+claude_limiter = ClaudeRateLimiter(
+    engine,
+    requests_per_minute=CLAUDE_REQUESTS_PER_MINUTE,
+    tokens_per_minute=CLAUDE_TOKENS_PER_MINUTE,
+    max_in_flight=CLAUDE_MAX_IN_FLIGHT,
+)
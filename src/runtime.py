@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Coroutine
+from db import engine
+from utils import client, start_http_session, close_http_session
+
+logger = logging.getLogger('celery')
+
+
+class WorkerRuntime:
+    """Event loop of a worker process, running in a background thread.
+
+    Celery tasks submit their coroutines to this loop, so the db pool, http session and anthropic client
+    are bound to a single loop and reused between tasks. Tasks submitted from several threads (the threads
+    pool) run concurrently on the loop.
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is not None:
+                return
+            # pooled connections inherited from the parent process can't be shared with it
+            engine.sync_engine.dispose(close=False)
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, name='worker-runtime', daemon=True)
+            self._thread.start()
+        self.run(start_http_session())
+        logger.info('Worker runtime started')
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        if self.loop is None:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        if self.loop is None:
+            return
+        try:
+            self.run(self._close_resources())
+        finally:
+            with self._lock:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self._thread.join()
+                self.loop.close()
+                self.loop = None
+                self._thread = None
+        logger.info('Worker runtime stopped')
+
+    @staticmethod
+    async def _close_resources():
+        await close_http_session()
+        await client.close()
+        await engine.dispose()
+
+
+runtime = WorkerRuntime()
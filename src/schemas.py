@@ -1,13 +1,51 @@
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl
 from datetime import date
+from typing import Literal
+from config import UPLOAD_REPORTS_MAX_URLS
 
 class UploadReportSchema(BaseModel):
     url: HttpUrl
 
 
+class UploadReportsSchema(BaseModel):
+    urls: list[HttpUrl] = Field(min_length=1, max_length=UPLOAD_REPORTS_MAX_URLS)
+    # analyze with Claude Message Batches: cheaper, results may take up to a day
+    llm_batch: bool = False
+
+
 class AnalyzeRequestSchema(BaseModel):
     id: int
     status: str
-    report_url: HttpUrl
+    report_url: HttpUrl | None
     report_date: date | None
     llm_result: str | None
+    source_request_id: int | None = None
+
+
+class TopProductSchema(BaseModel):
+    name: str
+    quantity: int
+
+
+class ReportSummarySchema(BaseModel):
+    request_id: int
+    products_count: int
+    total_revenue: float
+    top_products: list[TopProductSchema]
+    categories: dict[str, int]
+
+
+RollupPeriod = Literal['day', 'month']
+
+
+class SalesRollupSchema(BaseModel):
+    period_start: date
+    reports_count: int
+    products_count: int
+    total_revenue: float
+
+
+class CategoryMixSchema(BaseModel):
+    category: str
+    quantity: int
+    revenue: float
@@ -1,8 +1,17 @@
-from typing import Sequence
-from sqlalchemy import select, func, Row
+from datetime import date
+from itertools import repeat
+from typing import Iterable, Sequence
+import asyncpg
+from sqlalchemy import select, func, insert, and_, Row
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import AnalyzeRequest, Product
-from schemas import UploadReportSchema
+from metrics import AGGREGATE_QUERY_SECONDS, PRODUCT_INSERT_SECONDS, PRODUCTS_INSERTED
+from categories import category_ids
+from models import AnalyzeRequest, Category, Product, ReportSummary
+from product_batch import ProductBatch
+from schemas import UploadReportSchema, UploadReportsSchema
+
+REQUEST_STATUS_CHANNEL = 'analyze_request_status'
 
 
 async def create_analyze_request(session: AsyncSession, schema: UploadReportSchema) -> AnalyzeRequest:
@@ -13,6 +22,29 @@ async def create_analyze_request(session: AsyncSession, schema: UploadReportSche
     return request
 
 
+async def create_uploaded_analyze_request(session: AsyncSession, report_path: str) -> AnalyzeRequest:
+    request = AnalyzeRequest(report_path=report_path)
+    session.add(request)
+    await session.commit()
+    await session.refresh(request)
+    return request
+
+
+async def create_analyze_requests(session: AsyncSession, schema: UploadReportsSchema) -> Sequence[AnalyzeRequest]:
+    requests = await session.scalars(
+        insert(AnalyzeRequest).returning(AnalyzeRequest, sort_by_parameter_order=True),
+        [{'report_url': url.unicode_string()} for url in schema.urls],
+    )
+    requests = requests.all()
+    await session.commit()
+    return requests
+
+
+async def notify_request_status(session: AsyncSession, request_id: int):
+    """Notify listeners about the request status change, it's delivered on commit of the session."""
+    await session.execute(select(func.pg_notify(REQUEST_STATUS_CHANNEL, str(request_id))))
+
+
 async def get_request_by_id(session: AsyncSession, request_id: int) -> AnalyzeRequest | None:
     request = await session.execute(
         select(AnalyzeRequest).filter(AnalyzeRequest.id == request_id)
@@ -20,34 +52,140 @@ async def get_request_by_id(session: AsyncSession, request_id: int) -> AnalyzeRe
     return request.scalar()
 
 
-async def get_total_revenue(session: AsyncSession, request_id: int) -> float:
-    total_revenue = await session.execute(
-        select(
-            func.sum(Product.price * Product.quantity)
-        ).filter(
-            Product.request_id == request_id
-        ).group_by(Product.request_id)
+async def get_finished_request_by_hash(session: AsyncSession, report_hash: str) -> AnalyzeRequest | None:
+    request = await session.execute(
+        select(AnalyzeRequest).filter(
+            AnalyzeRequest.report_hash == report_hash,
+            AnalyzeRequest.status == AnalyzeRequest.STATUS_FINISHED,
+            AnalyzeRequest.source_request_id.is_(None),
+        ).order_by(AnalyzeRequest.id).limit(1)
     )
+    return request.scalar()
+
+
+def filter_request_products(request_id: int, report_date: date | None):
+    """Filter of the request products, report_date limits the scan to its product partition."""
+    if report_date is None:
+        return Product.request_id == request_id
+    return and_(Product.report_date == report_date, Product.request_id == request_id)
+
+
+async def get_total_revenue(session: AsyncSession, request_id: int, report_date: date | None = None) -> float:
+    with AGGREGATE_QUERY_SECONDS.labels('total_revenue').time():
+        total_revenue = await session.execute(
+            select(
+                func.sum(Product.price * Product.quantity)
+            ).filter(
+                filter_request_products(request_id, report_date)
+            ).group_by(Product.request_id)
+        )
     return total_revenue.scalar() or 0.0
 
 
-async def get_top3_products(session: AsyncSession, request_id: int) -> Sequence[Product]:
-    top_products = await session.execute(
-        select(Product).filter(
-            Product.request_id == request_id
-        ).order_by(
-            Product.quantity.desc()
-        ).limit(3)
-    )
+async def get_top3_products(
+        session: AsyncSession, request_id: int, report_date: date | None = None
+) -> Sequence[Product]:
+    with AGGREGATE_QUERY_SECONDS.labels('top3_products').time():
+        top_products = await session.execute(
+            select(Product).filter(
+                filter_request_products(request_id, report_date)
+            ).order_by(
+                Product.quantity.desc()
+            ).limit(3)
+        )
     return top_products.scalars().all()
 
 
-async def get_categories_distribution(session: AsyncSession, request_id: int) -> Sequence[Row[tuple[str, int]]]:
-    categories = await session.execute(
-        select(
-            Product.category, func.sum(Product.quantity)
-        ).filter(
-            Product.request_id == request_id
-        ).group_by(Product.category)
-    )
+async def get_categories_distribution(
+        session: AsyncSession, request_id: int, report_date: date | None = None
+) -> Sequence[Row[tuple[str, int]]]:
+    quantities = select(
+        Product.category_id, func.sum(Product.quantity).label('quantity')
+    ).filter(
+        filter_request_products(request_id, report_date)
+    ).group_by(Product.category_id).subquery()
+    with AGGREGATE_QUERY_SECONDS.labels('categories_distribution').time():
+        categories = await session.execute(
+            select(
+                Category.name, quantities.c.quantity
+            ).join(
+                quantities, Category.id == quantities.c.category_id
+            ).order_by(Category.name)
+        )
     return categories.all()
+
+
+async def save_report_summary(
+        session: AsyncSession, request_id: int, products_count: int, total_revenue: float,
+        top_products: Sequence[tuple[str, int]], categories: dict[str, int]
+) -> None:
+    """Upsert metrics of the report, a retried request overwrites the summary of the previous attempt."""
+    values = {
+        'products_count': products_count,
+        'total_revenue': total_revenue,
+        'top_products': [{'name': name, 'quantity': quantity} for name, quantity in top_products],
+        'categories': categories,
+    }
+    with AGGREGATE_QUERY_SECONDS.labels('report_summary').time():
+        await session.execute(
+            pg_insert(ReportSummary).values(request_id=request_id, **values).on_conflict_do_update(
+                index_elements=[ReportSummary.request_id], set_=values
+            )
+        )
+
+
+async def get_report_summary(session: AsyncSession, request_id: int) -> ReportSummary | None:
+    return await session.get(ReportSummary, request_id)
+
+
+PRODUCT_COPY_COLUMNS = ('request_id', 'report_date', 'name', 'quantity', 'price', 'category_id')
+
+
+async def insert_products(
+        session: AsyncSession, request_id: int, products: ProductBatch | Iterable[dict], report_date: date
+) -> None:
+    """Bulk insert products within the current transaction of the session.
+
+    Uses asyncpg binary COPY once the transaction has started, ORM bulk INSERT otherwise.
+    The product partition of report_date has to exist.
+    """
+    if not isinstance(products, ProductBatch):
+        products = ProductBatch.from_dicts(products)
+    if not products:
+        return
+
+    # categories are created in a transaction of their own, before the products referencing them
+    category_ids_by_name = await category_ids.ensure(session.bind, products.categories)
+    with PRODUCT_INSERT_SECONDS.time():
+        await _insert_products(session, request_id, products, category_ids_by_name, report_date)
+    PRODUCTS_INSERTED.inc(len(products))
+
+
+async def _insert_products(
+        session: AsyncSession, request_id: int, products: ProductBatch, category_ids_by_name: dict[str, int],
+        report_date: date,
+):
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    if isinstance(driver_connection, asyncpg.Connection) and driver_connection.is_in_transaction():
+        await driver_connection.copy_records_to_table(
+            Product.__tablename__,
+            records=zip(
+                repeat(request_id), repeat(report_date),
+                products.names, products.quantities, products.prices,
+                map(category_ids_by_name.get, products.categories),
+            ),
+            columns=PRODUCT_COPY_COLUMNS,
+        )
+    else:
+        await session.execute(
+            insert(Product),
+            [
+                {
+                    'request_id': request_id, 'report_date': report_date, 'name': name, 'quantity': quantity,
+                    'price': price, 'category_id': category_ids_by_name.get(category),
+                }
+                for name, quantity, price, category in products.rows()
+            ]
+        )
@@ -1,14 +1,61 @@
-import logging
-from celery import Celery
 import asyncio
-from celery.signals import setup_logging
-from db import async_session_maker
-from models import Product, AnalyzeRequest
-from service import get_top3_products, get_total_revenue, get_categories_distribution, get_request_by_id
-from utils import download_report, parse_sales_report_xml, create_prompt, get_claude_result
-from config import RABBITMQ_URL, config_logging
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import AsyncIterator, Sequence
+from celery import Celery, chain, group
+from celery.schedules import crontab
+from contextlib import aclosing
+from celery.signals import (
+    setup_logging, worker_init, worker_process_init, worker_ready, worker_process_shutdown, worker_shutdown,
+    before_task_publish, task_prerun, task_postrun,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import async_session_maker, engine
+from models import AnalyzeRequest
+from service import (
+    get_request_by_id, get_finished_request_by_hash, insert_products, notify_request_status, save_report_summary,
+    get_report_summary,
+)
+from utils import (
+    stream_report,
+    stream_local_report,
+    hash_report_stream,
+    parse_sales_report_stream,
+    create_prompt,
+    get_claude_result,
+    SalesReportParser,
+    create_sales_report_parser,
+    ReportAggregator,
+    ReportDownloadError,
+    ReportParseError,
+    ReportNotModified,
+)
+from analytics import add_report_to_rollups
+from categories import category_ids
+from product_batch import ProductBatch
+from fetch_cache import ReportFetch
+from uploads import UploadedReport, remove_uploaded_report
+from llm_batch import queue_llm_batch_item, submit_llm_batch, poll_llm_batches
+from llm_cache import llm_cache, get_prompt_fingerprint
+from partitions import product_partitions, is_missing_partition_error
+from metrics import TASK_QUEUE_WAIT_SECONDS, TASK_SECONDS, start_metrics_server, mark_process_dead
+from runtime import runtime
+from config import (
+    RABBITMQ_URL, WORKER_POOL, WORKER_CONCURRENCY, PRODUCT_BATCH_SIZE, PRODUCT_RETENTION_DAYS, ROLLUP_TOP_PRODUCTS,
+    LLM_BATCH_SUBMIT_INTERVAL, LLM_BATCH_POLL_INTERVAL, PIPELINE_STAGED, REPORT_IO_QUEUE, REPORT_CPU_QUEUE,
+    REPORT_SPOOL_DIR, WORKER_METRICS_PORT, CATEGORY_WARM_TIMEOUT, config_logging,
+)
 
 app = Celery('celery', broker=RABBITMQ_URL)
+# with the threads pool every task thread submits to the same runtime loop, so a single process
+# keeps up to worker_concurrency reports in flight
+app.conf.worker_pool = WORKER_POOL
+if WORKER_CONCURRENCY:
+    app.conf.worker_concurrency = WORKER_CONCURRENCY
 
 @setup_logging.connect
 def config_loggers(*args, **kwags):
@@ -16,73 +63,467 @@ def config_loggers(*args, **kwags):
 
 logger = logging.getLogger('celery')
 
+PROMPT_TOP_PRODUCTS = 3
+
+
+@worker_init.connect
+def init_worker(*args, **kwargs):
+    # prefork children report through PROMETHEUS_MULTIPROC_DIR to the server of the main process
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+
+
+@worker_process_init.connect
+def init_worker_process(*args, **kwargs):
+    runtime.start()
+    runtime.run(warm_category_ids())
+
+
+@worker_ready.connect
+def init_worker_runtime(*args, **kwargs):
+    # the threads pool runs tasks in the main worker process, without process signals
+    if WORKER_POOL != 'prefork':
+        runtime.run(warm_category_ids())
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(*args, **kwargs):
+    runtime.stop()
+    mark_process_dead(os.getpid())
+
+
+@worker_shutdown.connect
+def shutdown_worker(*args, **kwargs):
+    # the threads pool runs tasks in the main worker process, without process signals
+    runtime.stop()
+
+
+async def warm_category_ids():
+    try:
+        # a pool process blocked on an unreachable database would be killed and respawned over and over
+        await asyncio.wait_for(category_ids.warm(engine), CATEGORY_WARM_TIMEOUT)
+    except TimeoutError:
+        logger.warning(f'Category ids not loaded on startup in {CATEGORY_WARM_TIMEOUT} s')
+    except Exception as e:
+        # ids of unknown categories are loaded by the ingests anyway
+        logger.warning(f'Category ids not loaded on startup: {e}')
+
+
+@before_task_publish.connect
+def set_task_published_at(headers: dict, **kwargs):
+    headers.setdefault('published_at', time.time())
+
+
+_task_started: dict[str, float] = {}
+
+
+@task_prerun.connect
+def observe_task_queue_wait(task_id: str, task, **kwargs):
+    published_at = task.request.get('published_at')
+    if published_at is not None:
+        TASK_QUEUE_WAIT_SECONDS.labels(task.name).observe(max(0.0, time.time() - published_at))
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id: str, task, state: str | None = None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+async def finish_duplicate_request(
+        session: AsyncSession, request: AnalyzeRequest, source_request: AnalyzeRequest, report_hash: str
+):
+    """Link the request to the finished one with the same report, dropping everything ingested for it."""
+    logger.info(f'Report of request_id={request.id} is a duplicate of request_id={source_request.id}')
+    source_request_id = source_request.id
+    report_date = source_request.report_date
+    llm_result = source_request.llm_result
+    await session.rollback()
+    request.report_hash = report_hash
+    request.source_request_id = source_request_id
+    request.report_date = report_date
+    request.llm_result = llm_result
+    request.status = AnalyzeRequest.STATUS_FINISHED
+
+
+async def set_request_error(session: AsyncSession, request: AnalyzeRequest, request_id: int):
+    await session.rollback()
+    request.status = AnalyzeRequest.STATUS_ERROR
+    await notify_request_status(session, request_id)
+    await session.commit()
+
+
+async def ingest_products(
+        session: AsyncSession, request_id: int, chunks: AsyncIterator[bytes],
+        parser: SalesReportParser, aggregator: ReportAggregator,
+):
+    """Parse the report and insert its products in batches, aggregating them on the way."""
+    async with aclosing(parse_sales_report_stream(chunks, parser)) as report_products:
+        batch = ProductBatch()
+        report_date = None
+        insert_batch = insert_first_products
+        async for products in report_products:
+            if report_date is None:
+                report_date = parser.report_date.date()
+                await product_partitions.ensure(session.bind, report_date)
+            aggregator.add(products)
+            batch.extend(products)
+            if len(batch) >= PRODUCT_BATCH_SIZE:
+                await insert_batch(session, request_id, batch, report_date)
+                insert_batch = insert_products
+                batch = ProductBatch()
+        await insert_batch(session, request_id, batch, report_date)
+
+
+async def insert_first_products(session: AsyncSession, request_id: int, batch: ProductBatch, report_date: date):
+    """Insert the first batch of a report, recreating its partition if it was dropped since it was cached.
+
+    The retention task drops partitions in another worker process, this one may still remember them.
+    """
+    try:
+        async with session.begin_nested():
+            await insert_products(session, request_id, batch, report_date)
+    except Exception as e:
+        if report_date is None or not is_missing_partition_error(e):
+            raise
+        logger.warning(f'Product partition for {report_date} is missing, creating it again')
+        product_partitions.forget(report_date)
+        await product_partitions.ensure(session.bind, report_date)
+        await insert_products(session, request_id, batch, report_date)
 
-async def analyze_report_async(request_id: int):
+
+async def finish_ingest(
+        session: AsyncSession, request: AnalyzeRequest, request_id: int, report_hash: str,
+        parser: SalesReportParser, aggregator: ReportAggregator,
+) -> str:
+    """Commit the ingested report with its summary and rollups, return the prompt for Claude."""
+    request.report_hash = report_hash
+    request.report_date = parser.report_date
+    # a retried request must not be counted in the rollups twice
+    add_to_rollups = await get_report_summary(session, request_id) is None
+    await save_report_summary(
+        session, request_id,
+        products_count=aggregator.products_count,
+        total_revenue=aggregator.total_revenue,
+        top_products=aggregator.top_product_quantities[:PROMPT_TOP_PRODUCTS],
+        categories=aggregator.categories,
+    )
+    if add_to_rollups:
+        # rollup rows are shared by all workers, they stay locked only until the commit below
+        await add_report_to_rollups(
+            session, parser.report_date.date(),
+            products_count=aggregator.products_count,
+            total_revenue=aggregator.total_revenue,
+            categories=aggregator.categories,
+            category_revenue=aggregator.category_revenue,
+            top_products=aggregator.top_product_quantities,
+        )
+    await session.commit()
+
+    top_products = ', '.join(aggregator.top_products[:PROMPT_TOP_PRODUCTS])
+    categories = ', '.join([f'{category}: {quantity} pcs' for category, quantity in aggregator.categories.items()])
+    return create_prompt(
+        report_date=parser.report_date,
+        total_revenue=aggregator.total_revenue,
+        top_products=top_products,
+        categories=categories
+    )
+
+
+async def analyze_prompt(
+        session: AsyncSession, request: AnalyzeRequest, request_id: int, prompt: str, llm_batch: bool
+) -> int | None:
+    prompt_key = get_prompt_fingerprint(prompt)
+    llm_result = await llm_cache.get(session, prompt_key)
+    if llm_result:
+        logger.info(f'Claude result for {request_id=} found in cache')
+    elif llm_batch:
+        await queue_llm_batch_item(session, request_id, prompt, prompt_key)
+        logger.info(f'Prompt of {request_id=} queued for the next llm batch')
+        await session.commit()
+        return request_id
+    else:
+        llm_result = await get_claude_result(prompt)
+        if llm_result:
+            await llm_cache.set(session, prompt_key, llm_result)
+    if not llm_result:
+        logger.warning(f'Error getting claude result for {request_id=}')
+        await set_request_error(session, request, request_id)
+        return
+
+    request.llm_result = llm_result
+    request.status = AnalyzeRequest.STATUS_FINISHED
+    await notify_request_status(session, request_id)
+    await session.commit()
+    return request_id
+
+
+async def get_report_fetch(session: AsyncSession, request: AnalyzeRequest) -> ReportFetch | UploadedReport:
+    if request.report_path:
+        return UploadedReport(request.report_path)
+    return await ReportFetch.load(session, request.report_url)
+
+
+async def analyze_report_async(request_id: int, llm_batch: bool = False):
     async with async_session_maker() as session:
         request = await get_request_by_id(session, request_id)
         if not request:
             logger.warning(f'No analyze request found for {request_id=}')
             return
 
-        report_str = await download_report(request.report_url)
-        if not report_str:
-            logger.warning(f'Error downloading xml report for {request_id=}')
-            request.status = AnalyzeRequest.STATUS_ERROR
-            await session.commit()
-            return
+        report_path = request.report_path
+        try:
+            return await analyze_request_report(session, request, request_id, llm_batch)
+        finally:
+            # uploads are read once, a failed request is not retried
+            if report_path:
+                remove_uploaded_report(report_path)
 
-        report_date, report_products = parse_sales_report_xml(report_str)
-        if not report_date:
-            logger.warning(f'Error parsing xml report for {request_id=}')
-            request.status = AnalyzeRequest.STATUS_ERROR
-            await session.commit()
+
+async def analyze_request_report(session: AsyncSession, request: AnalyzeRequest, request_id: int, llm_batch: bool):
+    # the report is spooled and hashed first, so a duplicate is found before any of its products is written
+    fetched = await spool_request_report(session, request, request_id, llm_batch)
+    if fetched is None:
+        return request_id if request.status == AnalyzeRequest.STATUS_FINISHED else None
+
+    prompt = await ingest_spooled_report(session, request, fetched)
+    if prompt is None:
+        return
+    return await analyze_prompt(session, request, request_id, prompt, llm_batch)
+
+
+def create_report_aggregator() -> ReportAggregator:
+    return ReportAggregator(top_size=max(PROMPT_TOP_PRODUCTS, ROLLUP_TOP_PRODUCTS))
+
+
+async def fetch_report_async(request_id: int, llm_batch: bool = False) -> dict | None:
+    """Download stage of the staged pipeline: the report is spooled to REPORT_SPOOL_DIR for the ingest stage,
+    an uploaded report is handed over as it is.
+
+    Returns None when the pipeline is over for the request: it's a duplicate or the download failed.
+    """
+    async with async_session_maker() as session:
+        request = await get_request_by_id(session, request_id)
+        if not request:
+            logger.warning(f'No analyze request found for {request_id=}')
             return
 
-        request.report_date = report_date
-        for product in report_products:
-            session.add(
-                Product(
-                    request_id=request.id,
-                    name=product['name'],
-                    quantity=product['quantity'],
-                    price=product['price'],
-                    category=product['category'],
-                )
-            )
-
-        total_revenue = await get_total_revenue(session, request_id)
-        top_products = await get_top3_products(session, request_id)
-        top_products = ', '.join([str(product.name) for product in top_products])
-        categories = await get_categories_distribution(session, request_id)
-        categories = ', '.join([f'{category}: {quantity} pcs' for category, quantity in categories])
-
-        prompt = create_prompt(
-            report_date=request.report_date,
-            total_revenue=total_revenue,
-            top_products=top_products,
-            categories=categories
+        report_path = request.report_path
+        fetched = None
+        try:
+            fetched = await spool_request_report(session, request, request_id, llm_batch)
+            return fetched
+        finally:
+            # otherwise the ingest stage removes the upload
+            if report_path and fetched is None:
+                remove_uploaded_report(report_path)
+
+
+async def spool_request_report(
+        session: AsyncSession, request: AnalyzeRequest, request_id: int, llm_batch: bool
+) -> dict | None:
+    report_fetch = await get_report_fetch(session, request)
+    previous_request = None
+    if report_fetch.content_hash:
+        previous_request = await get_finished_request_by_hash(session, report_fetch.content_hash)
+    # with a finished request of the same content a 304 ends the analysis, otherwise the cached body is replayed
+    revalidate = previous_request is not None or report_fetch.cached_body_path is not None
+
+    report_path = request.report_path
+    try:
+        report_digest = hashlib.sha256()
+        report_chunks = hash_report_stream(
+            report_fetch.stream(revalidate, stream_report, replay=previous_request is None), report_digest
         )
-        llm_result = await get_claude_result(prompt)
-        if not llm_result:
-            logger.warning(f'Error getting claude result for {request_id=}')
-            request.status = AnalyzeRequest.STATUS_ERROR
-            await session.commit()
-            return
+        if report_path:
+            # an upload is already on the shared disk, it's only read for the hash
+            async with aclosing(report_chunks) as chunks:
+                async for _ in chunks:
+                    pass
+        else:
+            report_path = await spool_report(report_chunks)
+    except ReportNotModified:
+        await finish_duplicate_request(session, request, previous_request, report_fetch.content_hash)
+        await report_fetch.save(session, report_fetch.content_hash)
+        await notify_request_status(session, request_id)
+        await session.commit()
+        return
+    except ReportDownloadError:
+        logger.warning(f'Error downloading xml report for {request_id=}')
+        await set_request_error(session, request, request_id)
+        return
 
-        request.llm_result = llm_result
-        request.status = AnalyzeRequest.STATUS_FINISHED
+    report_hash = report_digest.hexdigest()
+    source_request = await get_finished_request_by_hash(session, report_hash)
+    if source_request:
+        remove_uploaded_report(report_path)
+        await finish_duplicate_request(session, request, source_request, report_hash)
+        await report_fetch.save(session, report_hash)
+        await notify_request_status(session, request_id)
         await session.commit()
-        return request_id
+        return
+
+    await report_fetch.save(session, report_hash)
+    await session.commit()
+    return {'request_id': request_id, 'report_path': report_path, 'report_hash': report_hash, 'llm_batch': llm_batch}
+
+
+async def spool_report(chunks: AsyncIterator[bytes]) -> str:
+    """Write the report to a new file in REPORT_SPOOL_DIR, return its path.
+
+    The writes go to a thread: the runtime loop also serves the downloads of the other tasks of the process.
+    """
+    await asyncio.to_thread(os.makedirs, REPORT_SPOOL_DIR, exist_ok=True)
+    spool_file = await asyncio.to_thread(
+        tempfile.NamedTemporaryFile, dir=REPORT_SPOOL_DIR, suffix='.xml', delete=False
+    )
+    completed = False
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                await asyncio.to_thread(spool_file.write, chunk)
+        completed = True
+    finally:
+        await asyncio.to_thread(spool_file.close)
+        if not completed:
+            await asyncio.to_thread(os.unlink, spool_file.name)
+    return spool_file.name
+
+
+async def ingest_report_async(fetched: dict | None) -> dict | None:
+    """Parse stage of the staged pipeline, hands the prompt over to the analyze stage."""
+    if fetched is None:
+        return
+    request_id = fetched['request_id']
+    async with async_session_maker() as session:
+        request = await get_request_by_id(session, request_id)
+        if not request:
+            logger.warning(f'No analyze request found for {request_id=}')
+            remove_uploaded_report(fetched['report_path'])
+            return
+
+        prompt = await ingest_spooled_report(session, request, fetched)
+        if prompt is None:
+            return
+        return {'request_id': request_id, 'prompt': prompt, 'llm_batch': fetched['llm_batch']}
+
+
+async def ingest_spooled_report(session: AsyncSession, request: AnalyzeRequest, fetched: dict) -> str | None:
+    """Ingest the report spooled by spool_request_report and remove it, return the prompt for Claude."""
+    request_id = fetched['request_id']
+    parser = create_sales_report_parser()
+    aggregator = create_report_aggregator()
+    try:
+        await ingest_products(session, request_id, stream_local_report(fetched['report_path']), parser, aggregator)
+    except (ReportDownloadError, ReportParseError):
+        logger.warning(f'Error parsing xml report for {request_id=}')
+        await set_request_error(session, request, request_id)
+        return
+    finally:
+        remove_uploaded_report(fetched['report_path'])
+
+    return await finish_ingest(session, request, request_id, fetched['report_hash'], parser, aggregator)
+
+
+async def analyze_prompt_async(ingested: dict | None) -> int | None:
+    """LLM stage of the staged pipeline."""
+    if ingested is None:
+        return
+    request_id = ingested['request_id']
+    async with async_session_maker() as session:
+        request = await get_request_by_id(session, request_id)
+        return await analyze_prompt(session, request, request_id, ingested['prompt'], ingested['llm_batch'])
 
 
 @app.task
-def analyze_report(args):
-    loop = asyncio.get_event_loop()
-    if loop.is_running():
-        new_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(new_loop)
-        res = new_loop.run_until_complete(analyze_report_async(args))
-        new_loop.close()
-        return res
-    else:
-        return loop.run_until_complete(analyze_report_async(args))
+def analyze_report(args, llm_batch: bool = False):
+    return runtime.run(analyze_report_async(args, llm_batch))
+
+
+@app.task
+def fetch_report(request_id: int, llm_batch: bool = False):
+    return runtime.run(fetch_report_async(request_id, llm_batch))
+
+
+@app.task
+def ingest_report(fetched: dict | None):
+    return runtime.run(ingest_report_async(fetched))
+
+
+@app.task
+def analyze_report_prompt(ingested: dict | None):
+    return runtime.run(analyze_prompt_async(ingested))
+
+
+# stages of the staged pipeline go to queues of their own, so io and cpu workers are sized separately
+app.conf.task_routes = {
+    fetch_report.name: {'queue': REPORT_IO_QUEUE},
+    ingest_report.name: {'queue': REPORT_CPU_QUEUE},
+    analyze_report_prompt.name: {'queue': REPORT_IO_QUEUE},
+}
+
+
+def get_analyze_report_signature(request_id: int, llm_batch: bool = False, staged: bool = PIPELINE_STAGED):
+    if staged:
+        return chain(fetch_report.s(request_id, llm_batch=llm_batch), ingest_report.s(), analyze_report_prompt.s())
+    return analyze_report.s(request_id, llm_batch=llm_batch)
+
+
+def enqueue_analyze_report(request_id: int):
+    get_analyze_report_signature(request_id).apply_async()
+
+
+def enqueue_analyze_reports(request_ids: Sequence[int], llm_batch: bool = False):
+    """Publish the analysis of every request at once, reusing one producer connection.
+
+    With llm_batch the prompts are sent to Claude in Message Batches, for backfills which may wait for hours.
+    """
+    group(get_analyze_report_signature(request_id, llm_batch) for request_id in request_ids).apply_async()
+
+
+async def submit_llm_batch_async() -> str | None:
+    async with async_session_maker() as session:
+        return await submit_llm_batch(session)
+
+
+@app.task
+def submit_llm_batches():
+    return runtime.run(submit_llm_batch_async())
+
+
+async def poll_llm_batches_async() -> list[str]:
+    async with async_session_maker() as session:
+        return await poll_llm_batches(session)
+
+
+@app.task
+def poll_llm_batches_results():
+    return runtime.run(poll_llm_batches_async())
+
+
+async def drop_expired_product_partitions_async() -> list[str]:
+    expired_before = date.today() - timedelta(days=PRODUCT_RETENTION_DAYS)
+    return await product_partitions.drop_expired(engine, expired_before)
+
+
+@app.task
+def drop_expired_product_partitions():
+    return runtime.run(drop_expired_product_partitions_async())
+
+
+app.conf.beat_schedule = {
+    'submit-llm-batches': {
+        'task': submit_llm_batches.name,
+        'schedule': LLM_BATCH_SUBMIT_INTERVAL,
+    },
+    'poll-llm-batches': {
+        'task': poll_llm_batches_results.name,
+        'schedule': LLM_BATCH_POLL_INTERVAL,
+    },
+    'drop-expired-product-partitions': {
+        'task': drop_expired_product_partitions.name,
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
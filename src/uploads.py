@@ -0,0 +1,70 @@
+import logging
+import os
+import uuid
+from contextlib import aclosing
+from typing import AsyncIterator
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from config import REPORT_UPLOAD_DIR, REPORT_MAX_SIZE
+from utils import stream_local_report
+
+logger = logging.getLogger('fastapi')
+
+
+class ReportTooLargeError(Exception):
+    """Uploaded report exceeds REPORT_MAX_SIZE, nothing is kept of it."""
+
+
+async def save_uploaded_report(
+        chunks: AsyncIterator[bytes], upload_dir: str = REPORT_UPLOAD_DIR, max_size: int = REPORT_MAX_SIZE
+) -> str:
+    """Spool the request body to upload_dir chunk by chunk, return the path of the report.
+
+    upload_dir has to be shared with the workers, e.g. a volume or a mounted object storage bucket.
+    """
+    # file calls block, they run in the threadpool to keep the event loop serving other requests
+    await run_in_threadpool(os.makedirs, upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f'{uuid.uuid4().hex}.upload')
+    file = await run_in_threadpool(open, path, 'wb')
+    completed = False
+    size = 0
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    logger.warning(f'Uploaded report exceeded {max_size=} bytes')
+                    raise ReportTooLargeError(f'Report is larger than {max_size} bytes')
+                await run_in_threadpool(file.write, chunk)
+        completed = True
+    finally:
+        await run_in_threadpool(file.close)
+        if not completed:
+            await run_in_threadpool(os.unlink, path)
+    return path
+
+
+def remove_uploaded_report(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class UploadedReport:
+    """Uploaded report, read the same way as a ReportFetch of a url but from the local disk."""
+
+    # uploads are not revalidated, they are deduplicated by the report hash only
+    content_hash = None
+    cached_body_path = None
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def stream(self, revalidate: bool, download=None, replay: bool = True) -> AsyncIterator[bytes]:
+        async with aclosing(stream_local_report(self.path)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def save(self, session: AsyncSession, content_hash: str):
+        pass
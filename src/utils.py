@@ -1,67 +1,467 @@
 import asyncio
+import heapq
 import logging
+import operator
+import random
+import time
+from functools import cache
 from datetime import datetime
+from contextlib import aclosing
+from typing import AsyncIterator, Iterable, Iterator
 import aiohttp
 import xml.etree.ElementTree as ET
 import anthropic
-from config import ANTHROPIC_API_KEY
+from config import (
+    REPORT_PARSER,
+    ANTHROPIC_API_KEY,
+    CLAUDE_MODEL,
+    CLAUDE_MAX_TOKENS,
+    CLAUDE_MAX_RETRIES,
+    CLAUDE_BACKOFF_BASE,
+    CLAUDE_BACKOFF_MAX,
+    REPORT_CHUNK_SIZE,
+    REPORT_MAX_SIZE,
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+)
+from decompress import ReportDecompressError, decompress_report_stream
+from product_batch import ProductBatch
+from metrics import (
+    REPORT_DOWNLOAD_BYTES, REPORT_DOWNLOAD_SECONDS, REPORT_PARSE_SECONDS, PRODUCTS_PARSED, PRODUCTS_PARSED_PER_SECOND,
+    LLM_REQUEST_SECONDS, Stopwatch, observe_llm_usage,
+)
+from rate_limit import claude_limiter, estimate_claude_tokens
 
-client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# retries are done by get_claude_result, so they are coordinated with the rate limiter
+client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
 logger = logging.getLogger('celery')
 
+CLAUDE_RETRY_ERRORS = (anthropic.RateLimitError, anthropic.InternalServerError, anthropic.APIConnectionError)
+
+REPORT_STREAM_TIMEOUT = aiohttp.ClientTimeout(sock_connect=10, sock_read=10)
+
+_http_session: aiohttp.ClientSession | None = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Long-lived session of the process, so connections and DNS lookups are reused between reports."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            )
+        )
+    return _http_session
+
+
+async def start_http_session():
+    get_http_session()
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
+
+class ReportDownloadError(Exception):
+    """Sales report can't be downloaded, the error is already logged."""
 
-async def download_report(url: str):
+
+class ReportNotModified(Exception):
+    """Report hasn't changed since the fetch described by the conditional request headers."""
+
+
+async def stream_report(
+        url: str,
+        max_size: int = REPORT_MAX_SIZE,
+        headers: dict[str, str] | None = None,
+        validators: dict[str, str | None] | None = None,
+) -> AsyncIterator[bytes]:
+    """Yield chunks of the report body as they arrive, without decoding them.
+
+    gzip, zstd and zip reports are decompressed on the fly, as well as bodies sent with Content-Encoding,
+    max_size limits the decompressed report. ETag and Last-Modified of the response are stored into
+    validators, if it's passed.
+    """
+    started = time.perf_counter()
+    # time the consumer spends on the chunks is not the download time
+    consumer = Stopwatch()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=10) as resp:
-                text = await resp.text()
-                if resp.status != 200:
-                    logger.warning(f'Request failed, {resp.status=}, {text=}')
-                    return None
-                return text
+        session = get_http_session()
+        async with session.get(url, timeout=REPORT_STREAM_TIMEOUT, headers=headers) as resp:
+            if resp.status == 304:
+                logger.info(f'Report from {url} is not modified')
+                raise ReportNotModified(url)
+            if resp.status != 200:
+                logger.warning(f'Request failed, {resp.status=}, {resp.reason=}')
+                raise ReportDownloadError(f'Unexpected status {resp.status}')
+            if resp.content_length is not None and resp.content_length > max_size:
+                logger.warning(f'Report from {url} is too large, {resp.content_length=}, {max_size=}')
+                raise ReportDownloadError('Report is too large')
+            if validators is not None:
+                validators['etag'] = resp.headers.get('ETag')
+                validators['last_modified'] = resp.headers.get('Last-Modified')
+
+            size = 0
+            body = decompress_report_stream(count_downloaded_bytes(resp.content.iter_chunked(REPORT_CHUNK_SIZE)))
+            async with aclosing(body) as chunks:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        logger.warning(f'Report from {url} exceeded {max_size=} bytes')
+                        raise ReportDownloadError('Report is too large')
+                    with consumer.measure():
+                        yield chunk
+            REPORT_DOWNLOAD_SECONDS.observe(time.perf_counter() - started - consumer.seconds)
+    except (ReportDownloadError, ReportNotModified):
+        raise
+    except ReportDecompressError as e:
+        logger.error(f"Error decompressing report from {url}: {e}")
+        raise ReportDownloadError(str(e)) from e
     except aiohttp.ClientError as e:
         logger.error(f"Network error while fetching {url}: {e}")
-    except asyncio.TimeoutError:
+        raise ReportDownloadError(str(e)) from e
+    except asyncio.TimeoutError as e:
         logger.error(f"Request to {url} timed out.")
-    except UnicodeDecodeError as e:
-        logger.error(f"Failed to decode response from {url}: {e}")
+        raise ReportDownloadError('Timeout') from e
     except Exception as e:
         logger.error(f"Unexpected error while downloading report from {url}: {e}")
-    return None
+        raise ReportDownloadError(str(e)) from e
 
 
-def parse_sales_report_xml(report_str: str) -> (datetime | None, list[dict]):
+async def count_downloaded_bytes(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        REPORT_DOWNLOAD_BYTES.inc(len(chunk))
+        yield chunk
+
+
+async def stream_report_file(path: str) -> AsyncIterator[bytes]:
+    """Yield chunks of a report stored on the local disk."""
+    try:
+        with open(path, 'rb') as file:
+            while chunk := file.read(REPORT_CHUNK_SIZE):
+                yield chunk
+    except OSError as e:
+        logger.error(f"Error reading report file {path}: {e}")
+        raise ReportDownloadError(str(e)) from e
+
+
+async def stream_local_report(path: str, max_size: int = REPORT_MAX_SIZE) -> AsyncIterator[bytes]:
+    """Yield chunks of an uploaded report, decompressed like the downloaded ones."""
+    size = 0
     try:
-        root = ET.fromstring(report_str)
+        async with aclosing(decompress_report_stream(stream_report_file(path))) as chunks:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    logger.warning(f'Report {path} exceeded {max_size=} bytes')
+                    raise ReportDownloadError('Report is too large')
+                yield chunk
+    except ReportDecompressError as e:
+        logger.error(f"Error decompressing report {path}: {e}")
+        raise ReportDownloadError(str(e)) from e
+
+
+async def hash_report_stream(chunks: AsyncIterator[bytes], digest) -> AsyncIterator[bytes]:
+    """Pass report chunks through, feeding them to a hashlib digest on the way."""
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+
+class ReportParseError(Exception):
+    """Sales report can't be parsed, the error is already logged."""
+
+
+class SalesReportParser:
+    """Incremental sales report parser on xml.etree.
+
+    Chunks of the xml document are fed as they arrive and products are returned as soon as their
+    elements are closed. Handled elements are dropped from the tree, so memory doesn't grow with the report.
+    """
+
+    parse_errors: tuple[type[Exception], ...] = (ET.ParseError,)
+    # names are mostly unique, the table of interned strings is started over once it grows this big
+    max_interned_strings = 100_000
+
+    def __init__(self):
+        self._parser = self._create_pull_parser()
+        self._path: list[ET.Element] = []
+        self._strings: dict[str, str] = {}
+        self.report_date: datetime | None = None
+        self.products_count = 0
+
+    @staticmethod
+    def _create_pull_parser():
+        return ET.XMLPullParser(events=("start", "end"))
+
+    def feed(self, data: str | bytes) -> ProductBatch:
+        try:
+            self._parser.feed(data)
+        except (TypeError, *self.parse_errors) as e:
+            logger.error(f"Error parsing report: {e}")
+            raise ReportParseError(str(e)) from e
+        return self._read_products()
+
+    def close(self) -> ProductBatch:
+        self._close_parser()
+        products = self._read_products()
+        report_date = self.report_date
+        logger.info(f"Parsed {report_date=} report and {self.products_count} products")
+        return products
+
+    def _close_parser(self):
+        try:
+            return self._parser.close()
+        except self.parse_errors as e:
+            logger.error(f"Error parsing report: {e}")
+            raise ReportParseError(str(e)) from e
+
+    def _read_products(self) -> ProductBatch:
+        products = self._create_batch()
+        try:
+            for event, elem in self._parser.read_events():
+                if event == "start":
+                    if not self._path:
+                        self._read_root(elem)
+                    self._path.append(elem)
+                    continue
+
+                self._path.pop()
+                if len(self._path) == 2:
+                    parent = self._path[-1]
+                    if elem.tag == "product" and parent.tag == "products":
+                        self._read_product(elem, products)
+                    parent.remove(elem)
+                elif len(self._path) == 1:
+                    self._path[0].remove(elem)
+        except self.parse_errors as e:
+            logger.error(f"Error parsing report: {e}")
+            raise ReportParseError(str(e)) from e
+        self.products_count += len(products)
+        return products
+
+    def _create_batch(self) -> ProductBatch:
+        if len(self._strings) > self.max_interned_strings:
+            self._strings = {}
+        return ProductBatch(self._strings)
+
+    def _read_root(self, root: ET.Element):
         if root.tag != "sales_data":
             logger.error("Invalid root element: expected 'sales_data'")
-            return None, []
-    except (ET.ParseError, TypeError) as e:
-        logger.error(f"Error parsing report: {e}")
-        return None, []
+            raise ReportParseError("Invalid root element")
 
-    try:
-        report_date = datetime.strptime(root.attrib.get("date"), '%Y-%m-%d')
-    except (TypeError, ValueError) as e:
-        logger.error(f"Invalid or missing report date in XML: {e}")
-        return None, []
+        try:
+            self.report_date = datetime.strptime(root.attrib.get("date"), '%Y-%m-%d')
+        except (TypeError, ValueError) as e:
+            logger.error(f"Invalid or missing report date in XML: {e}")
+            raise ReportParseError("Invalid report date") from e
 
-    products = []
-    for product_elem in root.findall("./products/product"):
+    @staticmethod
+    def _read_product(product_elem: ET.Element, products: ProductBatch):
         try:
-            product = {
-                "name": product_elem.find("name").text,
-                "quantity": int(product_elem.find("quantity").text),
-                "price": float(product_elem.find("price").text),
-                "category": product_elem.find("category").text,
-            }
-        except (AttributeError, ValueError) as e:
+            products.append(
+                product_elem.find("name").text,
+                int(product_elem.find("quantity").text),
+                float(product_elem.find("price").text),
+                product_elem.find("category").text,
+            )
+        except (AttributeError, ValueError, OverflowError) as e:
             logger.error(f"Error parsing product, skipping: {e}")
-            continue
-        products.append(product)
 
-    logger.info(f"Parsed {report_date=} report and {len(products)} products")
-    return report_date, products
+
+class LxmlSalesReportParser(SalesReportParser):
+    """Sales report parser on libxml2, with the same output and errors as SalesReportParser.
+
+    libxml2 only reports events of the report elements, so the fields of a product and unknown
+    elements never reach Python. _path holds the open report elements.
+    """
+
+    parse_errors = (lxml_etree.XMLSyntaxError,) if lxml_etree else ()
+
+    def __init__(self):
+        super().__init__()
+        self._root = None
+
+    @staticmethod
+    def _create_pull_parser():
+        return lxml_etree.XMLPullParser(events=("start", "end"), tag=("sales_data", "products", "product"))
+
+    def _close_parser(self):
+        root = super()._close_parser()
+        if self._root is None:
+            # no report element was parsed, events of unknown root tags are filtered out
+            self._root = root
+            self._read_root(root)
+
+    def _read_products(self) -> ProductBatch:
+        products = self._create_batch()
+        try:
+            for event, elem in self._parser.read_events():
+                if event == "start":
+                    if self._root is None:
+                        self._root = elem.getroottree().getroot()
+                        self._read_root(self._root)
+                    self._path.append(elem)
+                    continue
+
+                self._path.pop()
+                parent = elem.getparent()
+                if parent is None or parent is not self._root and parent.getparent() is not self._root:
+                    # the root itself, or an element nested deeper than the products
+                    continue
+                if elem.tag == "product" and parent.tag == "products":
+                    self._read_product(elem, products)
+                # drop the element along with the unknown ones before it
+                while elem.getprevious() is not None:
+                    del parent[0]
+                parent.remove(elem)
+        except self.parse_errors as e:
+            logger.error(f"Error parsing report: {e}")
+            raise ReportParseError(str(e)) from e
+        self.products_count += len(products)
+        return products
+
+    @staticmethod
+    def _read_product(product_elem, products: ProductBatch):
+        # find() is slow on lxml elements, the fields are looked up by one pass over the children
+        fields = {}
+        for child in product_elem:
+            fields.setdefault(child.tag, child)
+        try:
+            products.append(
+                fields.get("name").text,
+                int(fields.get("quantity").text),
+                float(fields.get("price").text),
+                fields.get("category").text,
+            )
+        except (AttributeError, ValueError, OverflowError) as e:
+            logger.error(f"Error parsing product, skipping: {e}")
+
+
+REPORT_PARSERS: dict[str, type[SalesReportParser]] = {
+    "stdlib": SalesReportParser,
+    "lxml": LxmlSalesReportParser,
+}
+
+
+@cache
+def get_sales_report_parser_class(name: str) -> type[SalesReportParser]:
+    if name not in REPORT_PARSERS:
+        raise ValueError(f"Unknown report parser {name!r}, expected one of {', '.join(REPORT_PARSERS)}")
+    if name == "lxml" and lxml_etree is None:
+        logger.warning("lxml is not installed, falling back to the stdlib report parser")
+        return SalesReportParser
+    return REPORT_PARSERS[name]
+
+
+def create_sales_report_parser(name: str | None = None) -> SalesReportParser:
+    """Parser of the REPORT_PARSER engine, unless another one is named."""
+    return get_sales_report_parser_class(name or REPORT_PARSER)()
+
+
+def _split_report(report: str | bytes | None, chunk_size: int = REPORT_CHUNK_SIZE) -> Iterator[str | bytes]:
+    if not report:
+        return
+    for start in range(0, len(report), chunk_size):
+        yield report[start:start + chunk_size]
+
+
+def parse_sales_report_xml(report_str: str) -> (datetime | None, Iterable[dict]):
+    """Parse sales report into its date and a ProductBatch of products."""
+    parser = create_sales_report_parser()
+    products = ProductBatch()
+    try:
+        for chunk in _split_report(report_str):
+            products.extend(parser.feed(chunk))
+        products.extend(parser.close())
+    except ReportParseError:
+        return None, []
+    return parser.report_date, products
+
+
+async def parse_sales_report_stream(
+        chunks: AsyncIterator[bytes], parser: SalesReportParser
+) -> AsyncIterator[ProductBatch]:
+    """Parse report chunks as they are downloaded, yielding products chunk by chunk.
+
+    Errors are raised as ReportDownloadError or ReportParseError, the report date is available on the parser.
+    """
+    parsing = Stopwatch()
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            with parsing.measure():
+                products = parser.feed(chunk)
+            if products:
+                PRODUCTS_PARSED.inc(len(products))
+                yield products
+    with parsing.measure():
+        products = parser.close()
+    REPORT_PARSE_SECONDS.observe(parsing.seconds)
+    if parsing.seconds:
+        PRODUCTS_PARSED_PER_SECOND.observe(parser.products_count / parsing.seconds)
+    if products:
+        PRODUCTS_PARSED.inc(len(products))
+        yield products
+
+
+class ReportAggregator:
+    """Report metrics computed on the fly while products stream out of the parser."""
+
+    def __init__(self, top_size: int = 3):
+        self.top_size = top_size
+        self.total_revenue = 0.0
+        self.categories: dict[str, int] = {}
+        self.category_revenue: dict[str, float] = {}
+        self._top: list[tuple[int, int, str]] = []
+        self._count = 0
+
+    def add(self, products: ProductBatch | Iterable[dict]):
+        if not isinstance(products, ProductBatch):
+            products = ProductBatch.from_dicts(products)
+        revenues = list(map(operator.mul, products.prices, products.quantities))
+        self.total_revenue = sum(revenues, self.total_revenue)
+
+        categories, category_revenue = self.categories, self.category_revenue
+        for category, quantity, revenue in zip(products.categories, products.quantities, revenues):
+            categories[category] = categories.get(category, 0) + quantity
+            category_revenue[category] = category_revenue.get(category, 0.0) + revenue
+
+        # min-heap of the best products so far, earlier products win ties
+        top, count = self._top, self._count
+        for quantity, name in zip(products.quantities, products.names):
+            if len(top) < self.top_size:
+                heapq.heappush(top, (quantity, -count, name))
+            elif quantity > top[0][0]:
+                heapq.heapreplace(top, (quantity, -count, name))
+            count += 1
+        self._count = count
+
+    @property
+    def products_count(self) -> int:
+        return self._count
+
+    @property
+    def top_products(self) -> list[str]:
+        return [name for name, _ in self.top_product_quantities]
+
+    @property
+    def top_product_quantities(self) -> list[tuple[str, int]]:
+        return [(name, quantity) for quantity, _, name in sorted(self._top, reverse=True)]
 
 
 def create_prompt(report_date: datetime, total_revenue: float, top_products: str, categories: str) -> str:
@@ -74,27 +474,64 @@ def create_prompt(report_date: datetime, total_revenue: float, top_products: str
     )
 
 
-async def get_claude_result(prompt: str) -> str | None:
+def get_retry_after(error: anthropic.APIError) -> float | None:
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
     try:
-        message = await client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=1000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    """Full jitter exponential backoff, never earlier than retry-after of the response."""
+    delay = random.uniform(0, min(CLAUDE_BACKOFF_MAX, CLAUDE_BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay += retry_after
+    return delay
+
+
+async def get_claude_result(prompt: str) -> str | None:
+    for attempt in range(CLAUDE_MAX_RETRIES + 1):
+        async with claude_limiter.acquire(estimate_claude_tokens(prompt, CLAUDE_MAX_TOKENS)) as reservation:
+            started = time.perf_counter()
+            try:
+                message = await client.messages.create(
+                    model=CLAUDE_MODEL,
+                    max_tokens=CLAUDE_MAX_TOKENS,
+                    messages=[
                         {
-                            "type": "text",
-                            "text": prompt
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "text",
+                                    "text": prompt
+                                }
+                            ]
                         }
                     ]
-                }
-            ]
-        )
-        if len(message.content) > 0:
-            return message.content[0].text
-        else:
-            logger.error('Claude returned nothing(')
-    except anthropic.AnthropicError as e:
-        logger.error(f"Error getting claude result: {e}")
-        return None
+                )
+            except CLAUDE_RETRY_ERRORS as e:
+                LLM_REQUEST_SECONDS.labels('retry').observe(time.perf_counter() - started)
+                retry_after = get_retry_after(e)
+                if isinstance(e, anthropic.RateLimitError):
+                    await claude_limiter.pause(retry_after or CLAUDE_BACKOFF_BASE)
+                if attempt == CLAUDE_MAX_RETRIES:
+                    logger.error(f"Error getting claude result after {attempt + 1} attempts: {e}")
+                    return None
+                delay = get_backoff_delay(attempt, retry_after)
+                logger.warning(f"Retrying claude request in {delay:.1f}s: {e}")
+            except anthropic.AnthropicError as e:
+                LLM_REQUEST_SECONDS.labels('error').observe(time.perf_counter() - started)
+                logger.error(f"Error getting claude result: {e}")
+                return None
+            else:
+                LLM_REQUEST_SECONDS.labels('success').observe(time.perf_counter() - started)
+                observe_llm_usage(message.usage)
+                reservation.usage = message.usage
+                if len(message.content) > 0:
+                    return message.content[0].text
+                logger.error('Claude returned nothing(')
+                return None
+        await asyncio.sleep(delay)
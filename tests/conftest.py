@@ -1,13 +1,16 @@
 import sys
+from datetime import date
 from pathlib import Path
 import pytest_asyncio
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from src.config import DATABASE_TEST_URL, PG_TEST_DB
-from src.models import Base, AnalyzeRequest, Product
-
 sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
 
+from src.config import DATABASE_TEST_URL, PG_TEST_DB
+from src.models import Base, AnalyzeRequest, Category, Product
+from src.partitions import product_partitions
+from src.service import category_ids
+
 
 @pytest_asyncio.fixture(scope="session", loop_scope="session", autouse=True)
 async def init_db():
@@ -47,6 +50,7 @@ async def clear_database(session: AsyncSession):
         for table in reversed(meta.sorted_tables):
             await session.execute(text(f"DELETE FROM {table.name}"))
     await session.commit()
+    category_ids.clear()
 
 
 @pytest_asyncio.fixture
@@ -56,13 +60,18 @@ async def setup_test_request(session: AsyncSession):
     await session.commit()
 
 
+TEST_REPORT_DATE = date(2024, 1, 1)
+
+
 @pytest_asyncio.fixture
 async def setup_test_products(setup_test_request, session: AsyncSession):
+    await product_partitions.ensure(session.bind, TEST_REPORT_DATE)
+    session.add_all([Category(id=i, name=f"Category{i}") for i in (1, 2, 3)])
     products = [
-        Product(id=1, name="product1", request_id=1, category="Category1", price=10.0, quantity=5),
-        Product(id=2, name="product2", request_id=1, category="Category2", price=15.0, quantity=10),
-        Product(id=3, name="product3", request_id=1, category="Category1", price=20.0, quantity=3),
-        Product(id=4, name="product4", request_id=1, category="Category3", price=5.0, quantity=8),
+        Product(id=1, name="product1", request_id=1, report_date=TEST_REPORT_DATE, category_id=1, price=10.0, quantity=5),
+        Product(id=2, name="product2", request_id=1, report_date=TEST_REPORT_DATE, category_id=2, price=15.0, quantity=10),
+        Product(id=3, name="product3", request_id=1, report_date=TEST_REPORT_DATE, category_id=1, price=20.0, quantity=3),
+        Product(id=4, name="product4", request_id=1, report_date=TEST_REPORT_DATE, category_id=3, price=5.0, quantity=8),
     ]
     session.add_all(products)
     await session.commit()
\ No newline at end of file
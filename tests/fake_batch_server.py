@@ -0,0 +1,103 @@
+"""Local stand-in for the Claude Message Batches API.
+
+Batches end after ended_after_polls retrieves, every request gets "Analysis of <prompt>" unless its
+custom_id is listed in errored_ids.
+"""
+import json
+from datetime import datetime, timezone
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+class FakeBatchServer:
+    def __init__(self, ended_after_polls: int = 1, errored_ids: set[str] | None = None):
+        self.ended_after_polls = ended_after_polls
+        self.errored_ids = errored_ids or set()
+        self.batches: dict[str, dict] = {}
+        app = web.Application()
+        app.router.add_post('/v1/messages/batches', self.create)
+        app.router.add_get('/v1/messages/batches/{batch_id}', self.retrieve)
+        app.router.add_get('/v1/messages/batches/{batch_id}/results', self.results)
+        self.server = TestServer(app)
+
+    @property
+    def url(self) -> str:
+        return str(self.server.make_url(''))
+
+    async def __aenter__(self) -> 'FakeBatchServer':
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.server.close()
+
+    async def create(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        batch_id = f'msgbatch_{len(self.batches) + 1}'
+        self.batches[batch_id] = {'requests': body['requests'], 'polls': 0}
+        return web.json_response(self._batch_json(batch_id))
+
+    async def retrieve(self, request: web.Request) -> web.Response:
+        batch_id = request.match_info['batch_id']
+        if batch_id not in self.batches:
+            return web.json_response({'type': 'error', 'error': {'type': 'not_found_error', 'message': batch_id}}, status=404)
+        self.batches[batch_id]['polls'] += 1
+        return web.json_response(self._batch_json(batch_id))
+
+    async def results(self, request: web.Request) -> web.Response:
+        batch = self.batches[request.match_info['batch_id']]
+        lines = [json.dumps(self._result_json(item)) for item in batch['requests']]
+        return web.Response(body='\n'.join(lines).encode(), content_type='application/binary')
+
+    def _ended(self, batch_id: str) -> bool:
+        return self.batches[batch_id]['polls'] >= self.ended_after_polls
+
+    def _batch_json(self, batch_id: str) -> dict:
+        ended = self._ended(batch_id)
+        count = len(self.batches[batch_id]['requests'])
+        now = datetime.now(timezone.utc).isoformat()
+        return {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': {
+                'processing': 0 if ended else count,
+                'succeeded': count if ended else 0,
+                'errored': 0,
+                'canceled': 0,
+                'expired': 0,
+            },
+            'created_at': now,
+            'expires_at': now,
+            'ended_at': now if ended else None,
+            'archived_at': None,
+            'cancel_initiated_at': None,
+            'results_url': f'{self.url}/v1/messages/batches/{batch_id}/results' if ended else None,
+        }
+
+    def _result_json(self, item: dict) -> dict:
+        if item['custom_id'] in self.errored_ids:
+            return {
+                'custom_id': item['custom_id'],
+                'result': {
+                    'type': 'errored',
+                    'error': {'type': 'error', 'error': {'type': 'invalid_request_error', 'message': 'Bad prompt'}},
+                },
+            }
+        prompt = item['params']['messages'][0]['content'][0]['text']
+        return {
+            'custom_id': item['custom_id'],
+            'result': {
+                'type': 'succeeded',
+                'message': {
+                    'id': f'msg_{item["custom_id"]}',
+                    'type': 'message',
+                    'role': 'assistant',
+                    'model': item['params']['model'],
+                    'content': [{'type': 'text', 'text': f'Analysis of {prompt}'}],
+                    'stop_reason': 'end_turn',
+                    'stop_sequence': None,
+                    'usage': {'input_tokens': 10, 'output_tokens': 10},
+                },
+            },
+        }
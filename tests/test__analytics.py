@@ -0,0 +1,71 @@
+from datetime import date
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.analytics import add_report_to_rollups, get_revenue_trend, get_categories_mix, get_top_products
+from src.models import SalesRollup
+
+
+async def add_report(session: AsyncSession, report_date: date, revenue: float, categories: dict[str, int],
+                     top_products: list[tuple[str, int]]):
+    await add_report_to_rollups(
+        session, report_date,
+        products_count=sum(categories.values()),
+        total_revenue=revenue,
+        categories=categories,
+        category_revenue={category: revenue / len(categories) for category in categories},
+        top_products=top_products,
+    )
+
+
+@pytest_asyncio.fixture
+async def setup_rollups(session: AsyncSession):
+    await add_report(session, date(2024, 1, 15), 100.0, {"A": 1, "B": 1}, [("p1", 10), ("p2", 5)])
+    await add_report(session, date(2024, 1, 15), 50.0, {"A": 2}, [("p1", 3)])
+    await add_report(session, date(2024, 2, 1), 30.0, {"B": 3}, [("p2", 20)])
+    await add_report(session, date(2024, 3, 2), 10.0, {"C": 1}, [("p3", 1)])
+    await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_add_report_to_rollups(session: AsyncSession, setup_rollups):
+    rollups = await session.execute(select(SalesRollup).order_by(SalesRollup.period, SalesRollup.period_start))
+    assert [
+        (r.period, r.period_start, r.reports_count, r.products_count, r.total_revenue) for r in rollups.scalars()
+    ] == [
+        ("day", date(2024, 1, 15), 2, 4, 150.0),
+        ("day", date(2024, 2, 1), 1, 3, 30.0),
+        ("day", date(2024, 3, 2), 1, 1, 10.0),
+        ("month", date(2024, 1, 1), 2, 4, 150.0),
+        ("month", date(2024, 2, 1), 1, 3, 30.0),
+        ("month", date(2024, 3, 1), 1, 1, 10.0),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_revenue_trend(session: AsyncSession, setup_rollups):
+    monthly = await get_revenue_trend(session, "month", date(2024, 1, 20), date(2024, 2, 28))
+    assert [(r.period_start, r.total_revenue) for r in monthly] == [(date(2024, 1, 1), 150.0), (date(2024, 2, 1), 30.0)]
+
+    daily = await get_revenue_trend(session, "day", date(2024, 1, 20), date(2024, 3, 31))
+    assert [(r.period_start, r.total_revenue) for r in daily] == [(date(2024, 2, 1), 30.0), (date(2024, 3, 2), 10.0)]
+
+
+@pytest.mark.asyncio
+async def test_get_categories_mix(session: AsyncSession, setup_rollups):
+    # whole january and february come from monthly rows, march 1-2 from daily ones
+    categories = await get_categories_mix(session, date(2024, 1, 1), date(2024, 3, 2))
+    assert [tuple(row) for row in categories] == [("A", 3, 100.0), ("B", 4, 80.0), ("C", 1, 10.0)]
+
+    categories = await get_categories_mix(session, date(2024, 1, 16), date(2024, 3, 1))
+    assert [tuple(row) for row in categories] == [("B", 3, 30.0)]
+
+
+@pytest.mark.asyncio
+async def test_get_top_products(session: AsyncSession, setup_rollups):
+    top_products = await get_top_products(session, date(2024, 1, 1), date(2024, 12, 31), 2)
+    assert [tuple(row) for row in top_products] == [("p2", 25), ("p1", 13)]
+
+    top_products = await get_top_products(session, date(2024, 1, 15), date(2024, 1, 15), 10)
+    assert [tuple(row) for row in top_products] == [("p1", 13), ("p2", 5)]
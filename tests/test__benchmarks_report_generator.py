@@ -0,0 +1,20 @@
+from benchmarks.report_generator import generate_sales_report, ReportStats
+from src.utils import parse_sales_report_xml
+
+
+def test_generate_sales_report_deterministic():
+    assert b"".join(generate_sales_report(2500, seed=1)) == b"".join(generate_sales_report(2500, seed=1))
+    assert b"".join(generate_sales_report(2500, seed=1)) != b"".join(generate_sales_report(2500, seed=2))
+
+
+def test_generate_sales_report_parsed():
+    stats = ReportStats()
+    report = b"".join(generate_sales_report(2500, categories=7, malformed_rate=0.1, stats=stats))
+    report_date, products = parse_sales_report_xml(report)
+
+    assert stats.products == 2500
+    assert stats.size == len(report)
+    assert 0 < stats.malformed < 2500
+    assert len(products) == stats.valid_products
+    assert len({product["category"] for product in products}) == 7
+    assert round(sum(product["quantity"] * product["price"] for product in products), 2) == round(stats.total_revenue, 2)
@@ -0,0 +1,70 @@
+from unittest.mock import Mock
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.categories import CategoryIds
+from src.models import Category, Product
+from src.partitions import product_partitions
+from src.service import insert_products
+from tests.conftest import TEST_REPORT_DATE
+
+
+async def get_categories(session: AsyncSession) -> dict[str, int]:
+    categories = await session.execute(select(Category.name, Category.id))
+    return dict(categories.all())
+
+
+@pytest.mark.asyncio
+async def test_ensure_creates_categories_in_bulk(session: AsyncSession):
+    category_ids = CategoryIds()
+
+    ids = await category_ids.ensure(session.bind, ["A", "B", "A", None])
+
+    assert ids == await get_categories(session)
+    assert set(ids) == {"A", "B"}
+
+    ids = await CategoryIds().ensure(session.bind, ["B", "C"])
+    assert ids["B"] == category_ids._ids["B"]
+    assert len(await get_categories(session)) == 3
+
+
+@pytest.mark.asyncio
+async def test_ensure_uses_cached_ids(session: AsyncSession):
+    category_ids = CategoryIds()
+    await category_ids.ensure(session.bind, ["A"])
+
+    mock_engine = Mock()
+    ids = await category_ids.ensure(mock_engine, ["A", None])
+
+    assert set(ids) == {"A"}
+    mock_engine.begin.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_warm(session: AsyncSession):
+    await CategoryIds().ensure(session.bind, ["A", "B"])
+    category_ids = CategoryIds()
+
+    await category_ids.warm(session.bind)
+
+    assert len(category_ids) == 2
+    assert category_ids._ids == await get_categories(session)
+
+
+@pytest.mark.asyncio
+async def test_categories_outlive_rolled_back_ingest(session: AsyncSession, setup_test_request):
+    await product_partitions.ensure(session.bind, TEST_REPORT_DATE)
+    await insert_products(
+        session, 1, [{"name": "product1", "quantity": 5, "price": 10.0, "category": "Category1"}], TEST_REPORT_DATE
+    )
+    await session.rollback()
+
+    await insert_products(
+        session, 1, [{"name": "product2", "quantity": 1, "price": 1.0, "category": "Category1"}], TEST_REPORT_DATE
+    )
+    await session.commit()
+
+    products = await session.execute(
+        select(Product.name, Category.name).join(Category, Category.id == Product.category_id)
+    )
+    assert products.all() == [("product2", "Category1")]
@@ -0,0 +1,61 @@
+import gzip
+import io
+import zipfile
+import pytest
+from backports import zstd
+from src.decompress import decompress_report_stream, ReportDecompressError
+
+REPORT = b'<sales_data date="2024-01-01"><products>' + b'<product><name>P</name></product>' * 5000 + b'</products></sales_data>'
+
+
+async def decompress(body: bytes, chunk_size: int = 1000) -> bytes:
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+    return b"".join([chunk async for chunk in decompress_report_stream(chunks())])
+
+
+def make_zip(compression: int, *entries: tuple[str, bytes]) -> bytes:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression) as zip_file:
+        for name, data in entries:
+            zip_file.writestr(name, data)
+    return archive.getvalue()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body", [
+    REPORT,
+    gzip.compress(REPORT),
+    gzip.compress(REPORT[:100]) + gzip.compress(REPORT[100:]),
+    zstd.compress(REPORT),
+    make_zip(zipfile.ZIP_DEFLATED, ("readme.txt", b"readme"), ("report.xml", REPORT)),
+    make_zip(zipfile.ZIP_STORED, ("report.xml", REPORT)),
+], ids=["plain", "gzip", "gzip members", "zstd", "zip", "zip stored"])
+async def test_decompress_report_stream(body):
+    assert await decompress(body) == REPORT
+    assert await decompress(body, chunk_size=3) == REPORT
+
+
+@pytest.mark.asyncio
+async def test_decompress_report_stream_bounded_chunks():
+    chunks = [chunk async for chunk in decompress_report_stream(iter_chunks(gzip.compress(b"0" * 10_000_000)))]
+
+    assert sum(len(chunk) for chunk in chunks) == 10_000_000
+    assert max(len(chunk) for chunk in chunks) <= 64 * 1024
+
+
+async def iter_chunks(body: bytes):
+    yield body
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body", [
+    gzip.compress(REPORT)[:-100],
+    zstd.compress(REPORT)[:-10],
+    make_zip(zipfile.ZIP_DEFLATED, ("report.csv", REPORT)),
+    gzip.compress(REPORT)[:50] + b"broken" + gzip.compress(REPORT)[56:],
+], ids=["gzip truncated", "zstd truncated", "zip without xml", "gzip broken"])
+async def test_decompress_report_stream_error(body):
+    with pytest.raises(ReportDecompressError):
+        await decompress(body)
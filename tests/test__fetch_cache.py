@@ -0,0 +1,176 @@
+import os
+import time
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.fetch_cache import ReportFetch, prune_report_cache, STALE_SPOOL_AGE
+from src.models import ReportFetchCacheEntry
+from src.fetch_cache import ReportNotModified
+
+URL = "http://example.com/report.xml"
+BODY = b'<sales_data date="2024-01-01"><products></products></sales_data>'
+
+
+def mock_download(
+        body: bytes | None, etag: str | None = '"v1"', last_modified: str | None = None, conditional: bool = False
+):
+    calls = []
+
+    async def download(url, headers=None, validators=None):
+        calls.append(headers)
+        if body is None or conditional and headers:
+            raise ReportNotModified(url)
+        validators['etag'] = etag
+        validators['last_modified'] = last_modified
+        yield body[:10]
+        yield body[10:]
+
+    return download, calls
+
+
+async def read(report_fetch: ReportFetch, revalidate: bool, download, replay: bool = True) -> bytes:
+    return b''.join([chunk async for chunk in report_fetch.stream(revalidate, download, replay=replay)])
+
+
+@pytest.mark.asyncio
+async def test_report_fetch_saves_validators(session: AsyncSession):
+    download, calls = mock_download(BODY, last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+    report_fetch = await ReportFetch.load(session, URL)
+
+    assert await read(report_fetch, False, download) == BODY
+    await report_fetch.save(session, "hash")
+    await session.commit()
+
+    assert calls == [None]
+    entry = await session.get(ReportFetchCacheEntry, URL)
+    assert entry.etag == '"v1"'
+    assert entry.last_modified == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert entry.content_hash == "hash"
+    assert entry.body_path is None
+
+
+@pytest.mark.asyncio
+async def test_report_fetch_not_modified(session: AsyncSession):
+    download, _ = mock_download(BODY)
+    report_fetch = await ReportFetch.load(session, URL)
+    await read(report_fetch, False, download)
+    await report_fetch.save(session, "hash")
+    await session.commit()
+
+    download, calls = mock_download(None)
+    report_fetch = await ReportFetch.load(session, URL)
+    assert report_fetch.content_hash == "hash"
+    with pytest.raises(ReportNotModified):
+        await read(report_fetch, True, download, replay=False)
+
+    assert calls == [{"If-None-Match": '"v1"'}]
+    assert report_fetch.not_modified
+
+
+@pytest.mark.asyncio
+async def test_report_fetch_replays_cached_body(session: AsyncSession, tmp_path):
+    download, _ = mock_download(BODY)
+    report_fetch = await ReportFetch.load(session, URL)
+    report_fetch.cache_dir = str(tmp_path)
+    await read(report_fetch, False, download)
+    await report_fetch.save(session, "hash")
+    await session.commit()
+
+    assert os.listdir(tmp_path) == ["hash.xml"]
+
+    download, _ = mock_download(None)
+    report_fetch = await ReportFetch.load(session, URL)
+    report_fetch.cache_dir = str(tmp_path)
+    assert report_fetch.cached_body_path == str(tmp_path / "hash.xml")
+    assert await read(report_fetch, True, download) == BODY
+    await report_fetch.save(session, "hash")
+    await session.commit()
+
+    assert os.listdir(tmp_path) == ["hash.xml"]
+    entry = await session.get(ReportFetchCacheEntry, URL)
+    assert entry.body_path == str(tmp_path / "hash.xml")
+
+
+@pytest.mark.asyncio
+async def test_report_fetch_skips_replay(session: AsyncSession, tmp_path):
+    download, _ = mock_download(BODY)
+    report_fetch = await ReportFetch.load(session, URL)
+    report_fetch.cache_dir = str(tmp_path)
+    await read(report_fetch, False, download)
+    await report_fetch.save(session, "hash")
+    await session.commit()
+
+    download, _ = mock_download(None)
+    report_fetch = await ReportFetch.load(session, URL)
+    report_fetch.cache_dir = str(tmp_path)
+    with pytest.raises(ReportNotModified):
+        await read(report_fetch, True, download, replay=False)
+
+    assert report_fetch.not_modified
+
+
+@pytest.mark.asyncio
+async def test_report_fetch_downloads_evicted_body(session: AsyncSession, tmp_path):
+    download, _ = mock_download(BODY)
+    report_fetch = await ReportFetch.load(session, URL)
+    report_fetch.cache_dir = str(tmp_path)
+    await read(report_fetch, False, download)
+    await report_fetch.save(session, "hash")
+    await session.commit()
+
+    report_fetch = await ReportFetch.load(session, URL)
+    report_fetch.cache_dir = str(tmp_path)
+    assert report_fetch.cached_body_path
+    os.unlink(tmp_path / "hash.xml")
+
+    download, calls = mock_download(BODY, etag='"v2"', conditional=True)
+    assert await read(report_fetch, True, download) == BODY
+    await report_fetch.save(session, "hash")
+    await session.commit()
+
+    assert calls == [{"If-None-Match": '"v1"'}, None]
+    assert not report_fetch.not_modified
+    assert os.listdir(tmp_path) == ["hash.xml"]
+    entry = await session.get(ReportFetchCacheEntry, URL)
+    await session.refresh(entry)
+    assert entry.etag == '"v2"'
+
+
+async def fetch_and_save(session: AsyncSession, url: str, body: bytes, content_hash: str, cache_dir) -> ReportFetch:
+    download, _ = mock_download(body)
+    report_fetch = await ReportFetch.load(session, url)
+    report_fetch.cache_dir = str(cache_dir)
+    await read(report_fetch, False, download)
+    await report_fetch.save(session, content_hash)
+    await session.commit()
+    return report_fetch
+
+
+@pytest.mark.asyncio
+async def test_report_fetch_removes_replaced_body(session: AsyncSession, tmp_path):
+    await fetch_and_save(session, URL, BODY, "hash1", tmp_path)
+    await fetch_and_save(session, URL, BODY + b" ", "hash2", tmp_path)
+
+    assert os.listdir(tmp_path) == ["hash2.xml"]
+
+
+@pytest.mark.asyncio
+async def test_report_fetch_keeps_shared_body(session: AsyncSession, tmp_path):
+    await fetch_and_save(session, URL, BODY, "hash1", tmp_path)
+    await fetch_and_save(session, URL + "?copy", BODY, "hash1", tmp_path)
+    await fetch_and_save(session, URL, BODY + b" ", "hash2", tmp_path)
+
+    assert sorted(os.listdir(tmp_path)) == ["hash1.xml", "hash2.xml"]
+
+
+def test_prune_report_cache(tmp_path):
+    now = time.time()
+    for age, name in enumerate(["new.xml", "old.xml", "oldest.xml"]):
+        (tmp_path / name).write_bytes(b"x" * 10)
+        os.utime(tmp_path / name, (now - age * 60, now - age * 60))
+    (tmp_path / "stale.part").write_bytes(b"x")
+    os.utime(tmp_path / "stale.part", (now - STALE_SPOOL_AGE - 1, now - STALE_SPOOL_AGE - 1))
+    (tmp_path / "active.part").write_bytes(b"x")
+
+    prune_report_cache(str(tmp_path), max_size=15, keep=str(tmp_path / "oldest.xml"))
+
+    assert sorted(os.listdir(tmp_path)) == ["active.part", "oldest.xml"]
@@ -0,0 +1,78 @@
+from unittest.mock import patch
+import anthropic
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.llm_batch import queue_llm_batch_item, submit_llm_batch, poll_llm_batches
+from src.llm_cache import llm_cache
+from src.models import AnalyzeRequest, LLMBatch, LLMBatchItem
+from tests.fake_batch_server import FakeBatchServer
+
+
+@pytest_asyncio.fixture
+async def setup_batch_requests(session: AsyncSession):
+    session.add_all([AnalyzeRequest(id=i, report_url=f"http://example.com/report{i}") for i in (1, 2, 3)])
+    await session.commit()
+    for i in (1, 2, 3):
+        await queue_llm_batch_item(session, i, f"prompt {i}", f"key {i}")
+    await session.commit()
+
+
+def fake_client(server: FakeBatchServer) -> anthropic.AsyncAnthropic:
+    return anthropic.AsyncAnthropic(api_key="test", base_url=server.url, max_retries=0)
+
+
+@pytest.mark.asyncio
+async def test_llm_batch_roundtrip(setup_batch_requests, async_session_maker):
+    llm_cache.clear()
+    async with FakeBatchServer(ended_after_polls=2, errored_ids={"3"}) as server:
+        with patch("src.llm_batch.client", fake_client(server)):
+            async with async_session_maker() as session:
+                batch_id = await submit_llm_batch(session)
+                # nothing is left to submit
+                assert await submit_llm_batch(session) is None
+                assert await poll_llm_batches(session) == []
+                assert await poll_llm_batches(session) == [batch_id]
+                assert await poll_llm_batches(session) == []
+
+    submitted = server.batches[batch_id]["requests"]
+    assert [item["custom_id"] for item in submitted] == ["1", "2", "3"]
+    assert submitted[0]["params"]["messages"][0]["content"][0]["text"] == "prompt 1"
+
+    async with async_session_maker() as session:
+        requests = await session.execute(select(AnalyzeRequest).order_by(AnalyzeRequest.id))
+        assert [(r.status, r.llm_result) for r in requests.scalars()] == [
+            (AnalyzeRequest.STATUS_FINISHED, "Analysis of prompt 1"),
+            (AnalyzeRequest.STATUS_FINISHED, "Analysis of prompt 2"),
+            (AnalyzeRequest.STATUS_ERROR, None),
+        ]
+        assert (await session.get(LLMBatch, batch_id)).status == LLMBatch.STATUS_ENDED
+        assert (await session.execute(select(LLMBatchItem))).scalars().all() == []
+
+        llm_cache.clear()
+        assert await llm_cache.get(session, "key 1") == "Analysis of prompt 1"
+
+
+@pytest.mark.asyncio
+async def test_submit_llm_batch_max_size(setup_batch_requests, async_session_maker):
+    async with FakeBatchServer() as server:
+        with patch("src.llm_batch.client", fake_client(server)):
+            async with async_session_maker() as session:
+                first = await submit_llm_batch(session, max_size=2)
+                second = await submit_llm_batch(session, max_size=2)
+
+    assert [item["custom_id"] for item in server.batches[first]["requests"]] == ["1", "2"]
+    assert [item["custom_id"] for item in server.batches[second]["requests"]] == ["3"]
+
+
+@pytest.mark.asyncio
+async def test_submit_llm_batch_error(setup_batch_requests, async_session_maker):
+    client = anthropic.AsyncAnthropic(api_key="test", base_url="http://127.0.0.1:9", max_retries=0)
+    with patch("src.llm_batch.client", client):
+        async with async_session_maker() as session:
+            assert await submit_llm_batch(session) is None
+
+    async with async_session_maker() as session:
+        items = await session.execute(select(LLMBatchItem.batch_id))
+        assert items.scalars().all() == [None, None, None]
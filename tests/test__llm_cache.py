@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.llm_cache import LLMCache, get_prompt_fingerprint
+from src.models import LLMCacheEntry
+
+
+def test_get_prompt_fingerprint():
+    key = get_prompt_fingerprint("prompt", model="model", max_tokens=100)
+
+    assert key == get_prompt_fingerprint("prompt", model="model", max_tokens=100)
+    assert key != get_prompt_fingerprint("prompt", model="model", max_tokens=200)
+    assert key != get_prompt_fingerprint("prompt", model="other-model", max_tokens=100)
+    assert key != get_prompt_fingerprint("other prompt", model="model", max_tokens=100)
+
+
+def get_lookups(result: str) -> float:
+    return REGISTRY.get_sample_value("llm_cache_lookups_total", {"result": result}) or 0
+
+
+@pytest.mark.asyncio
+async def test_llm_cache_hits_and_misses(session: AsyncSession):
+    cache = LLMCache(max_size=10, ttl=60, db_max_rows=100)
+    lookups = {result: get_lookups(result) for result in ("miss", "memory_hit", "db_hit")}
+
+    assert await cache.get(session, "key") is None
+    await cache.set(session, "key", "result")
+    await session.commit()
+
+    assert await cache.get(session, "key") == "result"
+    cache.clear()
+    assert await cache.get(session, "key") == "result"
+    assert await cache.get(session, "key") == "result"
+
+    assert get_lookups("miss") == lookups["miss"] + 1
+    assert get_lookups("memory_hit") == lookups["memory_hit"] + 2
+    assert get_lookups("db_hit") == lookups["db_hit"] + 1
+
+
+@pytest.mark.asyncio
+async def test_llm_cache_ttl(session: AsyncSession):
+    cache = LLMCache(max_size=10, ttl=60, db_max_rows=100)
+    session.add(LLMCacheEntry(key="key", result="result", created_at=datetime.now(timezone.utc) - timedelta(hours=1)))
+    await session.commit()
+
+    assert await cache.get(session, "key") is None
+
+    await cache.prune(session)
+    await session.commit()
+    entries = await session.execute(select(LLMCacheEntry))
+    assert entries.scalars().all() == []
+
+
+@pytest.mark.asyncio
+async def test_llm_cache_size_eviction(session: AsyncSession):
+    cache = LLMCache(max_size=2, ttl=60, db_max_rows=2)
+    now = datetime.now(timezone.utc)
+    for i in range(3):
+        session.add(LLMCacheEntry(key=f"key{i}", result=f"result{i}", created_at=now - timedelta(seconds=3 - i)))
+    await session.commit()
+
+    for i in range(3):
+        cache._remember(f"key{i}", f"result{i}", now)
+    assert list(cache._entries) == ["key1", "key2"]
+
+    await cache.prune(session)
+    await session.commit()
+    entries = await session.execute(select(LLMCacheEntry.key).order_by(LLMCacheEntry.key))
+    assert entries.scalars().all() == ["key1", "key2"]
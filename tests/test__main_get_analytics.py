@@ -0,0 +1,59 @@
+from datetime import date
+from unittest.mock import patch, AsyncMock
+import pytest
+from httpx import AsyncClient, ASGITransport
+from src.main import app
+from src.models import SalesRollup
+
+
+@pytest.mark.asyncio
+async def test_get_analytics_revenue():
+    rollups = [
+        SalesRollup(period="month", period_start=date(2024, 1, 1), reports_count=2, products_count=4, total_revenue=150.0)
+    ]
+    with patch("src.main.get_revenue_trend", AsyncMock(return_value=rollups)) as mock_trend:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get(
+                "/analytics/revenue", params={"date_from": "2024-01-01", "date_to": "2024-12-31", "period": "month"}
+            )
+
+            assert response.status_code == 200
+            assert response.json() == [
+                {"period_start": "2024-01-01", "reports_count": 2, "products_count": 4, "total_revenue": 150.0}
+            ]
+            assert mock_trend.call_args.args[1:] == ("month", date(2024, 1, 1), date(2024, 12, 31))
+
+
+@pytest.mark.asyncio
+async def test_get_analytics_revenue_invalid_range():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+        response = await client.get("/analytics/revenue", params={"date_from": "2024-02-01", "date_to": "2024-01-01"})
+        assert response.status_code == 422
+
+        response = await client.get(
+            "/analytics/revenue", params={"date_from": "2024-01-01", "date_to": "2024-02-01", "period": "week"}
+        )
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_analytics_categories():
+    with patch("src.main.get_categories_mix", AsyncMock(return_value=[("A", 3, 100.0)])):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get("/analytics/categories", params={"date_from": "2024-01-01", "date_to": "2024-01-31"})
+
+            assert response.status_code == 200
+            assert response.json() == [{"category": "A", "quantity": 3, "revenue": 100.0}]
+
+
+@pytest.mark.asyncio
+async def test_get_analytics_top_products():
+    with patch("src.main.get_top_products", AsyncMock(return_value=[("p1", 13)])) as mock_top:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get(
+                "/analytics/top_products", params={"date_from": "2024-01-01", "date_to": "2024-01-31", "limit": 5}
+            )
+
+            assert response.status_code == 200
+            assert response.json() == [{"name": "p1", "quantity": 13}]
+            assert mock_top.call_args.args[-1] == 5
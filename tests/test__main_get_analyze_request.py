@@ -0,0 +1,95 @@
+from unittest.mock import patch, AsyncMock
+import pytest
+from httpx import AsyncClient, ASGITransport
+from src.main import app
+from src.models import AnalyzeRequest, ReportSummary
+
+
+def make_request(status: str, llm_result: str | None = None) -> AnalyzeRequest:
+    return AnalyzeRequest(id=1, status=status, report_url="http://example.com/report", llm_result=llm_result)
+
+
+@pytest.mark.asyncio
+async def test_get_analyze_request():
+    request = make_request(AnalyzeRequest.STATUS_FINISHED, "Result")
+    with patch("src.main.wait_for_request_status", AsyncMock(return_value=request)) as mock_wait:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get("/analyze_request/1", params={"wait": 10})
+
+            assert response.status_code == 200
+            assert response.json()["status"] == AnalyzeRequest.STATUS_FINISHED
+            assert response.json()["llm_result"] == "Result"
+            assert mock_wait.call_args.args[1:] == (1, 10)
+
+
+@pytest.mark.asyncio
+async def test_get_analyze_request_not_found():
+    with patch("src.main.wait_for_request_status", AsyncMock(return_value=None)):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get("/analyze_request/1")
+
+            assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_get_analyze_request_wait_too_long():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+        response = await client.get("/analyze_request/1", params={"wait": 10 ** 6})
+
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_analyze_request_events():
+    requests = [
+        make_request(AnalyzeRequest.STATUS_CREATED),
+        make_request(AnalyzeRequest.STATUS_CREATED),
+        make_request(AnalyzeRequest.STATUS_FINISHED, "Result"),
+    ]
+    with patch("src.main.wait_for_request_status", AsyncMock(side_effect=requests)):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get("/analyze_request/1/events")
+
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+
+            messages = response.text.strip().split("\n\n")
+            assert len(messages) == 3
+            assert messages[0].startswith("event: status\ndata: ")
+            assert AnalyzeRequest.STATUS_CREATED in messages[0]
+            assert messages[1] == ": keepalive"
+            assert AnalyzeRequest.STATUS_FINISHED in messages[2]
+
+
+@pytest.mark.asyncio
+async def test_get_analyze_request_summary():
+    request = AnalyzeRequest(id=2, source_request_id=1, report_url="http://example.com/report")
+    summary = ReportSummary(
+        request_id=1, products_count=2, total_revenue=150.0,
+        top_products=[{"name": "product1", "quantity": 10}], categories={"Category1": 15},
+    )
+    with patch("src.main.get_request_by_id", AsyncMock(return_value=request)), \
+            patch("src.main.get_report_summary", AsyncMock(return_value=summary)) as mock_get_summary:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get("/analyze_request/2/summary")
+
+            assert response.status_code == 200
+            assert response.json() == {
+                "request_id": 1,
+                "products_count": 2,
+                "total_revenue": 150.0,
+                "top_products": [{"name": "product1", "quantity": 10}],
+                "categories": {"Category1": 15},
+            }
+            assert mock_get_summary.call_args.args[1] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_analyze_request_summary_not_ready():
+    request = AnalyzeRequest(id=1, report_url="http://example.com/report")
+    with patch("src.main.get_request_by_id", AsyncMock(return_value=request)), \
+            patch("src.main.get_report_summary", AsyncMock(return_value=None)):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.get("/analyze_request/1/summary")
+
+            assert response.status_code == 404
@@ -0,0 +1,17 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from src.main import app
+
+
+@pytest.mark.asyncio
+async def test_get_metrics():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+        await client.get("/analytics/revenue", params={"date_from": "2024-02-01", "date_to": "2024-01-01"})
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "report_download_seconds_bucket" in response.text
+    assert "llm_request_seconds" in response.text
+    assert 'http_request_seconds_count{method="GET",route="/analytics/revenue",status="422"}' in response.text
+
@@ -0,0 +1,44 @@
+import os
+from functools import partial
+from unittest.mock import patch
+import pytest
+from httpx import AsyncClient, ASGITransport
+from src.main import app, save_uploaded_report
+from src.models import AnalyzeRequest
+
+
+@pytest.mark.asyncio
+async def test_post_upload_report(tmp_path):
+    report = b'<sales_data date="2024-01-01"><products></products></sales_data>'
+    analyze_request = AnalyzeRequest(id=1, status=AnalyzeRequest.STATUS_CREATED, report_url=None)
+
+    async def body():
+        yield report[:10]
+        yield report[10:]
+
+    with patch("src.main.enqueue_analyze_report") as mock_analyze_report, \
+            patch("src.main.save_uploaded_report", partial(save_uploaded_report, upload_dir=str(tmp_path))), \
+            patch("src.main.create_uploaded_analyze_request", return_value=analyze_request) as mock_create_request:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.post("/upload_report/", content=body(), headers={"Content-Type": "application/xml"})
+
+    assert response.status_code == 200
+    assert response.json()["id"] == 1
+    assert response.json()["report_url"] is None
+    report_path = mock_create_request.call_args.args[1]
+    assert os.path.dirname(report_path) == str(tmp_path)
+    with open(report_path, "rb") as report_file:
+        assert report_file.read() == report
+    mock_analyze_report.assert_called_once_with(1)
+
+
+@pytest.mark.asyncio
+async def test_post_upload_report_too_large(tmp_path):
+    with patch("src.main.enqueue_analyze_report") as mock_analyze_report, \
+            patch("src.main.save_uploaded_report", partial(save_uploaded_report, upload_dir=str(tmp_path), max_size=10)):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.post("/upload_report/", content=b"0" * 100)
+
+    assert response.status_code == 413
+    assert os.listdir(tmp_path) == []
+    mock_analyze_report.assert_not_called()
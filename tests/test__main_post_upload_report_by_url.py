@@ -9,7 +9,7 @@ from src.models import AnalyzeRequest
 async def test_post_upload_report_by_url():
     url = "http://example.com/report.xml"
     analyze_request = AnalyzeRequest(id=1, status=AnalyzeRequest.STATUS_CREATED, report_url=url)
-    with patch("src.main.analyze_report.delay") as mock_analyze_report:
+    with patch("src.main.enqueue_analyze_report") as mock_analyze_report:
         with patch("src.main.create_analyze_request", return_value=analyze_request) as mock_create_request:
             async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
                 payload = {"url": url}
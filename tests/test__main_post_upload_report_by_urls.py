@@ -0,0 +1,51 @@
+import threading
+from unittest.mock import patch
+import pytest
+from httpx import AsyncClient, ASGITransport
+from src.main import app
+from src.models import AnalyzeRequest
+
+
+@pytest.mark.asyncio
+async def test_post_upload_report_by_urls():
+    urls = ["http://example.com/report1.xml", "http://example.com/report2.xml"]
+    analyze_requests = [
+        AnalyzeRequest(id=i, status=AnalyzeRequest.STATUS_CREATED, report_url=url) for i, url in enumerate(urls, 1)
+    ]
+    with patch("src.main.enqueue_analyze_reports") as mock_enqueue:
+        with patch("src.main.create_analyze_requests", return_value=analyze_requests) as mock_create_requests:
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+                response = await client.post("/upload_report_urls/", json={"urls": urls})
+
+                assert response.status_code == 200
+
+                data = response.json()
+                assert [request["id"] for request in data] == [1, 2]
+                assert [request["report_url"] for request in data] == urls
+
+                mock_create_requests.assert_called_once()
+                mock_enqueue.assert_called_once_with([1, 2], llm_batch=False)
+
+
+@pytest.mark.asyncio
+async def test_post_upload_report_by_urls_publishes_off_loop():
+    analyze_requests = [AnalyzeRequest(id=1, status=AnalyzeRequest.STATUS_CREATED, report_url="http://example.com/a.xml")]
+    publish_threads = []
+    with patch("src.main.enqueue_analyze_reports", lambda *args, **kwargs: publish_threads.append(threading.get_ident())), \
+            patch("src.main.create_analyze_requests", return_value=analyze_requests):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.post("/upload_report_urls/", json={"urls": ["http://example.com/a.xml"]})
+
+    assert response.status_code == 200
+    assert len(publish_threads) == 1
+    assert publish_threads[0] != threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_post_upload_report_by_urls_empty():
+    with patch("src.main.enqueue_analyze_reports") as mock_enqueue:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+            response = await client.post("/upload_report_urls/", json={"urls": []})
+
+            assert response.status_code == 422
+            mock_enqueue.assert_not_called()
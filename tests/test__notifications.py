@@ -0,0 +1,104 @@
+import asyncio
+import time
+from unittest.mock import patch
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import DATABASE_TEST_URL, PG_TEST_DB
+from src.models import AnalyzeRequest
+from src.notifications import RequestStatusListener, get_listener_dsn, wait_for_request_status
+from src.service import notify_request_status
+
+
+@pytest_asyncio.fixture
+async def listener():
+    listener = RequestStatusListener(get_listener_dsn(DATABASE_TEST_URL + PG_TEST_DB))
+    await listener.start()
+    yield listener
+    await listener.stop()
+
+
+async def finish_request(async_session_maker, request_id: int):
+    async with async_session_maker() as session:
+        request = await session.get(AnalyzeRequest, request_id)
+        request.status = AnalyzeRequest.STATUS_FINISHED
+        request.llm_result = "Result"
+        await notify_request_status(session, request_id)
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_listener_notifies_subscribers(listener, async_session_maker):
+    with listener.subscribe(1) as changed, listener.subscribe(2) as other:
+        async with async_session_maker() as session:
+            await notify_request_status(session, 1)
+            assert not changed.is_set()
+            await session.commit()
+
+        await asyncio.wait_for(changed.wait(), 5)
+        assert not other.is_set()
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnects(listener, async_session_maker):
+    with patch("src.notifications.REQUEST_POLL_INTERVAL", 0.05), patch("src.notifications.logger") as mock_logger:
+        async with async_session_maker() as session:
+            await session.execute(
+                text("SELECT pg_terminate_backend(:pid)"), {"pid": listener._connection.get_server_pid()}
+            )
+
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if mock_logger.info.called:
+                break
+        assert listener.connected
+
+    assert "lost its connection" in mock_logger.warning.call_args[0][0]
+    mock_logger.info.assert_called_once_with("Request status listener reconnected")
+
+    with listener.subscribe(1) as changed:
+        async with async_session_maker() as session:
+            await notify_request_status(session, 1)
+            await session.commit()
+
+        await asyncio.wait_for(changed.wait(), 5)
+
+
+@pytest.mark.asyncio
+async def test_listener_starts_without_database():
+    listener = RequestStatusListener("postgresql://postgres@127.0.0.1:1/nodb")
+    with patch("src.notifications.logger") as mock_logger:
+        await listener.start()
+        await listener.stop()
+
+    assert not listener.connected
+    assert "falling back to polling" in mock_logger.warning.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_wait_for_request_status(setup_test_request, listener, async_session_maker, session: AsyncSession):
+    started = time.monotonic()
+    with patch("src.notifications.REQUEST_POLL_INTERVAL", 60):
+        waiter = asyncio.create_task(wait_for_request_status(session, 1, 30, listener))
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+
+        await finish_request(async_session_maker, 1)
+        request = await asyncio.wait_for(waiter, 5)
+
+    assert request.status == AnalyzeRequest.STATUS_FINISHED
+    assert request.llm_result == "Result"
+    assert time.monotonic() - started < 5
+
+
+@pytest.mark.asyncio
+async def test_wait_for_request_status_timeout(setup_test_request, listener, session: AsyncSession):
+    request = await wait_for_request_status(session, 1, 0.2, listener)
+
+    assert request.status == AnalyzeRequest.STATUS_CREATED
+
+
+@pytest.mark.asyncio
+async def test_wait_for_request_status_not_found(listener, session: AsyncSession):
+    assert await wait_for_request_status(session, 1, 10, listener) is None
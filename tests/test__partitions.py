@@ -0,0 +1,67 @@
+from datetime import date
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models import Product
+from src.partitions import ProductPartitions, get_month_bounds, get_partition_name
+from src.service import insert_products
+
+
+async def get_partition_names(session: AsyncSession) -> list[str]:
+    partitions = await session.execute(text(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'product'::regclass ORDER BY 1"
+    ))
+    return partitions.scalars().all()
+
+
+def test_get_month_bounds():
+    assert get_month_bounds(date(2024, 2, 15)) == (date(2024, 2, 1), date(2024, 3, 1))
+    assert get_month_bounds(date(2024, 12, 31)) == (date(2024, 12, 1), date(2025, 1, 1))
+
+
+def test_get_partition_name():
+    assert get_partition_name(date(2024, 2, 15)) == "product_2024_02"
+
+
+@pytest.mark.asyncio
+async def test_ensure_partition(session: AsyncSession, setup_test_request):
+    partitions = ProductPartitions()
+    await partitions.ensure(session.bind, date(2020, 5, 10))
+    await partitions.ensure(session.bind, date(2020, 5, 20))
+    await ProductPartitions().ensure(session.bind, date(2020, 5, 1))
+
+    assert "product_2020_05" in await get_partition_names(session)
+
+    product = {"name": "product1", "quantity": 5, "price": 10.0, "category": "Category1"}
+    await insert_products(session, 1, [product], date(2020, 5, 31))
+    await session.commit()
+
+    rows = await session.execute(text("SELECT name FROM product_2020_05"))
+    assert rows.scalars().all() == ["product1"]
+    await session.commit()
+
+    await partitions.drop_expired(session.bind, date(2020, 6, 1))
+
+
+@pytest.mark.asyncio
+async def test_drop_expired_partitions(session: AsyncSession, setup_test_request):
+    partitions = ProductPartitions()
+    for report_date in (date(2020, 1, 15), date(2020, 2, 15), date(2020, 3, 15)):
+        await partitions.ensure(session.bind, report_date)
+        await insert_products(
+            session, 1, [{"name": "product", "quantity": 1, "price": 1.0, "category": "A"}], report_date
+        )
+    await session.commit()
+
+    dropped = await partitions.drop_expired(session.bind, date(2020, 3, 1))
+
+    assert dropped == ["product_2020_01", "product_2020_02"]
+    names = await get_partition_names(session)
+    assert "product_2020_01" not in names
+    assert "product_2020_03" in names
+
+    products = await session.execute(select(Product.report_date))
+    assert products.scalars().all() == [date(2020, 3, 15)]
+    await session.commit()
+
+    await partitions.drop_expired(session.bind, date(2020, 4, 1))
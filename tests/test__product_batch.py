@@ -0,0 +1,51 @@
+import pytest
+from src.product_batch import ProductBatch
+
+PRODUCTS = [
+    {"name": "product1", "quantity": 5, "price": 10.0, "category": "Category1"},
+    {"name": "product2", "quantity": 10, "price": 15.5, "category": "Category2"},
+    {"name": "product3", "quantity": 3, "price": 20.0, "category": "Category1"},
+]
+
+
+def test_product_batch_rows():
+    batch = ProductBatch.from_dicts(PRODUCTS)
+
+    assert len(batch) == 3
+    assert batch[1] == PRODUCTS[1]
+    assert list(batch) == PRODUCTS
+    assert list(batch.rows())[2] == ("product3", 3, 20.0, "Category1")
+    assert batch == PRODUCTS
+    assert batch != PRODUCTS[:2]
+
+
+def test_product_batch_interns_strings():
+    strings = {}
+    first, second = ProductBatch(strings), ProductBatch(strings)
+    first.append("Laptop", 1, 1.0, "".join(["Electro", "nics"]))
+    second.append("Mouse", 1, 1.0, "".join(["Electro", "nics"]))
+
+    assert first.categories[0] is second.categories[0]
+
+
+def test_product_batch_slices():
+    batch = ProductBatch.from_dicts(PRODUCTS)
+
+    assert batch[1:] == PRODUCTS[1:]
+    assert [list(chunk) for chunk in batch.chunks(2)] == [PRODUCTS[:2], PRODUCTS[2:]]
+
+    merged = ProductBatch()
+    for chunk in batch.chunks(2):
+        merged.extend(chunk)
+    assert merged == batch
+
+
+def test_product_batch_rejects_quantity_out_of_range():
+    batch = ProductBatch.from_dicts(PRODUCTS)
+
+    with pytest.raises(OverflowError):
+        batch.append("product4", 2 ** 31, 1.0, "Category1")
+    with pytest.raises(OverflowError):
+        batch.append("product4", -2 ** 31 - 1, 1.0, "Category1")
+
+    assert batch == PRODUCTS
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine
+from src.config import DATABASE_TEST_URL, PG_TEST_DB
+from src.models import RateLimitBucket
+from src.rate_limit import TokenBucket, ClaudeRateLimiter, estimate_claude_tokens
+
+
+@pytest_asyncio.fixture
+async def test_engine():
+    engine = create_async_engine(DATABASE_TEST_URL + PG_TEST_DB)
+    yield engine
+    await engine.dispose()
+
+
+def test_estimate_claude_tokens():
+    assert estimate_claude_tokens("a" * 300, 1000) == 1100
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_reserve(test_engine):
+    bucket = TokenBucket("test", per_minute=60)
+
+    assert await bucket.reserve(test_engine, 59) == 0.0
+    assert await bucket.reserve(test_engine, 1) == 0.0
+    # the bucket is empty, 3 more tokens are refilled in about 3 seconds
+    assert 2.5 < await bucket.reserve(test_engine, 3) <= 3.0
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_is_shared(test_engine):
+    first, second = TokenBucket("test", per_minute=60), TokenBucket("test", per_minute=60)
+
+    assert await first.reserve(test_engine, 60) == 0.0
+    assert await second.reserve(test_engine, 6) > 5.0
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_refund_and_drain(test_engine, session):
+    bucket = TokenBucket("test", per_minute=60)
+    await bucket.reserve(test_engine, 60)
+    await bucket.refund(test_engine, 30)
+    assert await bucket.reserve(test_engine, 30) == 0.0
+
+    await bucket.drain(test_engine, 10)
+    assert await bucket.reserve(test_engine, 1) > 10.0
+
+    await bucket.refund(test_engine, 1000)
+    entry = await session.get(RateLimitBucket, "test")
+    assert entry.tokens == 60.0
+
+
+@pytest.mark.asyncio
+async def test_claude_rate_limiter_settles_tokens(test_engine, session):
+    limiter = ClaudeRateLimiter(test_engine, requests_per_minute=60, tokens_per_minute=6000, max_in_flight=2)
+
+    async with limiter.acquire(1000) as reservation:
+        reservation.usage = SimpleNamespace(input_tokens=100, output_tokens=200)
+
+    requests = await session.get(RateLimitBucket, "claude_requests")
+    tokens = await session.get(RateLimitBucket, "claude_tokens")
+    assert round(requests.tokens) == 59
+    assert round(tokens.tokens) == 5700
+
+
+@pytest.mark.asyncio
+async def test_claude_rate_limiter_in_flight(test_engine):
+    limiter = ClaudeRateLimiter(test_engine, requests_per_minute=0, tokens_per_minute=0, max_in_flight=2)
+    in_flight = max_in_flight = 0
+
+    async def call():
+        nonlocal in_flight, max_in_flight
+        async with limiter.acquire(1000):
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    await asyncio.gather(*(call() for _ in range(10)))
+
+    assert max_in_flight == 2
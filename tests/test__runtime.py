@@ -0,0 +1,75 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, AsyncMock
+import pytest
+from src.runtime import WorkerRuntime
+from src.tasks import analyze_report
+
+
+async def get_running_loop():
+    return asyncio.get_running_loop()
+
+
+async def fail():
+    raise ValueError("task failed")
+
+
+def test_worker_runtime_reuses_loop():
+    runtime = WorkerRuntime()
+    with patch("src.runtime.client", AsyncMock()) as mock_client, \
+            patch("src.runtime.start_http_session", AsyncMock()) as mock_start_http_session, \
+            patch("src.runtime.close_http_session", AsyncMock()) as mock_close_http_session:
+        runtime.start()
+        try:
+            first_loop = runtime.run(get_running_loop())
+            with pytest.raises(ValueError):
+                runtime.run(fail())
+            second_loop = runtime.run(get_running_loop())
+        finally:
+            runtime.stop()
+
+        assert first_loop is second_loop
+        assert first_loop.is_closed()
+        assert runtime.loop is None
+        mock_start_http_session.assert_awaited_once()
+        mock_close_http_session.assert_awaited_once()
+        mock_client.close.assert_awaited_once()
+
+
+def test_analyze_report_runs_in_runtime():
+    with patch("src.tasks.runtime") as mock_runtime, \
+            patch("src.tasks.analyze_report_async", AsyncMock(return_value=1)):
+        mock_runtime.run.side_effect = lambda coro: asyncio.run(coro)
+
+        assert analyze_report(1) == 1
+        mock_runtime.run.assert_called_once()
+
+
+def test_worker_runtime_runs_tasks_from_threads_concurrently():
+    runtime = WorkerRuntime()
+    tasks_count = 20
+    in_flight = 0
+    all_started = None
+
+    async def analyze_report_async(request_id, llm_batch=False):
+        nonlocal in_flight, all_started
+        all_started = all_started or asyncio.Event()
+        in_flight += 1
+        if in_flight == tasks_count:
+            all_started.set()
+        # completes only when every task is waiting on the loop at the same time
+        await asyncio.wait_for(all_started.wait(), 5)
+        return request_id
+
+    with patch("src.runtime.client", AsyncMock()), \
+            patch("src.runtime.start_http_session", AsyncMock()), \
+            patch("src.runtime.close_http_session", AsyncMock()), \
+            patch("src.tasks.runtime", runtime), \
+            patch("src.tasks.analyze_report_async", analyze_report_async):
+        try:
+            with ThreadPoolExecutor(max_workers=tasks_count) as executor:
+                results = list(executor.map(analyze_report, range(tasks_count)))
+        finally:
+            runtime.stop()
+
+    assert results == list(range(tasks_count))
@@ -1,13 +1,21 @@
 import pytest
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from src.schemas import UploadReportSchema
+from src.models import Category, Product
+from src.partitions import product_partitions
+from src.schemas import UploadReportSchema, UploadReportsSchema
 from src.service import (
     create_analyze_request,
+    create_analyze_requests,
     get_request_by_id,
     get_total_revenue,
     get_top3_products,
     get_categories_distribution,
+    insert_products,
+    save_report_summary,
+    get_report_summary,
 )
+from tests.conftest import TEST_REPORT_DATE
 
 @pytest.mark.asyncio
 async def test_create_analyze_request(session: AsyncSession):
@@ -18,6 +26,17 @@ async def test_create_analyze_request(session: AsyncSession):
     assert new_request.report_url == "http://example.com/new-report"
 
 
+@pytest.mark.asyncio
+async def test_create_analyze_requests(session: AsyncSession):
+    urls = [f"http://example.com/report{i}" for i in range(5)]
+    new_requests = await create_analyze_requests(session, UploadReportsSchema(urls=urls))
+
+    assert [request.report_url for request in new_requests] == urls
+    assert all(request.id is not None for request in new_requests)
+    assert len({request.id for request in new_requests}) == len(urls)
+    assert all(request.status == "status_created" for request in new_requests)
+
+
 @pytest.mark.asyncio
 async def test_get_request_by_id(session: AsyncSession, setup_test_products):
     fetched_request = await get_request_by_id(session, 1)
@@ -35,6 +54,12 @@ async def test_get_total_revenue(session: AsyncSession, setup_test_products):
     assert revenue == expected_revenue
 
 
+@pytest.mark.asyncio
+async def test_get_total_revenue_by_report_date(session: AsyncSession, setup_test_products):
+    assert await get_total_revenue(session, 1, TEST_REPORT_DATE) == 300.0
+    assert await get_total_revenue(session, 1, TEST_REPORT_DATE.replace(day=2)) == 0.0
+
+
 @pytest.mark.asyncio
 async def test_get_top3_products(session: AsyncSession, setup_test_products):
     top3_products = await get_top3_products(session, 1)
@@ -58,3 +83,61 @@ async def test_get_categories_distribution(session: AsyncSession, setup_test_pro
     for actual, expected in zip(categories_distribution, expected_distribution):
         assert actual[0] == expected[0]  # Category
         assert actual[1] == expected[1]  # Quantity
+
+
+@pytest.mark.asyncio
+async def test_insert_products(session: AsyncSession, setup_test_request):
+    products = [
+        {"name": "product1", "quantity": 5, "price": 10.0, "category": "Category1"},
+        {"name": "product2", "quantity": 10, "price": 15.0, "category": "Category2"},
+    ]
+
+    await product_partitions.ensure(session.bind, TEST_REPORT_DATE)
+    # the first batch starts the transaction with a regular INSERT, the next one goes through COPY
+    await insert_products(session, 1, products[:1], TEST_REPORT_DATE)
+    await insert_products(session, 1, products[1:], TEST_REPORT_DATE)
+    await session.commit()
+
+    inserted = await session.execute(
+        select(
+            Product.request_id, Product.report_date, Product.name, Product.quantity, Product.price, Category.name
+        ).join(Category, Category.id == Product.category_id).order_by(Product.id)
+    )
+    assert inserted.all() == [
+        (1, TEST_REPORT_DATE, "product1", 5, 10.0, "Category1"),
+        (1, TEST_REPORT_DATE, "product2", 10, 15.0, "Category2"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_insert_products_rollback(session: AsyncSession, setup_test_request):
+    await product_partitions.ensure(session.bind, TEST_REPORT_DATE)
+    await get_request_by_id(session, 1)
+    await insert_products(
+        session, 1, [{"name": "product1", "quantity": 5, "price": 10.0, "category": "Category1"}], TEST_REPORT_DATE
+    )
+    await session.rollback()
+
+    inserted = await session.execute(select(Product))
+    assert inserted.scalars().all() == []
+
+
+@pytest.mark.asyncio
+async def test_save_report_summary(session: AsyncSession, setup_test_request):
+    await save_report_summary(
+        session, 1, products_count=2, total_revenue=150.0,
+        top_products=[("product1", 10), ("product2", 5)], categories={"Category1": 15},
+    )
+    await session.commit()
+    session.expunge_all()
+
+    summary = await get_report_summary(session, 1)
+    assert summary.products_count == 2
+    assert summary.total_revenue == 150.0
+    assert summary.top_products == [{"name": "product1", "quantity": 10}, {"name": "product2", "quantity": 5}]
+    assert summary.categories == {"Category1": 15}
+
+
+@pytest.mark.asyncio
+async def test_get_report_summary_missing(session: AsyncSession, setup_test_request):
+    assert await get_report_summary(session, 1) is None
@@ -1,11 +1,38 @@
+import gzip
+import hashlib
+import os
 import pytest
 from unittest.mock import Mock, patch, AsyncMock
 from datetime import datetime
 
-from sqlalchemy import select
+from sqlalchemy import select, text
 
-from src.tasks import analyze_report_async
-from src.models import AnalyzeRequest, Product
+from src.tasks import (
+    analyze_report_async, insert_products, llm_cache, product_partitions, ReportDownloadError, ReportFetch,
+    ReportNotModified,
+)
+from src.models import AnalyzeRequest, Product, ReportSummary, SalesRollup, CategoryRollup, LLMBatchItem
+
+
+@pytest.fixture(autouse=True)
+def clear_llm_cache():
+    llm_cache.clear()
+
+
+def make_report_xml(report_date: str, products: list[dict]) -> bytes:
+    products_xml = ''.join(
+        f'<product><name>{p["name"]}</name><quantity>{p["quantity"]}</quantity>'
+        f'<price>{p["price"]}</price><category>{p["category"]}</category></product>'
+        for p in products
+    )
+    return f'<sales_data date="{report_date}"><products>{products_xml}</products></sales_data>'.encode()
+
+
+def mock_stream_report(*chunks: bytes):
+    async def stream_report(url, **kwargs):
+        for chunk in chunks:
+            yield chunk
+    return stream_report
 
 
 @pytest.mark.asyncio
@@ -14,24 +41,19 @@ async def test_analyze_report_success(async_session_maker, setup_test_request):
     mock_request = Mock(
         id=1,
         report_url="http://example.com/report.xml",
+        report_path=None,
         status=AnalyzeRequest.STATUS_CREATED
     )
     mock_products = [
         {"name": "Product1", "quantity": 10, "price": 100, "category": "A"},
         {"name": "Product2", "quantity": 5, "price": 200, "category": "B"}
     ]
-    mock_top_products = [Mock(name="Product1"), Mock(name="Product2")]
 
     # Setup mocks
     with patch("src.tasks.async_session_maker", async_session_maker), \
             patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
-            patch("src.tasks.download_report", AsyncMock(return_value="<xml>report</xml>")), \
-            patch("src.tasks.parse_sales_report_xml", return_value=(report_date, mock_products)), \
-            patch("src.tasks.get_total_revenue", AsyncMock(return_value=1500)), \
-            patch("src.tasks.get_top3_products", AsyncMock(return_value=mock_top_products)), \
-            patch("src.tasks.get_categories_distribution",
-                  AsyncMock(return_value=[("A", 10), ("B", 5)])), \
-            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis complete")):
+            patch("src.tasks.stream_report", mock_stream_report(make_report_xml("2024-01-01", mock_products))), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis complete")) as mock_claude:
         result = await analyze_report_async(mock_request.id)
 
         # Assertions
@@ -40,6 +62,11 @@ async def test_analyze_report_success(async_session_maker, setup_test_request):
         assert mock_request.report_date == report_date
         assert mock_request.llm_result == "Analysis complete"
 
+        prompt = mock_claude.call_args[0][0]
+        assert "Общая выручка: 2000.0" in prompt
+        assert "Топ-3 товара по продажам: Product1, Product2" in prompt
+        assert "Распределение по категориям: A: 10 pcs, B: 5 pcs" in prompt
+
 
 @pytest.mark.asyncio
 async def test_analyze_report_no_request(async_session_maker):
@@ -51,30 +78,33 @@ async def test_analyze_report_no_request(async_session_maker):
 
 @pytest.mark.asyncio
 async def test_analyze_report_download_error(async_session_maker):
-    mock_request = Mock(id=1, report_url="http://example.com/report.xml")
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+
+    async def failing_stream_report(url, **kwargs):
+        raise ReportDownloadError("Network error")
+        yield
 
     with patch("src.tasks.async_session_maker", async_session_maker), \
             patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
-            patch("src.tasks.download_report", AsyncMock(return_value=None)):
+            patch("src.tasks.stream_report", failing_stream_report):
         await analyze_report_async(1)
         assert mock_request.status == AnalyzeRequest.STATUS_ERROR
 
 
 @pytest.mark.asyncio
 async def test_analyze_report_parse_error(async_session_maker):
-    mock_request = Mock(id=1, report_url="http://example.com/report.xml")
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
 
     with patch("src.tasks.async_session_maker", async_session_maker), \
             patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
-            patch("src.tasks.download_report", AsyncMock(return_value="<xml>report</xml>")), \
-            patch("src.tasks.parse_sales_report_xml", return_value=(None, None)):
+            patch("src.tasks.stream_report", mock_stream_report(b"<xml>report</xml>")):
         await analyze_report_async(1)
         assert mock_request.status == AnalyzeRequest.STATUS_ERROR
 
 
 @pytest.mark.asyncio
 async def test_analyze_report_claude_error(setup_test_request, async_session_maker):
-    mock_request = Mock(id=1, report_url="http://example.com/report.xml")
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
 
     mock_products = [
         {"name": "Product1", "quantity": 10, "price": 100, "category": "A"}
@@ -82,14 +112,7 @@ async def test_analyze_report_claude_error(setup_test_request, async_session_mak
 
     with patch("src.tasks.async_session_maker", async_session_maker), \
             patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
-            patch("src.tasks.download_report", AsyncMock(return_value="<xml>report</xml>")), \
-            patch("src.tasks.parse_sales_report_xml",
-                  return_value=(datetime(2024, 1, 1), mock_products)), \
-            patch("src.tasks.get_total_revenue", AsyncMock(return_value=1000)), \
-            patch("src.tasks.get_top3_products",
-                  AsyncMock(return_value=[Mock(name="Product1")])), \
-            patch("src.tasks.get_categories_distribution",
-                  AsyncMock(return_value=[("A", 10)])), \
+            patch("src.tasks.stream_report", mock_stream_report(make_report_xml("2024-01-01", mock_products))), \
             patch("src.tasks.get_claude_result", AsyncMock(return_value=None)):
         await analyze_report_async(1)
 
@@ -98,27 +121,331 @@ async def test_analyze_report_claude_error(setup_test_request, async_session_mak
 
 @pytest.mark.asyncio
 async def test_product_creation(setup_test_request, async_session_maker):
-    mock_request = Mock(id=1, report_url="http://example.com/report.xml")
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
 
     mock_products = [
         {"name": "Product1", "quantity": 10, "price": 100, "category": "A"},
         {"name": "Product2", "quantity": 5, "price": 200, "category": "B"}
     ]
+    report_xml = make_report_xml("2024-01-01", mock_products)
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
+            patch("src.tasks.stream_report", mock_stream_report(report_xml[:50], report_xml[50:])), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        await analyze_report_async(1)
+
+    async with async_session_maker() as async_session:
+        products = await async_session.execute(select(Product))
+        products = products.scalars().all()
+        assert len(products) == len(mock_products)
+
+
+@pytest.mark.asyncio
+async def test_product_creation_dropped_partition(setup_test_request, async_session_maker):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+    mock_products = [{"name": "Product1", "quantity": 10, "price": 100, "category": "A"}]
+
+    async with async_session_maker() as async_session:
+        await product_partitions.ensure(async_session.bind, datetime(2019, 3, 1).date())
+        # dropped by the retention task of another process
+        await async_session.execute(text("ALTER TABLE product DETACH PARTITION product_2019_03"))
+        await async_session.execute(text("DROP TABLE product_2019_03"))
+        await async_session.commit()
 
     with patch("src.tasks.async_session_maker", async_session_maker), \
             patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
-            patch("src.tasks.download_report", AsyncMock(return_value="<xml>report</xml>")), \
-            patch("src.tasks.parse_sales_report_xml",
-                  return_value=(datetime(2024, 1, 1), mock_products)), \
-            patch("src.tasks.get_total_revenue", AsyncMock(return_value=1000)), \
-            patch("src.tasks.get_top3_products",
-                  AsyncMock(return_value=[Mock(name="Product1")])), \
-            patch("src.tasks.get_categories_distribution",
-                  AsyncMock(return_value=[("A", 10)])), \
+            patch("src.tasks.stream_report", mock_stream_report(make_report_xml("2019-03-01", mock_products))), \
             patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
         await analyze_report_async(1)
 
+    assert mock_request.status == AnalyzeRequest.STATUS_FINISHED
     async with async_session_maker() as async_session:
         products = await async_session.execute(select(Product))
+        assert [product.name for product in products.scalars()] == ["Product1"]
+
+
+@pytest.mark.asyncio
+async def test_report_summary_creation(setup_test_request, async_session_maker):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+
+    mock_products = [
+        {"name": "Product1", "quantity": 10, "price": 100, "category": "A"},
+        {"name": "Product2", "quantity": 5, "price": 200, "category": "B"},
+        {"name": "Product3", "quantity": 1, "price": 50, "category": "A"},
+        {"name": "Product4", "quantity": 7, "price": 10, "category": "C"},
+    ]
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
+            patch("src.tasks.stream_report", mock_stream_report(make_report_xml("2024-01-01", mock_products))), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        await analyze_report_async(1)
+
+    async with async_session_maker() as async_session:
+        summary = await async_session.get(ReportSummary, 1)
+        assert summary.products_count == 4
+        assert summary.total_revenue == 2120.0
+        assert summary.top_products == [
+            {"name": "Product1", "quantity": 10},
+            {"name": "Product4", "quantity": 7},
+            {"name": "Product2", "quantity": 5},
+        ]
+        assert summary.categories == {"A": 11, "B": 5, "C": 7}
+
+
+@pytest.mark.asyncio
+async def test_product_creation_in_batches(setup_test_request, async_session_maker):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+
+    mock_products = [
+        {"name": f"Product{i}", "quantity": i, "price": 1.5 * i, "category": "A"} for i in range(5)
+    ]
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.PRODUCT_BATCH_SIZE", 2), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
+            patch("src.tasks.stream_report", mock_stream_report(make_report_xml("2024-01-01", mock_products))), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        await analyze_report_async(1)
+
+    async with async_session_maker() as async_session:
+        products = await async_session.execute(select(Product).order_by(Product.id))
         products = products.scalars().all()
-        assert len(products) == len(mock_products)
\ No newline at end of file
+        assert [(p.name, p.quantity, p.price) for p in products] == [
+            (p["name"], p["quantity"], p["price"]) for p in mock_products
+        ]
+
+
+@pytest.mark.asyncio
+async def test_analyze_report_broken_report_tail(setup_test_request, async_session_maker):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+
+    mock_products = [
+        {"name": "Product1", "quantity": 10, "price": 100, "category": "A"}
+    ]
+    report_xml = make_report_xml("2024-01-01", mock_products)
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
+            patch("src.tasks.stream_report", mock_stream_report(report_xml[:-20], b"<product><name>")), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")) as mock_claude:
+        await analyze_report_async(1)
+
+        assert mock_request.status == AnalyzeRequest.STATUS_ERROR
+        mock_claude.assert_not_called()
+
+    async with async_session_maker() as async_session:
+        products = await async_session.execute(select(Product))
+        assert products.scalars().all() == []
+
+
+@pytest.mark.asyncio
+async def test_analyze_report_llm_cache(setup_test_request, async_session_maker):
+    mock_products = [
+        {"name": "Product1", "quantity": 10, "price": 100, "category": "A"}
+    ]
+    report_xml = make_report_xml("2024-01-01", mock_products)
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.stream_report", mock_stream_report(report_xml)), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")) as mock_claude:
+        for _ in range(2):
+            mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+            with patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)):
+                await analyze_report_async(1)
+
+            assert mock_request.status == AnalyzeRequest.STATUS_FINISHED
+            assert mock_request.llm_result == "Analysis"
+            llm_cache.clear()
+
+        mock_claude.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_analyze_report_rollups(setup_test_request, async_session_maker):
+    mock_products = [
+        {"name": "Product1", "quantity": 10, "price": 100, "category": "A"},
+        {"name": "Product2", "quantity": 5, "price": 200, "category": "B"},
+    ]
+    report_xml = make_report_xml("2024-01-02", mock_products)
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.stream_report", mock_stream_report(report_xml)), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        # a retry of the same request is not counted twice
+        for _ in range(2):
+            mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+            with patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)):
+                await analyze_report_async(1)
+
+    async with async_session_maker() as async_session:
+        rollups = await async_session.execute(select(SalesRollup).order_by(SalesRollup.period))
+        assert [
+            (r.period, r.period_start, r.reports_count, r.products_count, r.total_revenue) for r in rollups.scalars()
+        ] == [
+            ("day", datetime(2024, 1, 2).date(), 1, 2, 2000.0),
+            ("month", datetime(2024, 1, 1).date(), 1, 2, 2000.0),
+        ]
+
+        categories = await async_session.execute(
+            select(CategoryRollup.category, CategoryRollup.quantity, CategoryRollup.revenue).filter(
+                CategoryRollup.period == SalesRollup.PERIOD_MONTH
+            ).order_by(CategoryRollup.category)
+        )
+        assert categories.all() == [("A", 10, 1000.0), ("B", 5, 1000.0)]
+
+
+@pytest.mark.asyncio
+async def test_analyze_report_duplicate(setup_test_request, async_session_maker):
+    mock_products = [
+        {"name": "Product1", "quantity": 10, "price": 100, "category": "A"}
+    ]
+    report_xml = make_report_xml("2024-01-01", mock_products)
+    async with async_session_maker() as async_session:
+        async_session.add(AnalyzeRequest(id=2, report_url="http://example.com/other.xml"))
+        await async_session.commit()
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.stream_report", mock_stream_report(report_xml)), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")) as mock_claude:
+        await analyze_report_async(1)
+        with patch("src.tasks.insert_products", AsyncMock()) as mock_insert_products:
+            assert await analyze_report_async(2) == 2
+
+        mock_claude.assert_called_once()
+        # the duplicate is found before any product is written
+        mock_insert_products.assert_not_called()
+
+    async with async_session_maker() as async_session:
+        request = await async_session.get(AnalyzeRequest, 2)
+        assert request.status == AnalyzeRequest.STATUS_FINISHED
+        assert request.source_request_id == 1
+        assert request.products_request_id == 1
+        assert request.report_date == datetime(2024, 1, 1).date()
+        assert request.llm_result == "Analysis"
+        assert request.report_hash == hashlib.sha256(report_xml).hexdigest()
+
+    async with async_session_maker() as async_session:
+        products = await async_session.execute(select(Product.request_id))
+        assert products.scalars().all() == [1]
+
+
+@pytest.mark.asyncio
+async def test_analyze_report_not_modified(setup_test_request, async_session_maker):
+    mock_products = [
+        {"name": "Product1", "quantity": 10, "price": 100, "category": "A"}
+    ]
+    report_xml = make_report_xml("2024-01-01", mock_products)
+    async with async_session_maker() as async_session:
+        async_session.add(AnalyzeRequest(id=2, report_url="http://example.com/report"))
+        await async_session.commit()
+
+    requests_headers = []
+
+    async def stream_report(url, headers=None, validators=None):
+        requests_headers.append(headers)
+        if headers:
+            raise ReportNotModified(url)
+        validators.update(etag='"v1"', last_modified=None)
+        yield report_xml
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.stream_report", stream_report), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        await analyze_report_async(1)
+        await analyze_report_async(2)
+
+    assert requests_headers == [None, {"If-None-Match": '"v1"'}]
+    async with async_session_maker() as async_session:
+        request = await async_session.get(AnalyzeRequest, 2)
+        assert request.status == AnalyzeRequest.STATUS_FINISHED
+        assert request.source_request_id == 1
+        assert request.llm_result == "Analysis"
+        assert request.report_hash == hashlib.sha256(report_xml).hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_analyze_report_not_modified_skips_cached_body(setup_test_request, async_session_maker, tmp_path):
+    report_xml = make_report_xml("2024-01-01", [{"name": "Product1", "quantity": 10, "price": 100, "category": "A"}])
+    async with async_session_maker() as async_session:
+        async_session.add(AnalyzeRequest(id=2, report_url="http://example.com/report"))
+        await async_session.commit()
+
+    async def stream_report(url, headers=None, validators=None):
+        if headers:
+            raise ReportNotModified(url)
+        validators.update(etag='"v1"', last_modified=None)
+        yield report_xml
+
+    load = ReportFetch.load
+
+    async def load_cached(session, url):
+        report_fetch = await load(session, url)
+        report_fetch.cache_dir = str(tmp_path)
+        return report_fetch
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.stream_report", stream_report), \
+            patch("src.tasks.ReportFetch.load", load_cached), \
+            patch("src.tasks.insert_products", AsyncMock(wraps=insert_products)) as mock_insert_products, \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        await analyze_report_async(1)
+        await analyze_report_async(2)
+
+    assert os.listdir(tmp_path) == [f"{hashlib.sha256(report_xml).hexdigest()}.xml"]
+    mock_insert_products.assert_called_once()
+    async with async_session_maker() as async_session:
+        request = await async_session.get(AnalyzeRequest, 2)
+        assert request.status == AnalyzeRequest.STATUS_FINISHED
+        assert request.source_request_id == 1
+
+
+@pytest.mark.asyncio
+async def test_analyze_report_llm_batch(setup_test_request, async_session_maker):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None, status=AnalyzeRequest.STATUS_CREATED)
+    mock_products = [
+        {"name": "Product1", "quantity": 10, "price": 100, "category": "A"}
+    ]
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
+            patch("src.tasks.stream_report", mock_stream_report(make_report_xml("2024-01-01", mock_products))), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")) as mock_claude:
+        assert await analyze_report_async(1, llm_batch=True) == 1
+
+        mock_claude.assert_not_called()
+        assert mock_request.status == AnalyzeRequest.STATUS_CREATED
+
+    async with async_session_maker() as async_session:
+        item = await async_session.get(LLMBatchItem, 1)
+        assert "Топ-3 товара по продажам: Product1" in item.prompt
+        assert item.batch_id is None
+
+        products = await async_session.execute(select(Product))
+        assert len(products.scalars().all()) == 1
+
+
+@pytest.mark.asyncio
+async def test_analyze_uploaded_report(async_session_maker, tmp_path):
+    report_path = tmp_path / "report.upload"
+    report_path.write_bytes(gzip.compress(make_report_xml(
+        "2024-01-01", [{"name": "Product1", "quantity": 10, "price": 100, "category": "A"}]
+    )))
+    async with async_session_maker() as session:
+        session.add(AnalyzeRequest(id=1, report_path=str(report_path)))
+        await session.commit()
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.stream_report") as mock_stream_report, \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        assert await analyze_report_async(1) == 1
+
+    mock_stream_report.assert_not_called()
+    assert not report_path.exists()
+    async with async_session_maker() as session:
+        request = await session.get(AnalyzeRequest, 1)
+        assert request.status == AnalyzeRequest.STATUS_FINISHED
+        assert request.report_hash == hashlib.sha256(make_report_xml(
+            "2024-01-01", [{"name": "Product1", "quantity": 10, "price": 100, "category": "A"}]
+        )).hexdigest()
@@ -0,0 +1,19 @@
+from unittest.mock import patch
+from src.tasks import enqueue_analyze_reports
+
+
+def test_enqueue_analyze_reports():
+    with patch("src.tasks.group") as mock_group:
+        enqueue_analyze_reports([1, 2, 3])
+
+    signatures = list(mock_group.call_args[0][0])
+    assert [signature.args for signature in signatures] == [(1,), (2,), (3,)]
+    mock_group.return_value.apply_async.assert_called_once_with()
+
+
+def test_enqueue_analyze_reports_llm_batch():
+    with patch("src.tasks.group") as mock_group:
+        enqueue_analyze_reports([1, 2], llm_batch=True)
+
+    signatures = list(mock_group.call_args[0][0])
+    assert [signature.kwargs for signature in signatures] == [{"llm_batch": True}, {"llm_batch": True}]
@@ -0,0 +1,19 @@
+from unittest.mock import Mock
+from prometheus_client import REGISTRY
+from src.tasks import set_task_published_at, observe_task_queue_wait, observe_task_duration
+
+
+def test_task_queue_wait():
+    headers = {}
+    set_task_published_at(headers=headers)
+    task = Mock()
+    task.name = "tasks.analyze_report"
+    task.request = Mock(get=lambda key: {"published_at": headers["published_at"] - 2}.get(key))
+    waits = REGISTRY.get_sample_value("task_queue_wait_seconds_count", {"task": task.name}) or 0
+
+    observe_task_queue_wait(task_id="1", task=task)
+    observe_task_duration(task_id="1", task=task, state="SUCCESS")
+
+    assert REGISTRY.get_sample_value("task_queue_wait_seconds_count", {"task": task.name}) == waits + 1
+    assert REGISTRY.get_sample_value("task_queue_wait_seconds_sum", {"task": task.name}) >= 2
+    assert REGISTRY.get_sample_value("task_seconds_count", {"task": task.name, "state": "SUCCESS"}) >= 1
@@ -0,0 +1,151 @@
+import gzip
+import os
+import pytest
+from unittest.mock import Mock, patch, AsyncMock
+
+from sqlalchemy import select
+
+from src.tasks import (
+    fetch_report_async, ingest_report_async, analyze_prompt_async, get_analyze_report_signature, llm_cache,
+    fetch_report, ingest_report, analyze_report_prompt, app, ReportDownloadError,
+)
+from src.models import AnalyzeRequest, Product
+from src.config import REPORT_IO_QUEUE, REPORT_CPU_QUEUE
+
+
+@pytest.fixture(autouse=True)
+def clear_llm_cache():
+    llm_cache.clear()
+
+
+REPORT_XML = (
+    b'<sales_data date="2024-01-01"><products>'
+    b'<product><name>Product1</name><quantity>10</quantity><price>100</price><category>A</category></product>'
+    b'<product><name>Product2</name><quantity>5</quantity><price>200</price><category>B</category></product>'
+    b'</products></sales_data>'
+)
+
+
+def mock_stream_report(*chunks: bytes):
+    async def stream_report(url, **kwargs):
+        for chunk in chunks:
+            yield chunk
+    return stream_report
+
+
+@pytest.mark.asyncio
+async def test_staged_pipeline(setup_test_request, async_session_maker, tmp_path):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None, status=AnalyzeRequest.STATUS_CREATED)
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.REPORT_SPOOL_DIR", str(tmp_path)), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
+            patch("src.tasks.stream_report", mock_stream_report(REPORT_XML[:50], REPORT_XML[50:])), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")) as mock_claude:
+        fetched = await fetch_report_async(1)
+        with open(fetched["report_path"], "rb") as report_file:
+            assert report_file.read() == REPORT_XML
+
+        ingested = await ingest_report_async(fetched)
+        assert not os.path.exists(fetched["report_path"])
+        assert "Общая выручка: 2000.0" in ingested["prompt"]
+
+        assert await analyze_prompt_async(ingested) == 1
+
+    mock_claude.assert_called_once_with(ingested["prompt"])
+    assert mock_request.status == AnalyzeRequest.STATUS_FINISHED
+    assert mock_request.llm_result == "Analysis"
+    async with async_session_maker() as session:
+        products = await session.execute(select(Product.name).filter(Product.request_id == 1).order_by(Product.name))
+        assert products.scalars().all() == ["Product1", "Product2"]
+
+
+@pytest.mark.asyncio
+async def test_staged_pipeline_uploaded_report(async_session_maker, tmp_path):
+    report_path = tmp_path / "report.upload"
+    report_path.write_bytes(gzip.compress(REPORT_XML))
+    spool_dir = tmp_path / "spool"
+    async with async_session_maker() as session:
+        session.add(AnalyzeRequest(id=1, report_path=str(report_path)))
+        await session.commit()
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.REPORT_SPOOL_DIR", str(spool_dir)), \
+            patch("src.tasks.get_claude_result", AsyncMock(return_value="Analysis")):
+        fetched = await fetch_report_async(1)
+        # the upload is not copied to the spool
+        assert fetched["report_path"] == str(report_path)
+        assert not spool_dir.exists()
+
+        ingested = await ingest_report_async(fetched)
+        assert await analyze_prompt_async(ingested) == 1
+
+    assert not report_path.exists()
+    async with async_session_maker() as session:
+        request = await session.get(AnalyzeRequest, 1)
+        assert request.status == AnalyzeRequest.STATUS_FINISHED
+
+
+@pytest.mark.asyncio
+async def test_staged_pipeline_download_error(async_session_maker, tmp_path):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+
+    async def stream_report(url, **kwargs):
+        raise ReportDownloadError("Download failed")
+        yield
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.REPORT_SPOOL_DIR", str(tmp_path)), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)), \
+            patch("src.tasks.stream_report", stream_report):
+        fetched = await fetch_report_async(1)
+
+    assert fetched is None
+    assert mock_request.status == AnalyzeRequest.STATUS_ERROR
+    assert os.listdir(tmp_path) == []
+    # the following stages pass the stop through
+    assert await ingest_report_async(fetched) is None
+    assert await analyze_prompt_async(None) is None
+
+
+@pytest.mark.asyncio
+async def test_staged_pipeline_parse_error(setup_test_request, async_session_maker, tmp_path):
+    mock_request = Mock(id=1, report_url="http://example.com/report.xml", report_path=None)
+    report_path = tmp_path / "report.xml"
+    report_path.write_bytes(b"<sales_data date='2024-01-01'><products><product>")
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=mock_request)):
+        ingested = await ingest_report_async(
+            {"request_id": 1, "report_path": str(report_path), "report_hash": "hash", "llm_batch": False}
+        )
+
+    assert ingested is None
+    assert mock_request.status == AnalyzeRequest.STATUS_ERROR
+    assert not report_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_staged_pipeline_deleted_request(async_session_maker, tmp_path):
+    report_path = tmp_path / "report.xml"
+    report_path.write_bytes(REPORT_XML)
+
+    with patch("src.tasks.async_session_maker", async_session_maker), \
+            patch("src.tasks.get_request_by_id", AsyncMock(return_value=None)):
+        ingested = await ingest_report_async(
+            {"request_id": 1, "report_path": str(report_path), "report_hash": "hash", "llm_batch": False}
+        )
+
+    assert ingested is None
+    assert not report_path.exists()
+
+
+def test_get_analyze_report_signature_staged():
+    signature = get_analyze_report_signature(1, llm_batch=True, staged=True)
+
+    assert [task.task for task in signature.tasks] == [fetch_report.name, ingest_report.name, analyze_report_prompt.name]
+    assert signature.tasks[0].args == (1,)
+    assert signature.tasks[0].kwargs == {"llm_batch": True}
+    assert app.conf.task_routes[fetch_report.name] == {"queue": REPORT_IO_QUEUE}
+    assert app.conf.task_routes[ingest_report.name] == {"queue": REPORT_CPU_QUEUE}
+    assert app.conf.task_routes[analyze_report_prompt.name] == {"queue": REPORT_IO_QUEUE}
@@ -0,0 +1,35 @@
+import asyncio
+from unittest.mock import patch, AsyncMock
+import pytest
+from src.tasks import warm_category_ids
+
+
+async def hang(engine):
+    await asyncio.sleep(60)
+
+
+@pytest.mark.asyncio
+async def test_warm_category_ids():
+    with patch("src.tasks.category_ids.warm", AsyncMock()) as mock_warm:
+        await warm_category_ids()
+
+    mock_warm.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_warm_category_ids_timeout():
+    with patch("src.tasks.category_ids.warm", hang), \
+            patch("src.tasks.CATEGORY_WARM_TIMEOUT", 0.01), \
+            patch("src.tasks.logger") as mock_logger:
+        await asyncio.wait_for(warm_category_ids(), 1)
+
+    assert "not loaded on startup" in mock_logger.warning.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_warm_category_ids_error():
+    with patch("src.tasks.category_ids.warm", AsyncMock(side_effect=OSError("connection refused"))), \
+            patch("src.tasks.logger") as mock_logger:
+        await warm_category_ids()
+
+    assert "connection refused" in mock_logger.warning.call_args[0][0]
@@ -0,0 +1,61 @@
+from unittest.mock import patch
+import pytest
+from src.utils import (
+    create_sales_report_parser, get_sales_report_parser_class, SalesReportParser, LxmlSalesReportParser,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_parser_classes():
+    get_sales_report_parser_class.cache_clear()
+    yield
+    get_sales_report_parser_class.cache_clear()
+
+
+def test_configured_parser():
+    with patch('src.utils.REPORT_PARSER', 'lxml'):
+        assert type(create_sales_report_parser()) is LxmlSalesReportParser
+    with patch('src.utils.REPORT_PARSER', 'stdlib'):
+        assert type(create_sales_report_parser()) is SalesReportParser
+
+
+def test_named_parser():
+    with patch('src.utils.REPORT_PARSER', 'lxml'):
+        assert type(create_sales_report_parser('stdlib')) is SalesReportParser
+
+
+def test_fallback_without_lxml():
+    with patch('src.utils.lxml_etree', None), patch('src.utils.logger') as mock_logger:
+        assert type(create_sales_report_parser('lxml')) is SalesReportParser
+        assert type(create_sales_report_parser('lxml')) is SalesReportParser
+
+    mock_logger.warning.assert_called_once()
+
+
+def test_unknown_parser():
+    with pytest.raises(ValueError):
+        create_sales_report_parser('sax')
+
+
+@pytest.mark.parametrize('report', [
+    '<sales_data date="2024-03-15"><meta><products><product><name>Hidden</name><quantity>1</quantity>'
+    '<price>1</price><category>Other</category></product></products></meta><products><note/>'
+    '<product><name>Laptop</name><quantity>10</quantity><price>999.99</price><category>Electronics</category>'
+    '<product><name>Nested</name></product></product></products></sales_data>',
+    '<report date="2024-03-15"></report>',
+    '<root><sales_data date="2024-03-15"><products></products></sales_data></root>',
+    '<!-- no report -->',
+])
+def test_parsers_agree(report):
+    results = []
+    for name in ('stdlib', 'lxml'):
+        parser = create_sales_report_parser(name)
+        with patch('src.utils.logger') as mock_logger:
+            try:
+                products = parser.feed(report) + parser.close()
+                results.append((parser.report_date, products))
+            except Exception as e:
+                results.append(type(e))
+        results.append([call[0][0].split(':')[0] for call in mock_logger.error.call_args_list])
+
+    assert results[:2] == results[2:]
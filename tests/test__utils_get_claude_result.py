@@ -1,7 +1,15 @@
 from unittest.mock import AsyncMock, patch, Mock
 import anthropic
+import httpx
 import pytest
-from src.utils import get_claude_result
+from prometheus_client import REGISTRY
+from src.utils import get_claude_result, get_backoff_delay
+
+
+def make_api_error(error_class, status_code: int, headers: dict | None = None):
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return error_class("API error", response=response, body=None)
 
 
 @pytest.mark.asyncio
@@ -10,12 +18,17 @@ async def test_get_claude_result_success():
     expected_result = "Here is the analysis."
 
     mock_client = AsyncMock()
-    mock_client.messages.create.return_value = Mock(content=[Mock(text=expected_result)])
+    mock_client.messages.create.return_value = Mock(
+        content=[Mock(text=expected_result)], usage=Mock(input_tokens=10, output_tokens=20)
+    )
+
+    input_tokens = REGISTRY.get_sample_value("llm_tokens_total", {"type": "input"}) or 0
 
     with patch("src.utils.client", mock_client):
         result = await get_claude_result(prompt)
 
         assert result == expected_result
+        assert REGISTRY.get_sample_value("llm_tokens_total", {"type": "input"}) == input_tokens + 10
         mock_client.messages.create.assert_called_once_with(
             model="claude-3-haiku-20240307",
             max_tokens=1000,
@@ -44,3 +57,63 @@ async def test_get_claude_result_failure():
 
         assert result is None
         mock_client.messages.create.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_claude_result_retries_rate_limit():
+    mock_client = AsyncMock()
+    mock_client.messages.create.side_effect = [
+        make_api_error(anthropic.RateLimitError, 429, {"retry-after": "7"}),
+        make_api_error(anthropic.InternalServerError, 529),
+        Mock(content=[Mock(text="Here is the analysis.")], usage=Mock(input_tokens=10, output_tokens=20)),
+    ]
+    mock_limiter = Mock(acquire=Mock(side_effect=lambda tokens: AsyncContextManager()), pause=AsyncMock())
+
+    with patch("src.utils.client", mock_client), \
+            patch("src.utils.claude_limiter", mock_limiter), \
+            patch("src.utils.asyncio.sleep", AsyncMock()) as mock_sleep:
+        result = await get_claude_result("Test prompt")
+
+        assert result == "Here is the analysis."
+        assert mock_client.messages.create.call_count == 3
+        mock_limiter.pause.assert_awaited_once_with(7.0)
+        assert mock_sleep.await_args_list[0].args[0] >= 7.0
+
+
+@pytest.mark.asyncio
+async def test_get_claude_result_retries_exhausted():
+    mock_client = AsyncMock()
+    mock_client.messages.create.side_effect = make_api_error(anthropic.InternalServerError, 500)
+
+    with patch("src.utils.client", mock_client), \
+            patch("src.utils.CLAUDE_MAX_RETRIES", 2), \
+            patch("src.utils.asyncio.sleep", AsyncMock()) as mock_sleep:
+        result = await get_claude_result("Test prompt")
+
+        assert result is None
+        assert mock_client.messages.create.call_count == 3
+        assert mock_sleep.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_claude_result_bad_request_is_not_retried():
+    mock_client = AsyncMock()
+    mock_client.messages.create.side_effect = make_api_error(anthropic.BadRequestError, 400)
+
+    with patch("src.utils.client", mock_client):
+        assert await get_claude_result("Test prompt") is None
+        mock_client.messages.create.assert_called_once()
+
+
+def test_get_backoff_delay():
+    for attempt in range(10):
+        assert 0 <= get_backoff_delay(attempt) <= 60
+    assert 5 <= get_backoff_delay(0, retry_after=5) <= 6
+
+
+class AsyncContextManager:
+    async def __aenter__(self):
+        return Mock(usage=None)
+
+    async def __aexit__(self, *args):
+        return False
@@ -0,0 +1,18 @@
+import pytest
+from src.config import HTTP_POOL_LIMIT_PER_HOST
+from src.utils import get_http_session, close_http_session
+
+
+@pytest.mark.asyncio
+async def test_http_session_is_shared():
+    try:
+        session = get_http_session()
+
+        assert get_http_session() is session
+        assert session.connector.limit_per_host == HTTP_POOL_LIMIT_PER_HOST
+    finally:
+        await close_http_session()
+
+    assert session.closed
+    assert get_http_session() is not session
+    await close_http_session()
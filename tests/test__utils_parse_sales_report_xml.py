@@ -1,6 +1,13 @@
 from datetime import datetime
 from unittest.mock import patch
-from src.utils import parse_sales_report_xml
+import pytest
+from src.utils import parse_sales_report_xml, create_sales_report_parser, REPORT_PARSERS
+
+
+@pytest.fixture(autouse=True, params=REPORT_PARSERS)
+def report_parser(request):
+    with patch('src.utils.REPORT_PARSER', request.param):
+        yield request.param
 
 
 def test_successful_parse():
@@ -169,6 +176,35 @@ def test_invalid_product_data():
     assert "Error parsing product" in mock_logger.error.call_args[0][0]
 
 
+@pytest.mark.parametrize("quantity", ["3000000000", "99999999999999999999"])
+def test_quantity_out_of_range(quantity):
+    xml_str = f"""
+    <sales_data date="2024-03-15">
+        <products>
+            <product>
+                <name>Laptop</name>
+                <quantity>{quantity}</quantity>
+                <price>999.99</price>
+                <category>Electronics</category>
+            </product>
+            <product>
+                <name>Mouse</name>
+                <quantity>50</quantity>
+                <price>29.99</price>
+                <category>Accessories</category>
+            </product>
+        </products>
+    </sales_data>
+    """
+
+    with patch('src.utils.logger') as mock_logger:
+        report_date, products = parse_sales_report_xml(xml_str)
+
+    assert products == [{"name": "Mouse", "quantity": 50, "price": 29.99, "category": "Accessories"}]
+    mock_logger.error.assert_called_once()
+    assert "Error parsing product" in mock_logger.error.call_args[0][0]
+
+
 def test_missing_product_fields():
     xml_str = """
     <sales_data date="2024-03-15">
@@ -212,4 +248,24 @@ def test_empty_products():
     assert report_date == datetime(2024, 3, 15)
     assert products == []
     mock_logger.info.assert_called_once()
-    assert "0 products" in mock_logger.info.call_args[0][0]
\ No newline at end of file
+    assert "0 products" in mock_logger.info.call_args[0][0]
+
+
+def test_parser_drops_handled_products():
+    parser = create_sales_report_parser()
+    product = (
+        '<product><name>Laptop</name><quantity>10</quantity><price>999.99</price><category>Electronics</category></product>'
+    )
+
+    with patch('src.utils.logger'):
+        assert parser.feed('<sales_data date="2024-03-15"><products>') == []
+        for _ in range(100):
+            assert len(parser.feed(product)) == 1
+        root, products_elem = parser._path
+
+        assert len(products_elem) == 0
+        parser.feed('</products></sales_data>')
+        parser.close()
+
+    assert len(root) == 0
+    assert parser.products_count == 100
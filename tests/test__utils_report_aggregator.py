@@ -0,0 +1,38 @@
+from src.utils import ReportAggregator
+
+
+def test_report_aggregator():
+    aggregator = ReportAggregator()
+    aggregator.add([
+        {"name": "product1", "quantity": 5, "price": 10.0, "category": "Category1"},
+        {"name": "product2", "quantity": 10, "price": 15.0, "category": "Category2"},
+    ])
+    aggregator.add([
+        {"name": "product3", "quantity": 3, "price": 20.0, "category": "Category1"},
+        {"name": "product4", "quantity": 8, "price": 5.0, "category": "Category3"},
+    ])
+
+    assert aggregator.total_revenue == (10.0 * 5) + (15.0 * 10) + (20.0 * 3) + (5.0 * 8)
+    assert aggregator.top_products == ["product2", "product4", "product1"]
+    assert aggregator.categories == {"Category1": 8, "Category2": 10, "Category3": 8}
+    assert aggregator.category_revenue == {"Category1": 110.0, "Category2": 150.0, "Category3": 40.0}
+    assert aggregator.products_count == 4
+
+
+def test_report_aggregator_top_ties():
+    aggregator = ReportAggregator(top_size=2)
+    aggregator.add([
+        {"name": "first", "quantity": 1, "price": 1.0, "category": "A"},
+        {"name": "second", "quantity": 1, "price": 1.0, "category": "A"},
+        {"name": "third", "quantity": 1, "price": 1.0, "category": "A"},
+    ])
+
+    assert aggregator.top_products == ["first", "second"]
+
+
+def test_report_aggregator_empty():
+    aggregator = ReportAggregator()
+
+    assert aggregator.total_revenue == 0.0
+    assert aggregator.top_products == []
+    assert aggregator.categories == {}
@@ -0,0 +1,195 @@
+import gzip
+from unittest.mock import patch, Mock
+import pytest
+from aiohttp import ClientError, web
+from aiohttp.test_utils import make_mocked_coro, TestServer
+from backports import zstd
+from src.utils import (
+    stream_report,
+    close_http_session,
+    parse_sales_report_stream,
+    SalesReportParser,
+    ReportDownloadError,
+    ReportNotModified,
+)
+
+
+def mock_http_session(status: int, chunks: list[bytes], content_length: int | None = None):
+    async def iter_chunked(size):
+        for chunk in chunks:
+            yield chunk
+
+    response = Mock()
+    response.status = status
+    response.reason = "Reason"
+    response.content_length = content_length
+    response.headers = {"ETag": '"v1"'}
+    response.content.iter_chunked = iter_chunked
+
+    context_manager = Mock()
+    context_manager.__aenter__ = make_mocked_coro(return_value=response)
+    context_manager.__aexit__ = make_mocked_coro(return_value=None)
+
+    session = Mock()
+    session.get = Mock(return_value=context_manager)
+    return session
+
+
+@pytest.mark.asyncio
+async def test_successful_stream():
+    session = mock_http_session(200, [b"<sales_", b"data/>"])
+
+    with patch('src.utils.get_http_session', return_value=session):
+        chunks = [chunk async for chunk in stream_report("http://example.com/report")]
+
+    assert chunks == [b"<sales_", b"data/>"]
+
+
+@pytest.mark.asyncio
+async def test_conditional_stream():
+    session = mock_http_session(200, [b"<sales_data/>"])
+    validators = {}
+
+    with patch('src.utils.get_http_session', return_value=session):
+        chunks = [chunk async for chunk in stream_report(
+            "http://example.com/report", headers={"If-None-Match": '"v0"'}, validators=validators
+        )]
+
+    assert chunks == [b"<sales_data/>"]
+    assert session.get.call_args.kwargs["headers"] == {"If-None-Match": '"v0"'}
+    assert validators == {"etag": '"v1"', "last_modified": None}
+
+
+@pytest.mark.asyncio
+async def test_not_modified():
+    session = mock_http_session(304, [])
+
+    with patch('src.utils.get_http_session', return_value=session):
+        with pytest.raises(ReportNotModified):
+            async for _ in stream_report("http://example.com/report", headers={"If-None-Match": '"v1"'}):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_failed_status_code():
+    session = mock_http_session(404, [])
+
+    with patch('src.utils.get_http_session', return_value=session):
+        with patch('src.utils.logger') as mock_logger:
+            with pytest.raises(ReportDownloadError):
+                async for _ in stream_report("http://example.com/report"):
+                    pass
+
+    mock_logger.warning.assert_called_once()
+    assert "404" in mock_logger.warning.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_declared_size_exceeds_limit():
+    session = mock_http_session(200, [b"data"], content_length=100)
+
+    with patch('src.utils.get_http_session', return_value=session):
+        with patch('src.utils.logger'):
+            with pytest.raises(ReportDownloadError):
+                async for _ in stream_report("http://example.com/report", max_size=10):
+                    pass
+
+
+@pytest.mark.asyncio
+async def test_streamed_size_exceeds_limit():
+    session = mock_http_session(200, [b"12345", b"67890", b"1"])
+
+    chunks = []
+    with patch('src.utils.get_http_session', return_value=session):
+        with patch('src.utils.logger'):
+            with pytest.raises(ReportDownloadError):
+                async for chunk in stream_report("http://example.com/report", max_size=10):
+                    chunks.append(chunk)
+
+    assert chunks == [b"12345", b"67890"]
+
+
+@pytest.mark.asyncio
+async def test_compressed_stream():
+    report = b'<sales_data date="2024-01-01"><products>' + b"<product/>" * 10000 + b"</products></sales_data>"
+    accept_encodings = []
+
+    async def encoded_report(request: web.Request) -> web.Response:
+        accept_encodings.append(request.headers["Accept-Encoding"])
+        return web.Response(body=zstd.compress(report), headers={"Content-Encoding": "zstd"})
+
+    async def gzip_report(request: web.Request) -> web.Response:
+        return web.Response(body=gzip.compress(report), content_type="application/gzip")
+
+    app = web.Application()
+    app.router.add_get("/report.xml", encoded_report)
+    app.router.add_get("/report.xml.gz", gzip_report)
+    async with TestServer(app) as server:
+        for path in ("/report.xml", "/report.xml.gz"):
+            chunks = [chunk async for chunk in stream_report(str(server.make_url(path)))]
+            assert b"".join(chunks) == report
+        await close_http_session()
+
+    assert "zstd" in accept_encodings[0]
+
+
+@pytest.mark.asyncio
+async def test_decompressed_size_exceeds_limit():
+    session = mock_http_session(200, [gzip.compress(b"0" * 1000)])
+
+    with patch('src.utils.get_http_session', return_value=session):
+        with patch('src.utils.logger'):
+            with pytest.raises(ReportDownloadError):
+                async for _ in stream_report("http://example.com/report.xml.gz", max_size=100):
+                    pass
+
+
+@pytest.mark.asyncio
+async def test_broken_compressed_stream():
+    session = mock_http_session(200, [gzip.compress(b"0" * 1000)[:20]])
+
+    with patch('src.utils.get_http_session', return_value=session):
+        with patch('src.utils.logger') as mock_logger:
+            with pytest.raises(ReportDownloadError):
+                async for _ in stream_report("http://example.com/report.xml.gz"):
+                    pass
+
+    assert "decompressing" in mock_logger.error.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_network_error():
+    session = Mock()
+    session.get = Mock(side_effect=ClientError("Network error occurred"))
+
+    with patch('src.utils.get_http_session', return_value=session):
+        with patch('src.utils.logger') as mock_logger:
+            with pytest.raises(ReportDownloadError):
+                async for _ in stream_report("http://example.com/report"):
+                    pass
+
+    mock_logger.error.assert_called_once()
+    assert "Network error" in mock_logger.error.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_parse_sales_report_stream():
+    report = (
+        '<?xml version="1.0" encoding="UTF-8"?><sales_data date="2024-03-15"><products>'
+        '<product><name>Ноутбук</name><quantity>10</quantity><price>999.99</price><category>Electronics</category></product>'
+        '<product><name>Mouse</name><quantity>50</quantity><price>29.99</price><category>Accessories</category></product>'
+        '</products></sales_data>'
+    ).encode()
+
+    async def chunks():
+        # split inside a multibyte character, the parser has to handle it
+        split = report.index("Ноутбук".encode()) + 1
+        yield report[:split]
+        yield report[split:]
+
+    parser = SalesReportParser()
+    with patch('src.utils.logger'):
+        products = [product async for batch in parse_sales_report_stream(chunks(), parser) for product in batch]
+
+    assert parser.report_date.isoformat() == "2024-03-15T00:00:00"
+    assert [product["name"] for product in products] == ["Ноутбук", "Mouse"]